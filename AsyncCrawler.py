@@ -0,0 +1,125 @@
+'''
+AsyncCrawler is the asyncio crawl mode of WebCrawler.
+Instead of NUM_THREADS threads that each block on one
+download, a single event loop keeps up to `concurrency`
+downloads in flight. Parsing and the MongoDB writes are
+blocking, so they are handed to a small thread pool and
+the loop can keep downloading while they run.
+
+The frontier is the same Link/depth queue and the pages
+are stored in the same collections as the threaded mode.
+'''
+from AsyncFetcher import AsyncFetcher
+from WebScraper import WebScraper
+from Link import Link
+from RetryPolicy import RetryPolicy
+from URLCanonicalizer import URLCanonicalizer
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+
+class AsyncCrawler(object):
+
+    def __init__(self, crawler, concurrency=200, storeThreads=4):
+        '''
+        Args:
+            crawler(WebCrawler): crawler whose collections are written to
+            concurrency(int): number of downloads in flight at once
+            storeThreads(int): threads used for parsing and MongoDB writes
+        '''
+        self.crawler = crawler
+        self.concurrency = concurrency
+        self.storeThreads = storeThreads
+        self.fetcher = AsyncFetcher(maxBytes=WebScraper.MAX_PAGE_BYTES, metrics=crawler.metrics)
+        self.crawlCount = 0
+        self.dontCrawl = crawler.newSeenSet()
+
+
+    def crawl(self, url, depth):
+        '''Crawls url to depth and returns
+        the number of pages crawled.
+
+        Args:
+            url(str): starting url to crawl
+            depth(int): depth at which to stop crawling
+        '''
+        self.crawlCount = 0
+        self.dontCrawl = self.crawler.newSeenSet()
+        self.fetcher.peak = 0
+        asyncio.run(self.run(url, depth))
+        self.crawler.recordPeak(self.fetcher.peak)
+        return self.crawlCount
+
+
+    async def run(self, url, depth):
+        q = asyncio.Queue()
+        q.put_nowait(Link(url, depth))
+        self.crawler.metrics.watch(q.qsize, lambda: self.concurrency)
+        with ThreadPoolExecutor(self.storeThreads) as executor:
+            tasks = [asyncio.ensure_future(self.worker(q, executor))
+                     for _ in range(self.concurrency)]
+            #every link that was put has been crawled
+            await q.join()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+    async def worker(self, q, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            link = await q.get()
+            start = time.perf_counter()
+            try:
+                url = link.getURL()
+                depth = link.getDepth()
+                #the loop is single threaded, so the set is never contended
+                if self.dontCrawl.add(URLCanonicalizer.key(url)):
+                    continue
+                #once the budget ran out the links left are dropped
+                if not self.crawler.budget.claim():
+                    continue
+                try:
+                    html, encoding = await self.fetcher.fetch(url)
+                except Exception as e:
+                    self.crawler.budget.release()
+                    await loop.run_in_executor(executor, self.crawler.insertError,
+                                               url, str(e), self.crawler.errors, RetryPolicy.classify(e))
+                    continue
+                self.crawler.budget.charge(len(html))
+                try:
+                    links = await loop.run_in_executor(executor, self.storePage, url, depth, html, encoding)
+                except Exception as e:
+                    #a page the storage could not take is failed, and
+                    #the worker goes on with the next link
+                    self.crawler.budget.release()
+                    await loop.run_in_executor(executor, self.crawler.insertError,
+                                               url, str(e), self.crawler.errors, RetryPolicy.classify(e))
+                    continue
+                if links is None:
+                    self.crawler.budget.release()
+                else:
+                    self.crawlCount = self.crawlCount + 1
+                    for link in links:
+                        q.put_nowait(Link(link, depth - 1))
+            finally:
+                q.task_done()
+                #a worker is busy from taking a link until it is done
+                self.crawler.metrics.record("page", time.perf_counter() - start)
+
+
+    def storePage(self, url, depth, html, encoding=None):
+        '''Parses a downloaded page and stores it. Runs
+        on the thread pool. Returns the links to queue,
+        or None if the page could not be parsed.
+        '''
+        scraper = WebScraper(url, html, encoding=encoding)
+        if scraper.error:
+            self.crawler.insertError(url, scraper.getErrorMessage(), self.crawler.errors, scraper.errorKind)
+            return None
+        #the links are stored for PageRank even past the last depth
+        links = set(scraper.crawlLinks())
+        self.crawler.storePage(url, scraper.crawlText(), self.crawler.urlsCrawled, links=links)
+        if depth > 0:
+            return links
+        return set()
@@ -0,0 +1,213 @@
+'''
+AsyncFetcher downloads webpages on an asyncio event loop.
+It speaks just enough HTTP/1.1 to get a page body: it
+follows redirects, understands chunked responses, decodes
+bodies with the same size and time limits as WebScraper and
+applies the same Content-Type check.
+Because every request is a coroutine, hundreds of pages
+can be in flight at once on a single thread.
+
+If a CrawlMetrics is given, the DNS lookup, connect, time to
+the first byte, download and decode of every request and the
+whole fetch per host are recorded.
+'''
+from BodyDecoder import BodyDecoder
+from ConnectionPool import HTTPError
+import asyncio
+import socket
+import ssl
+import time
+import urllib.parse
+from email.parser import BytesHeaderParser
+
+class AsyncFetcher(object):
+
+    MAX_REDIRECTS = 5
+
+    #most raw bytes read at once
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(self, timeout=10, maxBytes=10 * 1024 * 1024, metrics=None):
+        '''Creates a fetcher whose requests give up
+        after timeout seconds.
+
+        Args:
+            timeout(float): seconds allowed for a whole request
+            maxBytes(int): most decoded bytes of a page
+            metrics(CrawlMetrics): where request timings are recorded, or None
+        '''
+        self.timeout = timeout
+        self.maxBytes = maxBytes
+        self.metrics = metrics
+        self.sslContext = ssl.create_default_context()
+        #most body bytes one page held at once
+        self.peak = 0
+
+
+    async def fetch(self, url):
+        '''Downloads url and returns the decoded body
+        of the page and the charset its Content-Type named.
+        An exception is raised if the page can not be
+        downloaded, is not text/html or can not be decoded.
+
+        Args:
+            url(str): url of the page to download
+        '''
+        if self.metrics is None:
+            return await asyncio.wait_for(self._fetch(url), self.timeout)
+        start = time.perf_counter()
+        body, charset = await asyncio.wait_for(self._fetch(url), self.timeout)
+        self.metrics.record("fetch", time.perf_counter() - start, urllib.parse.urlsplit(url).hostname)
+        self.metrics.count("bytes", len(body))
+        return body, charset
+
+
+    async def _fetch(self, url):
+        for _ in range(self.MAX_REDIRECTS + 1):
+            status, reason, headers, body = await self.request(url)
+            location = headers.get("Location")
+            if status in (301, 302, 303, 307, 308) and location:
+                url = urllib.parse.urljoin(url, location)
+                continue
+            if status >= 400:
+                raise HTTPError(status, reason, headers.get("Retry-After"))
+            if headers.get_content_type() != "text/html":
+                raise Exception("URL is of Content-Type", headers.get_content_type())
+            return body, headers.get_content_charset()
+        raise Exception("Too many redirects")
+
+
+    async def request(self, url):
+        '''Sends a GET request for url and reads the whole
+        response. Returns the status code, reason, headers
+        and decoded body. The body of redirects, errors and
+        pages that are not text/html is not read.
+
+        Args:
+            url(str): url to request
+        '''
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise Exception("Unknown url type: %s" % url)
+        https = parts.scheme == "https"
+        port = parts.port or (443 if https else 80)
+        path = parts.path or "/"
+        if parts.query:
+            path = path + "?" + parts.query
+
+        reader, writer = await self.connect(parts.hostname, port, https)
+        metrics = self.metrics
+        try:
+            start = time.perf_counter()
+            writer.write(("GET %s HTTP/1.1\r\n"
+                          "Host: %s\r\n"
+                          "User-Agent: Mozilla/5.0\r\n"
+                          "Accept-Encoding: %s\r\n"
+                          "Connection: close\r\n\r\n" % (path, parts.netloc, BodyDecoder.accepted())).encode("ascii"))
+            await writer.drain()
+
+            statusLine = await reader.readline()
+            version, status, reason = (statusLine.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+            if not version.startswith("HTTP/"):
+                raise Exception("Bad status line: %r" % statusLine)
+            headers = BytesHeaderParser().parsebytes(await reader.readuntil(b"\r\n\r\n"))
+            if metrics is not None:
+                metrics.record("ttfb", time.perf_counter() - start)
+            if int(status) >= 300 or headers.get_content_type() != "text/html":
+                return int(status), reason, headers, b""
+
+            decoder = BodyDecoder(headers.get("Content-Encoding"), self.maxBytes, self.timeout)
+            if headers.get("Transfer-Encoding", "").lower() == "chunked":
+                raw = self.readChunked(reader)
+            else:
+                raw = self.readRaw(reader, headers.get("Content-Length"))
+            pieces = []
+            if metrics is None:
+                async for data in raw:
+                    pieces.extend(decoder.decode(data))
+                pieces.extend(decoder.flush())
+            else:
+                #the time between chunks is spent downloading
+                decodeSeconds = 0.0
+                start = time.perf_counter()
+                async for data in raw:
+                    decoding = time.perf_counter()
+                    pieces.extend(decoder.decode(data))
+                    decodeSeconds = decodeSeconds + time.perf_counter() - decoding
+                decoding = time.perf_counter()
+                pieces.extend(decoder.flush())
+                end = time.perf_counter()
+                decodeSeconds = decodeSeconds + end - decoding
+                metrics.record("download", end - start - decodeSeconds)
+                metrics.record("decode", decodeSeconds)
+            body = b"".join(pieces)
+            #the pieces and the joined body are both held once
+            self.peak = max(self.peak, decoder.peak, 2 * len(body))
+            return int(status), reason, headers, body
+        finally:
+            writer.close()
+
+
+    async def connect(self, host, port, https):
+        '''Opens a connection and returns its reader and
+        writer. With metrics the DNS lookup and the connect
+        (with the TLS handshake) are timed separately.
+        '''
+        context = self.sslContext if https else None
+        if self.metrics is None:
+            return await asyncio.open_connection(host, port, ssl=context)
+        start = time.perf_counter()
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        resolved = time.perf_counter()
+        self.metrics.record("dns", resolved - start)
+        error = None
+        #try the addresses in order like open_connection does
+        for family, kind, proto, name, sockaddr in addresses:
+            try:
+                connection = await asyncio.open_connection(sockaddr[0], port, ssl=context,
+                                                           server_hostname=host if https else None)
+                self.metrics.record("connect", time.perf_counter() - resolved)
+                return connection
+            except OSError as e:
+                error = e
+        raise error
+
+
+    async def readRaw(self, reader, length):
+        '''Yields the raw body CHUNK_SIZE bytes at a time,
+        up to Content-Length or the end of the stream.
+
+        Args:
+            reader(asyncio.StreamReader): stream positioned at the body
+            length(str): Content-Length of the response, or None
+        '''
+        remaining = int(length) if length is not None else None
+        while remaining is None or remaining > 0:
+            size = self.CHUNK_SIZE if remaining is None else min(self.CHUNK_SIZE, remaining)
+            data = await reader.read(size)
+            if not data:
+                return
+            if remaining is not None:
+                remaining = remaining - len(data)
+            yield data
+
+
+    async def readChunked(self, reader):
+        '''Yields the raw pieces of a body that was sent
+        with Transfer-Encoding: chunked.
+
+        Args:
+            reader(asyncio.StreamReader): stream positioned at the first chunk
+        '''
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                #skip any trailers up to the blank line
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            while size > 0:
+                data = await reader.readexactly(min(size, self.CHUNK_SIZE))
+                size = size - len(data)
+                yield data
+            await reader.readline()
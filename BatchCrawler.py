@@ -0,0 +1,186 @@
+'''
+BatchCrawler crawls a list of seeds, the starting urls of many
+crawls, without the menu of Driver.py, for example from a nightly
+job. Crawling them with one crawlURL after another would start
+and stop a pool of workers per seed and wait for the slowest page
+of each one before the next could start. Here every seed is
+queued into one threads mode crawl at once (WebCrawler.crawlSeeds),
+so one pool of workers and one set of crawled urls serve the whole
+list and the workers stay busy until the last seed is done. A page
+found from several seeds is crawled once and counted for the seed
+it was found from first.
+
+Seeds are read from a file, or from stdin if it is "-" or not
+given, one per line as "url [depth]". Blank lines and lines
+starting with # are skipped, seeds without a depth get --depth.
+
+Usage: python BatchCrawler.py [seeds] [--depth n] [options]
+       python BatchCrawler.py --help
+
+stdout gets one JSON object per line, so other programs can follow
+the crawl; everything else the crawler prints goes to stderr:
+
+    {"event": "start", "seeds": 2}
+    {"event": "progress", "elapsed": 1.0, "pages": 42, "errors": 1, ...}
+    {"event": "seed", "seed": 0, "url": "http://a.com/", "depth": 2, "crawled": 40, "errors": 1}
+    {"event": "seed", "seed": 1, "url": "ftp://b.com/", "depth": 1, "error": "not an http or https url"}
+    {"event": "done", "seeds": 2, "crawled": 40, "errors": 1, "executionTime": 1.5, ...}
+
+The seed lines come once the crawl is over, in the order of the
+seeds. On Ctrl-C an "interrupted" line is written instead and the
+batch can be continued with --resume and the same seeds.
+'''
+from CrawlBudget import CrawlBudget
+from URLCanonicalizer import URLCanonicalizer
+import argparse
+import contextlib
+import json
+import sys
+import threading
+
+class BatchCrawler(object):
+
+    #fields of a metrics snapshot written in a progress line
+    PROGRESS_FIELDS = ("elapsed", "pages", "errors", "retries", "bytes", "pagesPerSecond", "queue", "workers")
+
+    def __init__(self, crawler, out=None, interval=1.0):
+        '''
+        Args:
+            crawler(WebCrawler): crawler the seeds are crawled with
+            out(file): where the JSON lines go, sys.stdout if None
+            interval(float): seconds between progress lines
+        '''
+        self.crawler = crawler
+        self.out = out or sys.stdout
+        self.interval = interval
+        self.lock = threading.Lock()
+
+
+    @staticmethod
+    def readSeeds(lines, depth):
+        '''Returns the (url, depth) of every seed in lines.
+        Raises ValueError for a line that is not "url [depth]".
+
+        Args:
+            lines(iterable): lines of a seeds file
+            depth(int): depth of seeds that do not give one
+        '''
+        seeds = []
+        for number, line in enumerate(lines, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) > 2 or (len(fields) == 2 and not fields[1].isdigit()):
+                raise ValueError("line %d: expected \"url [depth]\", got %r" % (number, line.strip()))
+            seeds.append((fields[0], int(fields[1]) if len(fields) == 2 else depth))
+        return seeds
+
+
+    def emit(self, event, **fields):
+        '''Writes one JSON line.'''
+        record = {"event": event}
+        record.update(fields)
+        line = json.dumps(record)
+        with self.lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+
+    def crawl(self, seeds, resume=False, budget=None):
+        '''Crawls the seeds as one crawl, writing progress
+        lines while it runs and a line per seed at the end.
+        Returns the stats record of the crawl.
+
+        Args:
+            seeds(list): (url, depth) of every seed
+            resume(bool): continue the batch that was interrupted
+            budget(CrawlBudget): most pages, bytes and seconds for
+                the whole batch, None for no limit
+        '''
+        crawler = self.crawler
+        #index in seeds of every seed that is crawled
+        valid = [index for index, (url, depth) in enumerate(seeds)
+                 if URLCanonicalizer.canonicalize(url) is not None]
+        self.emit("start", seeds=len(seeds))
+        stopped = threading.Event()
+        def progress():
+            while not stopped.wait(self.interval):
+                #current gauges, not the sampler's last ones
+                crawler.metrics.sample()
+                snapshot = crawler.metrics.snapshot()
+                self.emit("progress", **{name: snapshot[name] for name in self.PROGRESS_FIELDS})
+        reporter = threading.Thread(target=progress, daemon=True)
+        reporter.start()
+        try:
+            record = crawler.crawlSeeds([seeds[index] for index in valid], resume, budget)
+        except KeyboardInterrupt:
+            self.emit("interrupted", crawled=sum(counts[0] for counts in crawler.seedCounts))
+            raise
+        finally:
+            stopped.set()
+            reporter.join()
+
+        counts = dict(zip(valid, crawler.seedCounts))
+        for index, (url, depth) in enumerate(seeds):
+            if index in counts:
+                self.emit("seed", seed=index, url=url, depth=depth,
+                          crawled=counts[index][0], errors=counts[index][1])
+            else:
+                self.emit("seed", seed=index, url=url, depth=depth, error="not an http or https url")
+        self.emit("done", seeds=len(seeds),
+                  crawled=record["crawlCount"],
+                  errors=sum(failed for crawled, failed in crawler.seedCounts),
+                  unchanged=record["unchangedCount"],
+                  executionTime=record["executionTime"],
+                  pagesPerSecond=round(record["crawlCount"] / record["executionTime"], 3)
+                                 if record["executionTime"] else 0.0,
+                  workers=record["threadCount"],
+                  budgetReached=record["budgetReached"])
+        return record
+
+
+if __name__ == "__main__":
+    from WebCrawler import WebCrawler
+    parser = argparse.ArgumentParser(description="Crawls a list of seeds with one pool of workers.")
+    parser.add_argument("seeds", nargs="?", default="-", help="file of \"url [depth]\" lines, - for stdin")
+    parser.add_argument("--depth", type=int, default=1, help="depth of seeds that do not give one")
+    parser.add_argument("--threads", type=int, default=WebCrawler.NUM_THREADS, help="workers to start with")
+    parser.add_argument("--max-threads", type=int, default=WebCrawler.MAX_THREADS, help="most workers at once")
+    parser.add_argument("--resume", action="store_true", help="continue the batch that was interrupted")
+    parser.add_argument("--max-pages", type=int, default=None, help="most pages for the whole batch")
+    parser.add_argument("--max-mb", type=float, default=None, help="most MB downloaded for the whole batch")
+    parser.add_argument("--max-seconds", type=float, default=None, help="most seconds for the whole batch")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between progress lines")
+    parser.add_argument("--storage", choices=("mongo", "sqlite"), default=WebCrawler.STORAGE)
+    parser.add_argument("--path", default=WebCrawler.SQLITE_PATH, help="the SQLite file")
+    parser.add_argument("--mongo-uri", default=WebCrawler.MONGO_URI, help="the MongoDB")
+    args = parser.parse_args()
+
+    if args.seeds == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.seeds) as f:
+            lines = f.readlines()
+    try:
+        seeds = BatchCrawler.readSeeds(lines, args.depth)
+    except ValueError as e:
+        parser.error(str(e))
+    budget = CrawlBudget(args.max_pages,
+                         int(args.max_mb * 1024 * 1024) if args.max_mb is not None else None,
+                         args.max_seconds)
+
+    WebCrawler.STORAGE = args.storage
+    WebCrawler.SQLITE_PATH = args.path
+    WebCrawler.MONGO_URI = args.mongo_uri
+    WebCrawler.NUM_THREADS = args.threads
+    WebCrawler.MAX_THREADS = args.max_threads
+    out = sys.stdout
+    #only the JSON lines go to stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        crawler = WebCrawler()
+        try:
+            BatchCrawler(crawler, out, args.interval).crawl(seeds, args.resume, budget)
+        except KeyboardInterrupt:
+            sys.exit(130)
+        finally:
+            crawler.close()
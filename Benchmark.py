@@ -0,0 +1,425 @@
+'''
+Benchmark compares the crawl modes of WebCrawler against
+a local HTTP stand-in, so the numbers do not depend on the
+network or on someone else's website. The databases are deleted
+before every crawl, so use a MongoDB just for benchmarking, or
+--storage sqlite, which needs no mongod.
+
+The stand-in site is generated from a seed, so every run crawls
+the same site. Page n links to page n*fanout+1 and, in a "tree"
+site, to the rest of n*fanout+1 through n*fanout+fanout; in a
+"random" site the other links go to pages picked at random, so
+pages are linked from many others. Pages are padded with words
+to pageSize bytes, and errorRate of them answer 503 (and are not
+retried, so the modes stay comparable). The server
+sleeps `latency` seconds before every response to imitate a
+remote host. Every page has an ETag and conditional requests for
+it are answered with 304, so the cost of crawling the same site
+again is measured too. Pages are sent gzipped to clients that
+accept it. With hosts above 1 the site is served on that many
+local ports and page n links to its children on the port of
+host child % hosts, so a distributed crawl has hosts to divide.
+
+Every mode and worker count is crawled `repeats` times and the
+median crawl is kept. The results can be saved as a baseline
+and later runs compared with it: a pages/sec more than threshold
+below the baseline is a regression and the exit status is 1.
+Baselines only compare with runs on the same machine and with
+the same settings.
+
+Usage: python Benchmark.py [pages] [fanout] [latency] [options]
+       python Benchmark.py --help
+'''
+from WebCrawler import WebCrawler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import gzip
+import json
+import random
+import string
+import threading
+import time
+import sys
+
+class Benchmark(object):
+
+    #words the pages are padded with, enough that padded pages
+    #are not near duplicates of each other
+    VOCABULARY = 5000
+    #threads of every process in distributed mode
+    PROCESS_THREADS = 4
+
+    def __init__(self, pages=200, fanout=5, latency=0.05, pageSize=0, errorRate=0.0,
+                 graph="tree", seed=1, storage=None, hosts=1):
+        '''
+        Args:
+            pages(int): number of pages on the stand-in site
+            fanout(int): number of links on every page
+            latency(float): seconds the server waits before responding
+            pageSize(int): bytes every page is padded to, 0 for no padding
+            errorRate(float): share of the pages that answer 503
+            graph(str): "tree" or "random", how pages link to each other
+            seed(int): seed of the generated site
+            storage(str): WebCrawler.STORAGE of the crawls, None for the default
+            hosts(int): local ports the site is served on
+        '''
+        self.pages = pages
+        self.fanout = fanout
+        self.latency = latency
+        self.pageSize = pageSize
+        self.errorRate = errorRate
+        self.graph = graph
+        self.seed = seed
+        self.storage = storage
+        self.hosts = hosts
+        self.servers = []
+        self.bytesSent = 0
+        self.lock = threading.Lock()
+        self.generate()
+
+
+    def generate(self):
+        '''Generates the links of every page and the pages
+        that fail, from the seed.
+        '''
+        rng = random.Random(self.seed)
+        self.vocabulary = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+                           for _ in range(self.VOCABULARY)]
+        self.links = []
+        for n in range(self.pages):
+            children = [(n * self.fanout + i) % self.pages for i in range(1, self.fanout + 1)]
+            if self.graph == "random":
+                #the first link keeps every page reachable
+                children = children[:1] + [rng.randrange(self.pages) for _ in range(self.fanout - 1)]
+            self.links.append(children)
+        #the start page always answers
+        self.broken = set(n for n in range(1, self.pages) if rng.random() < self.errorRate)
+        self.bodies = {}
+
+
+    def settings(self):
+        '''Returns the settings the results depend on.'''
+        settings = {"pages": self.pages, "fanout": self.fanout, "latency": self.latency,
+                    "pageSize": self.pageSize, "errorRate": self.errorRate,
+                    "graph": self.graph, "seed": self.seed}
+        #baselines saved before there were hosts had one
+        if self.hosts != 1:
+            settings["hosts"] = self.hosts
+        return settings
+
+
+    def href(self, n):
+        '''Returns the link to page n.'''
+        if self.hosts == 1:
+            return "/page%d.html" % n
+        return "http://127.0.0.1:%d/page%d.html" % (self.servers[n % self.hosts].server_address[1], n)
+
+
+    def page(self, n):
+        '''Returns the html of page n of the stand-in site.'''
+        links = "".join('<a href="%s">page %d</a>\n' % (self.href(child), child) for child in self.links[n])
+        html = ("<html><head><title>Page %d</title></head><body>\n"
+                "<p>This is benchmark page number %d of the local test site.</p>\n"
+                "%s" % (n, n, links))
+        end = "</body></html>"
+        padding = self.pageSize - len(html) - len(end) - len("<p></p>\n")
+        if padding > 0:
+            rng = random.Random(self.seed * 1000003 + n)
+            words = []
+            size = 0
+            while size < padding:
+                word = rng.choice(self.vocabulary)
+                words.append(word)
+                size = size + len(word) + 1
+            html = html + "<p>" + " ".join(words)[:padding] + "</p>\n"
+        return (html + end).encode("utf-8")
+
+
+    def body(self, n, compressed):
+        '''Returns the body of page n, generated once so the
+        server costs the crawler as little as possible.
+        '''
+        key = (n, compressed)
+        body = self.bodies.get(key)
+        if body is None:
+            body = self.page(n)
+            if compressed:
+                body = gzip.compress(body)
+            self.bodies[key] = body
+        return body
+
+
+    def expected(self, depth):
+        '''Returns the number of pages a crawl to depth
+        stores, those within depth links of page 0 through
+        pages that do not fail.
+        '''
+        seen = {0}
+        level = [0]
+        crawled = 1
+        for _ in range(depth):
+            following = []
+            for n in level:
+                for child in self.links[n]:
+                    if child not in seen:
+                        seen.add(child)
+                        if child not in self.broken:
+                            crawled = crawled + 1
+                            following.append(child)
+            level = following
+        return crawled
+
+
+    def start(self):
+        '''Starts the stand-in site on free local ports
+        and returns the url of its first page.
+        '''
+        benchmark = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            #headers and body are sent separately, so Nagle would
+            #stall every keep-alive response
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                time.sleep(benchmark.latency)
+                try:
+                    n = int(self.path.strip("/").replace("page", "").replace(".html", "") or 0)
+                except ValueError:
+                    n = -1
+                if not 0 <= n < benchmark.pages:
+                    self.send_error(404)
+                    return
+                if n in benchmark.broken:
+                    self.send_error(503)
+                    return
+                etag = '"page%d"' % n
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                compressed = "gzip" in self.headers.get("Accept-Encoding", "")
+                body = benchmark.body(n, compressed)
+                self.send_response(200)
+                if compressed:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+                with benchmark.lock:
+                    benchmark.bytesSent = benchmark.bytesSent + len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            #the default backlog of 5 drops connections when
+            #hundreds of requests arrive at once
+            request_queue_size = 1024
+
+        self.servers = []
+        for _ in range(self.hosts):
+            server = Server(("127.0.0.1", 0), Handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+        #the links depend on the ports
+        self.bodies = {}
+        #page 0 by name, so links back to it are not a second url
+        return "http://127.0.0.1:%d/page0.html" % self.servers[0].server_address[1]
+
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+
+    def crawler(self):
+        if self.storage is not None:
+            WebCrawler.STORAGE = self.storage
+        crawler = WebCrawler()
+        #the broken pages always answer 503, and only threads
+        #mode retries, so every mode fails them once
+        crawler.RETRY_ATTEMPTS = 1
+        return crawler
+
+
+    def run(self, depth=4, threadCounts=(1, 4, 16), concurrencies=(50, 200),
+            modes=("threads", "pipeline", "async"), repeats=1, processCounts=(1, 2, 4)):
+        '''Crawls the stand-in site once per thread count in
+        threads and pipeline mode, once per concurrency in
+        async mode and once per process count in distributed
+        mode, each `repeats` times, then prints a table of the
+        median crawls and returns them.
+
+        Args:
+            depth(int): depth of every crawl
+            threadCounts(tuple): NUM_THREADS values for threads and pipeline mode
+            concurrencies(tuple): ASYNC_CONCURRENCY values for async mode
+            modes(tuple): crawl modes to run
+            repeats(int): crawls of every mode and worker count
+            processCounts(tuple): DISTRIBUTED_PROCESSES values for distributed
+                mode, of PROCESS_THREADS threads each
+        '''
+        url = self.start()
+        crawler = self.crawler()
+        results = []
+        try:
+            for mode in modes:
+                counts = {"async": concurrencies, "distributed": processCounts}.get(mode, threadCounts)
+                for count in counts:
+                    #a fixed pool, so each row measures one thread count
+                    crawler.NUM_THREADS = count
+                    crawler.MIN_THREADS = count
+                    crawler.MAX_THREADS = count
+                    #the stand-in site is a single host
+                    crawler.HOST_CONCURRENCY = count
+                    crawler.ASYNC_CONCURRENCY = count
+                    if mode == "distributed":
+                        crawler.DISTRIBUTED_PROCESSES = count
+                        crawler.NUM_THREADS = self.PROCESS_THREADS
+                        crawler.HOST_CONCURRENCY = self.PROCESS_THREADS
+                    crawls = []
+                    for _ in range(repeats):
+                        crawler.delete()
+                        start = time.time()
+                        crawler.crawlURL(url, depth, mode)
+                        crawlTime = time.time() - start
+                        crawls.append((crawlTime, crawler.crawlCount, crawler.errorCount()))
+                    crawlTime, crawled, errors = sorted(crawls)[len(crawls) // 2]
+                    results.append({"mode": mode, "workers": count, "executionTime": round(crawlTime, 3),
+                                    "pagesCrawled": crawled, "errors": errors,
+                                    "pagesPerSecond": round(crawled / crawlTime, 3),
+                                    "secondsPerPage": round(crawlTime / crawled, 5) if crawled else None})
+        finally:
+            crawler.close()
+            self.stop()
+
+        print("Expected pages:", self.expected(depth))
+        print("mode     --- workers --- executionTime --- pagesCrawled --- errors --- pages/sec --- sec/page")
+        for result in results:
+            print("%-8s --- %7d --- %13.3f --- %12d --- %6d --- %9.1f --- %8.4f"
+                  % (result["mode"], result["workers"], result["executionTime"], result["pagesCrawled"],
+                     result["errors"], result["pagesPerSecond"], result["secondsPerPage"] or 0))
+        return results
+
+
+    def save(self, results, path, depth):
+        '''Saves results as the baseline of later runs.'''
+        with open(path, "w") as f:
+            json.dump({"settings": dict(self.settings(), depth=depth), "results": results}, f, indent=1)
+
+
+    def compare(self, results, path, depth, threshold=0.2):
+        '''Compares results with the baseline saved at path
+        and returns the regressions. A run is a regression if
+        its pages/sec is more than threshold below the baseline
+        or it crawled fewer pages.
+
+        Args:
+            results(list): what run returned
+            path(str): file saved by save
+            depth(int): depth of the crawls
+            threshold(float): largest drop in pages/sec allowed, 0.2 is 20%
+        '''
+        with open(path) as f:
+            baseline = json.load(f)
+        if baseline["settings"] != dict(self.settings(), depth=depth):
+            print("The baseline was saved with other settings:", baseline["settings"])
+            return ["settings"]
+        before = {(result["mode"], result["workers"]): result for result in baseline["results"]}
+        regressions = []
+        print("mode     --- workers --- baseline pages/sec --- pages/sec --- change")
+        for result in results:
+            old = before.get((result["mode"], result["workers"]))
+            if old is None:
+                continue
+            change = result["pagesPerSecond"] / old["pagesPerSecond"] - 1
+            regressed = change < -threshold or result["pagesCrawled"] < old["pagesCrawled"]
+            print("%-8s --- %7d --- %18.1f --- %9.1f --- %+5.0f%%%s"
+                  % (result["mode"], result["workers"], old["pagesPerSecond"], result["pagesPerSecond"],
+                     100 * change, "  REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append((result["mode"], result["workers"]))
+        return regressions
+
+
+    def runRecrawl(self, depth=4, threads=4):
+        '''Crawls the stand-in site twice in threads mode
+        without deleting the databases in between and prints
+        the time and body bytes of each crawl. The second
+        crawl only sends conditional requests.
+
+        Args:
+            depth(int): depth of both crawls
+            threads(int): NUM_THREADS of both crawls
+        '''
+        url = self.start()
+        crawler = self.crawler()
+        crawler.NUM_THREADS = threads
+        crawler.HOST_CONCURRENCY = threads
+        results = []
+        try:
+            crawler.delete()
+            for name in ("first", "again"):
+                self.bytesSent = 0
+                start = time.time()
+                crawler.crawlURL(url, depth)
+                results.append((name, time.time() - start, self.bytesSent, crawler.unchangedCount))
+        finally:
+            crawler.close()
+            self.stop()
+
+        print("crawl --- executionTime --- bytesSent --- unchanged")
+        for name, crawlTime, sent, unchanged in results:
+            print("%-5s --- %13.3f --- %9d --- %9d" % (name, crawlTime, sent, unchanged))
+        return results
+
+
+def counts(text):
+    return tuple(int(count) for count in text.split(","))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the crawl modes against a generated local site.")
+    parser.add_argument("pages", nargs="?", type=int, default=200)
+    parser.add_argument("fanout", nargs="?", type=int, default=5)
+    parser.add_argument("latency", nargs="?", type=float, default=0.05)
+    parser.add_argument("--page-size", type=int, default=0, help="bytes every page is padded to")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of pages that answer 503")
+    parser.add_argument("--graph", choices=("tree", "random"), default="tree")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--threads", type=counts, default=(1, 4, 16), help="thread counts, e.g. 1,4,16")
+    parser.add_argument("--concurrency", type=counts, default=(50, 200), help="async concurrencies, e.g. 50,200")
+    parser.add_argument("--processes", type=counts, default=(1, 2, 4),
+                        help="distributed process counts, e.g. 1,2,4")
+    parser.add_argument("--hosts", type=int, default=1, help="local ports the site is served on")
+    parser.add_argument("--modes", default="threads,pipeline,async", help="any of threads,pipeline,async,distributed")
+    parser.add_argument("--repeats", type=int, default=1, help="crawls per row, the median is kept")
+    parser.add_argument("--storage", choices=("mongo", "sqlite"), default=None)
+    parser.add_argument("--baseline", help="JSON file to compare with, or to save to with --save")
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="largest pages/sec drop allowed")
+    parser.add_argument("--no-recrawl", action="store_true", help="skip the repeated crawl")
+    args = parser.parse_args()
+
+    def benchmark():
+        return Benchmark(args.pages, args.fanout, args.latency, args.page_size, args.error_rate,
+                         args.graph, args.seed, args.storage, args.hosts)
+
+    results = benchmark().run(args.depth, args.threads, args.concurrency,
+                              tuple(args.modes.split(",")), args.repeats, args.processes)
+    regressions = []
+    if args.baseline and args.save:
+        benchmark().save(results, args.baseline, args.depth)
+    elif args.baseline:
+        regressions = benchmark().compare(results, args.baseline, args.depth, args.threshold)
+    if not args.no_recrawl:
+        benchmark().runRecrawl(args.depth)
+    sys.exit(1 if regressions else 0)
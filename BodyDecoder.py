@@ -0,0 +1,163 @@
+'''
+BodyDecoder undoes the Content-Encoding of a response body a
+piece at a time, so a page never has to be held in memory
+whole, compressed and decompressed, before it is parsed.
+
+gzip and deflate are decompressed with zlib, brotli with the
+brotli package if it is installed. Every call produces at most
+CHUNK_SIZE bytes of output at once, so a small gzip bomb can not
+expand into gigabytes in one step, and the decoded size and the
+time since the first byte are checked against maxBytes and
+timeLimit as the body arrives.
+
+peak is the most body bytes the decoder held at one time, the
+raw piece being decoded plus its output, which is the memory a
+page costs while it streams into the parser.
+
+stream() also adds up the seconds spent waiting for the raw
+body and decoding it, in readSeconds and decodeSeconds, without
+the time the caller takes between pieces.
+'''
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class BodyDecoder(object):
+
+    #most bytes read from the socket or produced by the decompressor at once
+    CHUNK_SIZE = 16 * 1024
+    #brotli can not cap its output, so it is fed small pieces
+    BROTLI_PIECE = 1024
+
+    def __init__(self, encoding=None, maxBytes=10 * 1024 * 1024, timeLimit=30.0):
+        '''
+        Args:
+            encoding(str): Content-Encoding of the response, None for none
+            maxBytes(int): most decoded bytes allowed
+            timeLimit(float): most seconds allowed for the whole body
+        '''
+        encoding = (encoding or "identity").strip().lower()
+        if encoding in ("gzip", "x-gzip"):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            #servers send zlib wrapped or raw deflate, which one is
+            #decided by the first bytes
+            self.decompressor = None
+        elif encoding == "br" and brotli is not None:
+            self.decompressor = brotli.Decompressor()
+        elif encoding == "identity":
+            self.decompressor = None
+        else:
+            raise Exception("Decoding Error: Can not decode %s response" % encoding)
+        self.encoding = encoding
+        self.maxBytes = maxBytes
+        self.timeLimit = timeLimit
+        self.start = time.monotonic()
+        self.rawBytes = 0
+        self.size = 0
+        self.peak = 0
+        self.readSeconds = 0.0
+        self.decodeSeconds = 0.0
+        #charset the response named for the body, if any
+        self.charset = None
+
+
+    @classmethod
+    def accepted(cls):
+        '''Returns the Accept-Encoding header value for the
+        encodings that can be decoded.
+        '''
+        return "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+
+
+    def stream(self, response):
+        '''Reads response CHUNK_SIZE bytes at a time and
+        yields its decoded body in pieces.
+
+        Args:
+            response(http.client.HTTPResponse): response to read the body of
+        '''
+        length = response.getheader("Content-Length")
+        if self.encoding == "identity" and length and length.isdigit() and int(length) > self.maxBytes:
+            raise Exception("Page is larger than %d bytes" % self.maxBytes)
+        while True:
+            start = time.perf_counter()
+            data = response.read(self.CHUNK_SIZE)
+            self.readSeconds = self.readSeconds + time.perf_counter() - start
+            if not data:
+                break
+            for piece in self.timed(self.decode(data)):
+                yield piece
+        for piece in self.timed(self.flush()):
+            yield piece
+
+
+    def timed(self, pieces):
+        '''Yields the pieces of a decode or flush call,
+        adding the time it took to produce them to decodeSeconds.
+        '''
+        while True:
+            start = time.perf_counter()
+            piece = next(pieces, None)
+            self.decodeSeconds = self.decodeSeconds + time.perf_counter() - start
+            if piece is None:
+                return
+            yield piece
+
+
+    def decode(self, data):
+        '''Yields the decoded pieces of the next raw bytes
+        of the body.
+
+        Args:
+            data(bytes): the next bytes of the body
+        '''
+        self.rawBytes = self.rawBytes + len(data)
+        if self.encoding == "identity":
+            yield self.check(data, 0)
+        elif self.encoding == "br":
+            for i in range(0, len(data), self.BROTLI_PIECE):
+                piece = data[i:i + self.BROTLI_PIECE]
+                yield self.check(self.decompressor.process(piece), len(piece))
+        else:
+            if self.decompressor is None:
+                #zlib streams start with a header whose first 16 bits are a multiple of 31
+                wrapped = len(data) >= 2 and (data[0] & 0x0f) == 8 and ((data[0] << 8) | data[1]) % 31 == 0
+                self.decompressor = zlib.decompressobj(zlib.MAX_WBITS if wrapped else -zlib.MAX_WBITS)
+            while not self.decompressor.eof:
+                output = self.decompressor.decompress(data, self.CHUNK_SIZE)
+                yield self.check(output, len(data))
+                data = self.decompressor.unconsumed_tail
+                #a full chunk may leave more output behind without any input
+                if not data and len(output) < self.CHUNK_SIZE:
+                    break
+
+
+    def flush(self):
+        '''Yields what the decompressor still holds once
+        the whole body was read.
+        '''
+        if self.encoding in ("gzip", "x-gzip", "deflate") and self.decompressor is not None:
+            output = self.decompressor.flush()
+            if output:
+                yield self.check(output, 0)
+
+
+    def check(self, output, held):
+        '''Counts output against the limits and returns it.
+
+        Args:
+            output(bytes): decoded bytes
+            held(int): raw bytes held while they were decoded
+        '''
+        self.size = self.size + len(output)
+        self.peak = max(self.peak, held + len(output))
+        if self.size > self.maxBytes:
+            raise Exception("Page is larger than %d bytes" % self.maxBytes)
+        if time.monotonic() - self.start > self.timeLimit:
+            raise Exception("Page took longer than %g seconds" % self.timeLimit)
+        return output
@@ -0,0 +1,83 @@
+'''
+CircuitBreaker keeps a crawl from spending its workers on hosts
+that are down, where every request only ends in a timeout.
+
+Every host starts closed. After `threshold` transient failures in
+a row its breaker opens for openSeconds, and the HostScheduler
+hands out none of the host's links until then, so they wait
+instead of each failing in turn. Then it is half open: one link
+is tried, and the host closes again if it works, or opens for
+twice as long if it fails. A host that failed its last try after
+opening `opens` times is given up, and its links are failed
+without a request, so a crawl does not wait for a host that stays
+down. Permanent errors such as a 404 show that the host answers,
+so they count as successes.
+
+It takes no lock, the HostScheduler calls it holding its own.
+'''
+
+class CircuitBreaker(object):
+
+    def __init__(self, threshold=5, openSeconds=15.0, opens=3):
+        '''
+        Args:
+            threshold(int): transient failures in a row that open a host
+            openSeconds(float): seconds a host is open the first time
+            opens(int): times a host opens before it is given up
+        '''
+        self.threshold = threshold
+        self.openSeconds = openSeconds
+        self.opens = opens
+        self.reset()
+
+
+    def reset(self):
+        #host -> [failures in a row, time open until, times opened],
+        #only for hosts whose last request failed
+        self.hosts = {}
+        self.deadHosts = set()
+
+
+    def openUntil(self, host):
+        '''Returns the time.monotonic() the host is open
+        until, 0 if it is closed or given up.
+        '''
+        state = self.hosts.get(host)
+        return state[1] if state is not None else 0
+
+
+    def halfOpen(self, host, now):
+        '''True if the host was open and may be tried again.'''
+        state = self.hosts.get(host)
+        return state is not None and 0 < state[1] <= now
+
+
+    def dead(self, host):
+        '''True if the host was given up.'''
+        return host in self.deadHosts
+
+
+    def success(self, host):
+        self.hosts.pop(host, None)
+
+
+    def failure(self, host, now):
+        '''Counts a transient failure of host. Returns the
+        time it is open until if it opened now, else None.
+        '''
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = [0, 0, 0]
+        state[0] = state[0] + 1
+        if state[1] > now or host in self.deadHosts:
+            #a request sent before it opened
+            return None
+        if state[1] == 0 and state[0] < self.threshold:
+            return None
+        if state[2] >= self.opens:
+            del self.hosts[host]
+            self.deadHosts.add(host)
+            return None
+        state[1] = now + self.openSeconds * 2 ** state[2]
+        state[2] = state[2] + 1
+        return state[1]
@@ -0,0 +1,269 @@
+'''
+ConnectionPool keeps HTTP keep-alive connections open
+between requests so that pages from the same site do not
+each pay for a new TCP connect and TLS handshake.
+
+Connections are kept per scheme/host/port, are shared by
+every thread, and at most maxPerHost of them are open to
+one host at a time. Connections that sit idle longer than
+idleTimeout seconds are closed.
+
+If a CrawlMetrics is given, the DNS lookup and connect of every
+new connection and the time to the first byte of every response
+are recorded.
+
+4xx/5xx responses raise an HTTPError, which keeps the status and
+the Retry-After header, so a RetryPolicy can tell a 503 that is
+worth retrying from a 404 that is not.
+'''
+from contextlib import contextmanager
+import email.utils
+import http.client
+import socket
+import threading
+import time
+import urllib.parse
+
+class HTTPError(Exception):
+
+    def __init__(self, status, reason, retryAfter=None):
+        '''
+        Args:
+            status(int): status code of the response
+            reason(str): reason phrase of the response
+            retryAfter(str): Retry-After header of the response, or None
+        '''
+        Exception.__init__(self, "HTTP Error %d: %s" % (status, reason))
+        self.status = status
+        self.reason = reason
+        self.retryAfter = self.seconds(retryAfter)
+
+
+    @staticmethod
+    def seconds(retryAfter):
+        '''Returns the seconds a Retry-After header asks
+        to wait, given in seconds or as a date, or None.
+        '''
+        if not retryAfter:
+            return None
+        retryAfter = retryAfter.strip()
+        if retryAfter.isdigit():
+            return float(retryAfter)
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(retryAfter).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class ConnectionPool(object):
+
+    MAX_REDIRECTS = 5
+
+    def __init__(self, maxPerHost=8, idleTimeout=30, metrics=None):
+        '''
+        Args:
+            maxPerHost(int): most connections open to one host at once
+            idleTimeout(float): seconds an idle connection is kept open
+            metrics(CrawlMetrics): where request timings are recorded, or None
+        '''
+        self.maxPerHost = maxPerHost
+        self.idleTimeout = idleTimeout
+        self.metrics = metrics
+        self.cv = threading.Condition()
+        #key -> list of (connection, time it went idle)
+        self.idle = {}
+        #key -> number of connections checked out
+        self.active = {}
+        self.lastEviction = time.monotonic()
+        self.requests = 0
+        self.reused = 0
+
+
+    @contextmanager
+    def urlopen(self, url, headers, timeout=10, raiseErrors=True):
+        '''Sends a GET request for url, following redirects,
+        and yields the response. The body must be read
+        inside the with block. If the whole body was read the
+        connection goes back to the pool, otherwise it is closed.
+        Raises an HTTPError for 4xx/5xx responses unless
+        raiseErrors is False.
+
+        Args:
+            url(str): url to request
+            headers(dict): headers to send with the request
+            timeout(float): socket timeout in seconds
+            raiseErrors(bool): raise for 4xx/5xx responses
+        '''
+        for _ in range(self.MAX_REDIRECTS + 1):
+            key, conn, response = self.request(url, headers, timeout)
+            reusable = False
+            try:
+                location = response.getheader("Location")
+                if response.status in (301, 302, 303, 307, 308) and location:
+                    response.read()
+                    reusable = not response.will_close
+                    url = urllib.parse.urljoin(url, location)
+                    continue
+                if response.status >= 400 and raiseErrors:
+                    raise HTTPError(response.status, response.reason, response.getheader("Retry-After"))
+                yield response
+                reusable = response.isclosed() and not response.will_close
+                return
+            finally:
+                self.release(key, conn, reusable)
+        raise Exception("Too many redirects")
+
+
+    def request(self, url, headers, timeout):
+        '''Sends one GET request on a pooled connection and
+        returns the key, connection and response. A reused
+        connection the server already closed is replaced
+        by a new one.
+        '''
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise Exception("unknown url type: %s" % url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path = path + "?" + parts.query
+
+        conn, reused = self.acquire(key, timeout)
+        try:
+            try:
+                return key, conn, self.send(conn, reused, path, headers)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+            #the server timed out the idle connection, try once on a new one
+            conn.close()
+            with self.cv:
+                self.reused = self.reused - 1
+            return key, conn, self.send(conn, False, path, headers)
+        except:
+            self.release(key, conn, False)
+            raise
+
+
+    def acquire(self, key, timeout):
+        '''Checks out a connection to key, waiting if
+        maxPerHost connections are already in use. Returns
+        the connection and whether it was reused.
+        '''
+        with self.cv:
+            self.evict()
+            self.requests = self.requests + 1
+            while True:
+                idle = self.idle.get(key)
+                if idle:
+                    conn = idle.pop()[0]
+                    self.active[key] = self.active.get(key, 0) + 1
+                    self.reused = self.reused + 1
+                    conn.timeout = timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    return conn, True
+                if self.active.get(key, 0) < self.maxPerHost:
+                    self.active[key] = self.active.get(key, 0) + 1
+                    break
+                self.cv.wait()
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout), False
+        return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+
+    def send(self, conn, reused, path, headers):
+        '''Sends the request and returns the response once
+        its headers have arrived.
+        '''
+        metrics = self.metrics
+        if metrics is None:
+            conn.request("GET", path, headers=headers)
+            return conn.getresponse()
+        if not reused:
+            self.connect(conn, metrics)
+        start = time.perf_counter()
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        metrics.record("ttfb", time.perf_counter() - start)
+        return response
+
+
+    @staticmethod
+    def connect(conn, metrics):
+        '''Opens a new connection, recording the DNS lookup
+        and the connect (with the TLS handshake) separately.
+        '''
+        start = time.perf_counter()
+        addresses = socket.getaddrinfo(conn.host, conn.port, 0, socket.SOCK_STREAM)
+        resolved = time.perf_counter()
+        metrics.record("dns", resolved - start)
+
+        def createConnection(address, timeout, sourceAddress=None):
+            #the addresses were already looked up, try them in order
+            #like socket.create_connection does
+            error = None
+            for family, kind, proto, name, sockaddr in addresses:
+                try:
+                    return socket.create_connection(sockaddr[:2], timeout, sourceAddress)
+                except OSError as e:
+                    error = e
+            raise error
+
+        #http.client connects through this attribute, the host name
+        #is still used for the Host header and TLS
+        conn._create_connection = createConnection
+        conn.connect()
+        metrics.record("connect", time.perf_counter() - resolved)
+
+
+    def release(self, key, conn, reusable):
+        '''Returns a checked out connection to the pool,
+        or closes it if it can not be used again.
+        '''
+        if not reusable:
+            conn.close()
+        with self.cv:
+            self.active[key] = self.active[key] - 1
+            if reusable:
+                self.idle.setdefault(key, []).append((conn, time.monotonic()))
+            self.cv.notify_all()
+
+
+    def evict(self):
+        '''Closes connections that have been idle longer
+        than idleTimeout. Must be called holding self.cv.
+        '''
+        now = time.monotonic()
+        if now - self.lastEviction < 1:
+            return
+        self.lastEviction = now
+        for key in list(self.idle):
+            keep = []
+            for conn, since in self.idle[key]:
+                if now - since > self.idleTimeout:
+                    conn.close()
+                else:
+                    keep.append((conn, since))
+            if keep:
+                self.idle[key] = keep
+            else:
+                del self.idle[key]
+
+
+    def getStats(self):
+        '''Returns the number of requests sent and how
+        many of them reused an open connection.
+        '''
+        with self.cv:
+            return self.requests, self.reused
+
+
+    def close(self):
+        '''Closes every idle connection.'''
+        with self.cv:
+            for idle in self.idle.values():
+                for conn, since in idle:
+                    conn.close()
+            self.idle = {}
@@ -0,0 +1,96 @@
+'''
+CrawlBudget ends a crawl after a number of pages, bytes or
+seconds, whichever runs out first, instead of only by depth.
+
+A worker claims a page before it downloads it, so the page
+budget is never overrun however many workers there are, and
+gives the claim back if the page could not be crawled. Once a
+budget has run out the crawl is over, even if claims are given
+back after that. Bytes are the decoded body bytes of the pages
+crawled and are counted once a page is downloaded, so the byte
+budget can be overrun by the pages in flight when it runs out.
+Seconds run from start().
+'''
+import threading
+import time
+
+class CrawlBudget(object):
+
+    def __init__(self, maxPages=None, maxBytes=None, maxSeconds=None):
+        '''
+        Args:
+            maxPages(int): most pages crawled, None for no limit
+            maxBytes(int): most body bytes downloaded, None for no limit
+            maxSeconds(float): most seconds of crawling, None for no limit
+        '''
+        self.maxPages = maxPages
+        self.maxBytes = maxBytes
+        self.maxSeconds = maxSeconds
+        self.lock = threading.Lock()
+        self.start()
+
+
+    def start(self):
+        '''Starts counting from zero.'''
+        with self.lock:
+            self.pages = 0
+            self.bytes = 0
+            self.started = time.monotonic()
+            #the budget that ran out, None while none has
+            self.reason = None
+
+
+    def unlimited(self):
+        return self.maxPages is None and self.maxBytes is None and self.maxSeconds is None
+
+
+    def remaining(self):
+        '''Returns the seconds left, or None without a time budget.'''
+        if self.maxSeconds is None:
+            return None
+        return max(0.0, self.maxSeconds - (time.monotonic() - self.started))
+
+
+    def exhausted(self):
+        '''Returns True once any budget has run out.'''
+        with self.lock:
+            return self.check()
+
+
+    def check(self):
+        '''Must be called holding self.lock.'''
+        if self.reason is None:
+            if self.maxPages is not None and self.pages >= self.maxPages:
+                self.reason = "pages"
+            elif self.maxBytes is not None and self.bytes >= self.maxBytes:
+                self.reason = "bytes"
+            elif self.maxSeconds is not None and time.monotonic() - self.started >= self.maxSeconds:
+                self.reason = "seconds"
+        return self.reason is not None
+
+
+    def claim(self):
+        '''Returns True and counts a page if another page may
+        be crawled, False once the budget has run out.
+        '''
+        with self.lock:
+            if self.check():
+                return False
+            self.pages = self.pages + 1
+            return True
+
+
+    def release(self):
+        '''Gives back the claim of a page that was not crawled.'''
+        with self.lock:
+            self.pages = self.pages - 1
+
+
+    def charge(self, size):
+        '''Counts the body bytes of a crawled page.
+
+        Args:
+            size(int): decoded body bytes
+        '''
+        with self.lock:
+            self.bytes = self.bytes + size
@@ -0,0 +1,402 @@
+'''
+CrawlMetrics times the stages of every page while a crawl runs:
+the DNS lookup, the TCP connect (and TLS handshake), the time to
+the first byte of the response, downloading and decoding the
+body, parsing it and the storage calls, plus the whole fetch per
+host. It also counts pages, errors and bytes, and samples how many
+links are queued and how busy the workers are.
+
+It is cheap enough to leave on. Every thread records into its own
+shard, so recording takes no lock: a duration only goes into a
+histogram of log2 buckets from 50 microseconds up, a count and a
+sum. snapshot() adds the shards up while the crawl runs, and
+percentiles are interpolated within their bucket, so they are
+estimates within a factor of two.
+
+While a crawl runs a sampler thread reads the queue depth and the
+number of workers every interval seconds, and prints a progress
+line if asked to. MetricsServer serves the current snapshot on a
+local port in the Prometheus text format at /metrics and as JSON
+at /metrics.json.
+'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import sys
+import threading
+import time
+
+class Histogram(object):
+
+    #upper bound of bucket 0, bucket i goes up to MIN_SECONDS * 2**i
+    MIN_SECONDS = 0.00005
+    BUCKETS = 24
+
+    def __init__(self):
+        self.counts = [0] * (self.BUCKETS + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def add(self, seconds):
+        if seconds > self.MIN_SECONDS:
+            index = min(math.frexp(seconds / self.MIN_SECONDS)[1], self.BUCKETS)
+        else:
+            index = 0
+        self.counts[index] = self.counts[index] + 1
+        self.count = self.count + 1
+        self.total = self.total + seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+    def merge(self, other):
+        '''Adds the durations of another histogram to this one.'''
+        for index, count in enumerate(other.counts):
+            self.counts[index] = self.counts[index] + count
+        self.count = self.count + other.count
+        self.total = self.total + other.total
+        self.max = max(self.max, other.max)
+
+
+    @classmethod
+    def bound(cls, index):
+        return cls.MIN_SECONDS * 2 ** index
+
+
+    def quantile(self, q):
+        '''Returns the q quantile, interpolated within its
+        bucket and at most the longest duration.
+        '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bound(index - 1) if index else 0.0
+                upper = min(self.bound(index), self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen = seen + count
+        return self.max
+
+
+    def summary(self):
+        '''Returns the count, total, mean, percentiles and max.'''
+        return {"count": self.count,
+                "total": round(self.total, 6),
+                "mean": round(self.total / self.count, 6) if self.count else 0.0,
+                "p50": round(self.quantile(0.5), 6),
+                "p95": round(self.quantile(0.95), 6),
+                "p99": round(self.quantile(0.99), 6),
+                "max": round(self.max, 6)}
+
+
+class CrawlMetrics(object):
+
+    STAGES = ("dns", "connect", "ttfb", "download", "decode", "parse", "lookup", "store", "fetch", "page")
+    #hosts in a snapshot, the ones with the most fetch time
+    MAX_HOSTS = 20
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sampler = None
+        self.reset()
+
+
+    def reset(self):
+        '''Starts counting from zero. Shards of the last
+        crawl are dropped.
+        '''
+        with self.lock:
+            self.local = threading.local()
+            self.shards = []
+            self.started = time.monotonic()
+            #name -> function returning the current value
+            self.gauges = {}
+            self.samples = {}
+            self.queueMax = 0
+            self.workerSeconds = 0.0
+            self.lastSample = self.started
+
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = {"stages": {}, "hosts": {}, "counts": {}}
+            with self.lock:
+                self.shards.append(shard)
+            self.local.shard = shard
+            return shard
+
+
+    def record(self, stage, seconds, host=None):
+        '''Adds the duration of a stage of one page.
+
+        Args:
+            stage(str): one of STAGES
+            seconds(float): how long the stage took
+            host(str): the host of the page, counted per host too
+        '''
+        shard = self.shard()
+        histogram = shard["stages"].get(stage)
+        if histogram is None:
+            histogram = shard["stages"][stage] = Histogram()
+        histogram.add(seconds)
+        if host is not None:
+            latency = shard["hosts"].get(host)
+            if latency is None:
+                shard["hosts"][host] = [1, seconds, seconds]
+            else:
+                latency[0] = latency[0] + 1
+                latency[1] = latency[1] + seconds
+                if seconds > latency[2]:
+                    latency[2] = seconds
+
+
+    def count(self, name, amount=1):
+        '''Adds to a counter, such as "pages", "errors", "retries"
+        or "bytes".
+        '''
+        counts = self.shard()["counts"]
+        counts[name] = counts.get(name, 0) + amount
+
+
+    def watch(self, queue=None, workers=None):
+        '''Sets the functions the sampler reads.
+
+        Args:
+            queue(function): returns the number of links waiting
+            workers(function): returns the number of workers running
+        '''
+        with self.lock:
+            self.gauges = {"queue": queue, "workers": workers}
+        #worker time counts from now, not from the first sample
+        self.sample()
+
+
+    def sample(self):
+        '''Reads the gauges and adds up the worker time
+        since the last sample.
+        '''
+        with self.lock:
+            gauges = dict(self.gauges)
+        samples = {name: function() for name, function in gauges.items() if function is not None}
+        now = time.monotonic()
+        with self.lock:
+            self.workerSeconds = self.workerSeconds + self.samples.get("workers", 0) * (now - self.lastSample)
+            self.lastSample = now
+            self.samples = samples
+            self.queueMax = max(self.queueMax, samples.get("queue", 0))
+
+
+    def merged(self):
+        '''Returns the stages, hosts and counts of every shard
+        added up.
+        '''
+        with self.lock:
+            shards = list(self.shards)
+        stages, hosts, counts = {}, {}, {}
+        for shard in shards:
+            for stage, histogram in list(shard["stages"].items()):
+                stages.setdefault(stage, Histogram()).merge(histogram)
+            for host, latency in list(shard["hosts"].items()):
+                total = hosts.setdefault(host, [0, 0.0, 0.0])
+                total[0] = total[0] + latency[0]
+                total[1] = total[1] + latency[1]
+                total[2] = max(total[2], latency[2])
+            for name, count in list(shard["counts"].items()):
+                counts[name] = counts.get(name, 0) + count
+        return stages, hosts, counts
+
+
+    def add(self, shards, workerSeconds=0.0):
+        '''Adds the shards and worker time recorded by the
+        CrawlMetrics of another process.
+
+        Args:
+            shards(list): the other metrics' shards
+            workerSeconds(float): the other metrics' workerSeconds
+        '''
+        with self.lock:
+            self.shards.extend(shards)
+            self.workerSeconds = self.workerSeconds + workerSeconds
+
+
+    def utilization(self, stages):
+        '''Share of the worker time spent on links.'''
+        with self.lock:
+            workerSeconds = self.workerSeconds
+        page = stages.get("page")
+        if not workerSeconds or page is None:
+            return 0.0
+        return min(1.0, page.total / workerSeconds)
+
+
+    def snapshot(self):
+        '''Returns the metrics so far as a dict of plain
+        values that can be stored or sent as JSON.
+        '''
+        stages, hosts, counts = self.merged()
+        elapsed = time.monotonic() - self.started
+        slowest = sorted(hosts.items(), key=lambda item: item[1][1], reverse=True)[:self.MAX_HOSTS]
+        with self.lock:
+            samples = dict(self.samples)
+            queueMax = self.queueMax
+        return {"elapsed": round(elapsed, 3),
+                "pages": counts.get("pages", 0),
+                "errors": counts.get("errors", 0),
+                "retries": counts.get("retries", 0),
+                "bytes": counts.get("bytes", 0),
+                "pagesPerSecond": round(counts.get("pages", 0) / elapsed, 3) if elapsed else 0.0,
+                "queue": samples.get("queue", 0),
+                "queueMax": queueMax,
+                "workers": samples.get("workers", 0),
+                "utilization": round(self.utilization(stages), 3),
+                "stages": {stage: stages[stage].summary() for stage in self.STAGES if stage in stages},
+                "hosts": [{"host": host, "count": count, "total": round(total, 6),
+                           "mean": round(total / count, 6), "max": round(longest, 6)}
+                          for host, (count, total, longest) in slowest]}
+
+
+    def prometheus(self):
+        '''Returns the metrics so far in the Prometheus
+        text exposition format.
+        '''
+        stages, hosts, counts = self.merged()
+        with self.lock:
+            samples = dict(self.samples)
+        lines = ["# TYPE webcrawler_stage_seconds histogram"]
+        for stage in self.STAGES:
+            histogram = stages.get(stage)
+            if histogram is None:
+                continue
+            cumulative = 0
+            for index, count in enumerate(histogram.counts):
+                cumulative = cumulative + count
+                lines.append('webcrawler_stage_seconds_bucket{stage="%s",le="%g"} %d'
+                             % (stage, Histogram.bound(index), cumulative))
+            lines.append('webcrawler_stage_seconds_bucket{stage="%s",le="+Inf"} %d' % (stage, histogram.count))
+            lines.append('webcrawler_stage_seconds_sum{stage="%s"} %.6f' % (stage, histogram.total))
+            lines.append('webcrawler_stage_seconds_count{stage="%s"} %d' % (stage, histogram.count))
+        slowest = sorted(hosts.items(), key=lambda item: item[1][1], reverse=True)[:self.MAX_HOSTS]
+        lines.append("# TYPE webcrawler_host_fetch_seconds summary")
+        for host, (count, total, longest) in slowest:
+            label = host.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append('webcrawler_host_fetch_seconds_sum{host="%s"} %.6f' % (label, total))
+            lines.append('webcrawler_host_fetch_seconds_count{host="%s"} %d' % (label, count))
+        for name in ("pages", "errors", "retries", "bytes"):
+            lines.append("# TYPE webcrawler_%s_total counter" % name)
+            lines.append("webcrawler_%s_total %d" % (name, counts.get(name, 0)))
+        lines.append("# TYPE webcrawler_queue_depth gauge")
+        lines.append("webcrawler_queue_depth %d" % samples.get("queue", 0))
+        lines.append("# TYPE webcrawler_workers gauge")
+        lines.append("webcrawler_workers %d" % samples.get("workers", 0))
+        lines.append("# TYPE webcrawler_worker_utilization gauge")
+        lines.append("webcrawler_worker_utilization %.3f" % self.utilization(stages))
+        return "\n".join(lines) + "\n"
+
+
+    def progressLine(self):
+        '''Returns one line about the crawl so far.'''
+        snapshot = self.snapshot()
+        fetch = snapshot["stages"].get("fetch", {})
+        return ("%d pages (%.1f/s) | %.1f MB | %d errors | queue %d | %d workers %d%% busy"
+                " | fetch p50 %.0f ms p95 %.0f ms"
+                % (snapshot["pages"], snapshot["pagesPerSecond"], snapshot["bytes"] / 1048576,
+                   snapshot["errors"], snapshot["queue"], snapshot["workers"],
+                   100 * snapshot["utilization"], 1000 * fetch.get("p50", 0), 1000 * fetch.get("p95", 0)))
+
+
+    def start(self, interval=1.0, progress=False, out=None):
+        '''Starts the sampler thread.
+
+        Args:
+            interval(float): seconds between samples
+            progress(bool): print a progress line every sample
+            out(file): where the progress line goes, sys.stdout if None
+        '''
+        self.stop()
+        stopped = threading.Event()
+        out = out or sys.stdout
+
+        def run():
+            while not stopped.wait(interval):
+                self.sample()
+                if progress:
+                    out.write("\r" + self.progressLine() + "\033[K")
+                    out.flush()
+            self.sample()
+            if progress:
+                out.write("\r" + self.progressLine() + "\033[K\n")
+                out.flush()
+
+        self.sampler = (threading.Thread(target=run, daemon=True), stopped)
+        self.sampler[0].start()
+
+
+    def stop(self):
+        '''Stops the sampler thread after a last sample.'''
+        if self.sampler is not None:
+            thread, stopped = self.sampler
+            stopped.set()
+            thread.join()
+            self.sampler = None
+
+
+class MetricsServer(object):
+
+    def __init__(self, metrics, port=9108, host="127.0.0.1"):
+        '''
+        Args:
+            metrics(CrawlMetrics): the metrics to serve
+            port(int): port to listen on, 0 for a free one
+            host(str): address to listen on
+        '''
+        self.metrics = metrics
+        self.port = port
+        self.host = host
+        self.server = None
+
+
+    def start(self):
+        '''Starts serving in a background thread and
+        returns the base url.
+        '''
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.prometheus().encode("utf-8")
+                    contentType = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot()).encode("utf-8")
+                    contentType = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return "http://%s:%d" % (self.host, self.port)
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
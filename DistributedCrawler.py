@@ -0,0 +1,325 @@
+'''
+DistributedCrawler is the "distributed" crawl mode of WebCrawler.
+Threads of one process share one GIL and one machine's sockets,
+so here the crawl is split between processes, on one machine or
+many, that coordinate only through the storage:
+
+    process 1 --+                                  +-- process 1
+    process 2 --+-- claim url --> SharedFrontier --+-- links found
+    process n --+   (partition leases, url leases) +-- process n
+
+Urls are partitioned by a hash of their host and every process
+leases a share of the partitions, so it alone crawls those hosts
+and keeps to their HOST_CONCURRENCY and crawl delay. A process
+runs NUM_THREADS threads that claim urls of its partitions,
+crawl them with its own WebCrawler and send the links found back
+in batches. The crawl is over once no partition has a url left.
+Every url is crawled with the most depth any path to it gives,
+so the pages crawled are the ones a breadth first crawl finds,
+however the work was split.
+
+crawlURL(url, depth, "distributed") starts DISTRIBUTED_PROCESSES
+processes on this machine and adds up what they crawled; an
+SQLite file is opened by all of them with shared=True. To crawl
+from many machines, share a MongoDB (MONGO_URI) and run this
+file on each one, starting the crawl on the first and joining it
+on the others:
+
+Usage: python DistributedCrawler.py url depth [--processes n] [--total n] [--join]
+       python DistributedCrawler.py --help
+
+Budgets do not apply to this mode, and near duplicates are only
+found among the pages a process indexed itself. The words given
+many index blocks are compacted by the process that started the
+crawl, for the blocks of its own machine.
+'''
+from IndexWriter import IndexWriter
+from RetryPolicy import RetryPolicy
+from SharedFrontier import SharedFrontier
+from WebScraper import WebScraper
+from contextlib import contextmanager
+import argparse
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+import traceback
+import urllib.parse
+
+class DistributedCrawler(object):
+
+    #seconds an idle thread waits before it claims again
+    IDLE_SECONDS = 0.1
+
+    def __init__(self, crawler, processes=4, threads=4, totalProcesses=None):
+        '''
+        Args:
+            crawler(WebCrawler): crawler whose settings the processes use
+            processes(int): crawler processes started on this machine
+            threads(int): threads crawling in every process
+            totalProcesses(int): processes on all machines, processes if None
+        '''
+        self.crawler = crawler
+        self.processes = processes
+        self.threads = threads
+        self.totalProcesses = totalProcesses or processes
+        self.crawlCount = 0
+        #what every process returned from run
+        self.reports = []
+
+
+    def crawl(self, url, depth, join=False):
+        '''Crawls url to depth with processes processes and
+        returns the number of pages they crawled.
+
+        Args:
+            url(str): starting url to crawl
+            depth(int): depth at which to stop crawling
+            join(bool): join the crawl in the shared frontier, started
+                on another machine or interrupted, instead of a new one
+        '''
+        crawler = self.crawler
+        storage = crawler.storage
+        if not join:
+            SharedFrontier.reset(storage.frontier, storage.leases)
+        #the processes open the storage themselves
+        storage.flush()
+        settings = {name: getattr(crawler, name) for name in dir(crawler) if name.isupper()}
+        #an SQLite file is written by every process, and the
+        #metrics of the processes are served from this one
+        settings.update(SQLITE_SHARED=True, METRICS_PORT=None)
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        workers = [context.Process(target=DistributedCrawler.work,
+                                   args=(type(crawler), settings, url, depth, self.threads,
+                                         self.totalProcesses, results))
+                   for _ in range(self.processes)]
+        for worker in workers:
+            worker.start()
+        reports = []
+        while len(reports) < len(workers):
+            try:
+                reports.append(results.get(timeout=1.0))
+            except queue.Empty:
+                #a process that died without a report
+                if not any(worker.is_alive() for worker in workers) and results.empty():
+                    break
+        for worker in workers:
+            worker.join()
+
+        self.crawlCount = 0
+        self.reports = reports
+        failures = [report["error"] for report in reports if "error" in report]
+        if failures or len(reports) < len(workers):
+            raise Exception("Crawl Error: %d of %d processes failed\n%s"
+                            % (len(workers) - len(reports) + len(failures), len(workers), "\n".join(failures)))
+        for report in reports:
+            self.crawlCount = self.crawlCount + report["crawled"]
+            with crawler.countLock:
+                crawler.unchangedCount = crawler.unchangedCount + report["unchanged"]
+                crawler.duplicateCount = crawler.duplicateCount + report["duplicates"]
+                crawler.postingsSaved = crawler.postingsSaved + report["postingsSaved"]
+                crawler.bytesSaved = crawler.bytesSaved + report["bytesSaved"]
+                crawler.peakPageBytes = max(crawler.peakPageBytes, report["peakPageBytes"])
+            crawler.metrics.add(report["shards"], report["workerSeconds"])
+            if not join:
+                #compacted by crawlURL once, for all processes
+                blockCounts = crawler.indexWriter.blockCounts
+                for word, count in report["blockCounts"].items():
+                    blockCounts[word] = blockCounts.get(word, 0) + count
+        return self.crawlCount
+
+
+    @staticmethod
+    def work(crawlerClass, settings, url, depth, threads, totalProcesses, results):
+        '''Runs in a process started by crawl. Crawls with a
+        crawler of its own and puts what run returned, or the
+        error, in results.
+        '''
+        try:
+            #the class is only changed in this process
+            for name, value in settings.items():
+                setattr(crawlerClass, name, value)
+            crawler = crawlerClass()
+            try:
+                results.put(DistributedCrawler(crawler, 1, threads, totalProcesses).run(url, depth))
+            finally:
+                crawler.close()
+        except Exception:
+            results.put({"error": traceback.format_exc()})
+
+
+    def run(self, url, depth):
+        '''Crawls in this process until no url is left in the
+        shared frontier and returns what was crawled.
+
+        Args:
+            url(str): starting url, queued unless it is already
+            depth(int): depth at which to stop crawling
+        '''
+        crawler = self.crawler
+        owner = "%s:%d" % (socket.gethostname(), os.getpid())
+        self.frontier = SharedFrontier(crawler.storage.frontier, crawler.storage.leases, owner, self.totalProcesses)
+        self.frontier.open()
+        self.frontier.put([url], depth)
+        self.frontier.flush()
+        self.crawlCount = 0
+        self.lock = threading.Lock()
+        #host -> threads fetching from it, and when it may be fetched from next
+        self.hostCv = threading.Condition()
+        self.active = {}
+        self.nextTime = {}
+        crawler.nearDuplicates.load()
+        crawler.indexWriter = IndexWriter(crawler.words, counters = crawler.counters)
+        crawler.indexWriter.start()
+        crawler.metrics.reset()
+        crawler.metrics.watch(None, lambda: self.threads)
+        crawler.metrics.start(crawler.PROGRESS_INTERVAL)
+        try:
+            threads = [threading.Thread(target=self.worker) for _ in range(self.threads)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            crawler.metrics.stop()
+            self.frontier.close()
+            crawler.indexWriter.close(compact = False)
+        #one write, so the lines of the processes do not mix
+        print("Process %s crawled %d webpages." % (owner, self.crawlCount))
+        return {"owner": owner,
+                "crawled": self.crawlCount,
+                "unchanged": crawler.unchangedCount,
+                "duplicates": crawler.duplicateCount,
+                "postingsSaved": crawler.postingsSaved,
+                "bytesSaved": crawler.bytesSaved,
+                "peakPageBytes": crawler.peakPageBytes,
+                "blockCounts": crawler.indexWriter.blockCounts,
+                "shards": crawler.metrics.shards,
+                "workerSeconds": crawler.metrics.workerSeconds}
+
+
+    def worker(self):
+        crawler = self.crawler
+        #make local connections for each thread
+        storage = crawler.storage.connect()
+        urlsCrawled = storage.urlsCrawled
+        errors = storage.errors
+        crawled = 0
+        while True:
+            document = self.frontier.claim()
+            if document is None:
+                #urls may still come from pages being crawled
+                if self.frontier.finished():
+                    break
+                time.sleep(self.IDLE_SECONDS)
+                continue
+            start = time.monotonic()
+            url = document["url"]
+            links = None
+            try:
+                if document.get("crawled"):
+                    #found again with more depth left
+                    links = self.storedLinks(url, urlsCrawled)
+                else:
+                    links = self.crawlPage(url, urlsCrawled, errors)
+                    if links is not None:
+                        crawled = crawled + 1
+            except Exception as e:
+                crawler.insertError(url, str(e), errors, RetryPolicy.classify(e))
+            finally:
+                self.frontier.done(document, links or ())
+            crawler.metrics.record("page", time.monotonic() - start)
+        storage.close()
+        with self.lock:
+            self.crawlCount = self.crawlCount + crawled
+
+
+    def crawlPage(self, url, urlsCrawled, errors):
+        '''Crawls one page as a worker of threads mode does
+        and returns its links, or None if it failed.
+        '''
+        crawler = self.crawler
+        if not crawler.robots.allowed(url):
+            crawler.insertError(url, "Disallowed by robots.txt", errors, "robots")
+            return None
+        validators = crawler.storedValidators(url, urlsCrawled)
+        with self.politely(url):
+            scraper = WebScraper(url, validators=validators)
+        crawler.recordPeak(scraper.peakBytes)
+        if scraper.error:
+            crawler.insertError(url, scraper.getErrorMessage(), errors, scraper.errorKind)
+            return None
+        links = set(scraper.crawlLinks())
+        if scraper.unchanged:
+            crawler.revisitPage(url, scraper.validators, urlsCrawled)
+        else:
+            crawler.storePage(url, scraper.crawlText(), urlsCrawled, scraper.validators, links)
+        return links
+
+
+    def storedLinks(self, url, urlsCrawled):
+        '''Returns the links stored for a crawled page.'''
+        page = urlsCrawled.find_one({"url": url}, {"_id": 0, "links": 1})
+        return (page or {}).get("links") or ()
+
+
+    @contextmanager
+    def politely(self, url):
+        '''Waits until the host of url has fewer than
+        HOST_CONCURRENCY fetches of this process and its crawl
+        delay has passed. The host's partition is this
+        process's, so no other process fetches from it.
+        '''
+        crawler = self.crawler
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        delay = max(crawler.CRAWL_DELAY, crawler.robots.crawlDelay(url))
+        with self.hostCv:
+            while self.active.get(host, 0) >= crawler.HOST_CONCURRENCY:
+                self.hostCv.wait()
+            self.active[host] = self.active.get(host, 0) + 1
+            now = time.monotonic()
+            wait = self.nextTime.get(host, now) - now
+            self.nextTime[host] = max(now, self.nextTime.get(host, now)) + delay
+        try:
+            if wait > 0:
+                time.sleep(wait)
+            yield
+        finally:
+            with self.hostCv:
+                self.active[host] = self.active[host] - 1
+                if not self.active[host]:
+                    del self.active[host]
+                self.hostCv.notify_all()
+
+
+if __name__ == "__main__":
+    from WebCrawler import WebCrawler
+    parser = argparse.ArgumentParser(description="Crawls with processes sharing a frontier in the storage.")
+    parser.add_argument("url")
+    parser.add_argument("depth", type=int)
+    parser.add_argument("--processes", type=int, default=WebCrawler.DISTRIBUTED_PROCESSES,
+                        help="crawler processes on this machine")
+    parser.add_argument("--threads", type=int, default=WebCrawler.NUM_THREADS, help="threads of every process")
+    parser.add_argument("--total", type=int, default=None,
+                        help="crawler processes on all machines, --processes if not given")
+    parser.add_argument("--join", action="store_true",
+                        help="join the crawl in the frontier instead of starting a new one")
+    parser.add_argument("--storage", choices=("mongo", "sqlite"), default=WebCrawler.STORAGE)
+    parser.add_argument("--path", default=WebCrawler.SQLITE_PATH, help="the SQLite file")
+    parser.add_argument("--mongo-uri", default=WebCrawler.MONGO_URI, help="the shared MongoDB")
+    args = parser.parse_args()
+
+    WebCrawler.STORAGE = args.storage
+    WebCrawler.SQLITE_PATH = args.path
+    WebCrawler.MONGO_URI = args.mongo_uri
+    WebCrawler.DISTRIBUTED_PROCESSES = args.processes
+    WebCrawler.DISTRIBUTED_TOTAL = args.total
+    WebCrawler.NUM_THREADS = args.threads
+    crawler = WebCrawler()
+    try:
+        crawler.crawlURL(args.url, args.depth, "distributed", resume=args.join)
+    finally:
+        crawler.close()
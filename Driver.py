@@ -3,6 +3,8 @@ interface for the WebCrawler.
  @author: Arlie Moore
  2/23/2017
 '''
+from CrawlBudget import CrawlBudget
+from LinkScorer import LinkScorer
 from WebCrawler import WebCrawler
 
 def main():
@@ -24,18 +26,33 @@ def main():
             print("5. Delete databases")
             print("6. View Errors")
             print("7. View Stats")
-            print("8. Exit")
+            print("8. Rank pages (PageRank)")
+            print("9. Exit")
             option = input("Select number: ")
             if(option == "1"):
                 url = input("URL: ")
                 depth = int(input("Depth: "))
-                crawler.crawlURL(url, depth)
+                mode = input("Mode (threads/pipeline/async/distributed) [threads]: ").strip()
+                resume = False
+                scorer = None
+                budget = None
+                if mode in ("", "threads"):
+                    resume = input("Resume interrupted crawl? (y/n) [n]: ").strip() == "y"
+                    if input("Crawl best links first? (y/n) [n]: ").strip() == "y":
+                        scorer = LinkScorer(url)
+                if mode == "distributed":
+                    resume = input("Join the crawl in the shared frontier? (y/n) [n]: ").strip() == "y"
+                else:
+                    pages = input("Most pages (blank for no limit): ").strip()
+                    megabytes = input("Most MB downloaded (blank for no limit): ").strip()
+                    seconds = input("Most seconds (blank for no limit): ").strip()
+                    budget = CrawlBudget(int(pages) if pages else None,
+                                         int(float(megabytes) * 1024 * 1024) if megabytes else None,
+                                         float(seconds) if seconds else None)
+                crawler.crawlURL(url, depth, mode or "threads", resume, budget, scorer)
             elif(option == "2"):
-                word = input("Search for links that contain the word: ")
-                word = word.split()
-                word = word[0]
-                word = word.lower()
-                crawler.searchWords(word)
+                query = input("Search for links that match (words, \"phrases\", OR): ")
+                crawler.searchWords(query)
             elif(option == "3"):
                 crawler.printURLS()
             elif(option == "4"):
@@ -47,9 +64,12 @@ def main():
             elif(option == '7'):
                 crawler.printStats()
             elif(option == '8'):
+                crawler.rankPages()
+            elif(option == '9'):
                 print("Exiting WebCralwer, Goodbye...")
+                crawler.close()
                 exit()
-            elif(option == "9"):
+            elif(option == "10"):
                 crawler.printDoubles()
             else:
                 print("Invalid Input, try again with a number.")
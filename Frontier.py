@@ -0,0 +1,363 @@
+'''
+Frontier is a disk-backed replacement for the queue.Queue of
+Links that the worker threads crawl from. Links are appended to
+a log of segment files and read back through mmap, so the
+frontier takes the same small amount of memory however many
+links are waiting.
+
+Every record is a 4 byte url length, a 1 byte depth, the 4 byte
+number of the seed the link was found from and the url in utf-8. Every checkpointInterval seconds the position of
+the readers and the links being crawled at that moment are
+written to checkpoint.json, so an interrupted crawl can be
+resumed from there with open(resume=True).
+
+Segments are mapped WINDOW_BYTES at a time. The tail of a segment
+that is shorter than a window, usually the end of the one being
+written, is read into memory instead, and the writer is only
+flushed once the readers have read everything it wrote before.
+A segment the readers moved past is deleted at the next
+checkpoint, after its urls were added to taken.log, which is all
+a resumed crawl needs of it.
+'''
+from Link import Link
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+class Frontier(object):
+
+    HEADER = struct.Struct("<IBI")
+    SEGMENT_BYTES = 64 * 1024 * 1024
+    WINDOW_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, directory, checkpointInterval=5.0):
+        '''
+        Args:
+            directory(str): where the segments and checkpoint are kept
+            checkpointInterval(float): seconds between checkpoints
+        '''
+        self.directory = directory
+        self.checkpointInterval = checkpointInterval
+        self.cv = threading.Condition()
+        self.writer = None
+        self.writeSegment = 0
+        #bytes of the write segment flushed to disk
+        self.flushed = 0
+        self.readSegment = 0
+        self.readOffset = 0
+        #oldest segment that was not deleted yet
+        self.firstSegment = 0
+        #the part of the read segment from mapStart that is mapped,
+        #or read into memory at its tail
+        self.reader = None
+        self.map = None
+        self.mapStart = 0
+        #id(link) -> (url, depth, seed) of links handed out but not done
+        self.inflight = {}
+        self.requeued = set()
+        #links put and not done yet, the crawl is over at 0
+        self.outstanding = 0
+        self.lastCheckpoint = time.monotonic()
+
+
+    def open(self, resume=False):
+        '''Opens the frontier. Returns True if a checkpoint
+        was found and the frontier continues from it, in which
+        case the links that were being crawled are queued again.
+        Otherwise any old frontier is removed.
+
+        Args:
+            resume(bool): continue from the last checkpoint if there is one
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        self.unmap()
+        self.writeSegment = 0
+        self.flushed = 0
+        self.readSegment = 0
+        self.readOffset = 0
+        self.firstSegment = 0
+        self.inflight = {}
+        self.requeued = set()
+        self.outstanding = 0
+        checkpoint = os.path.join(self.directory, "checkpoint.json")
+        if resume and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            self.readSegment = state["segment"]
+            self.readOffset = state["offset"]
+            self.firstSegment = min(self.segments())
+            self.writeSegment = max(self.segments())
+            self.repair(self.segmentPath(self.writeSegment))
+            self.writer = open(self.segmentPath(self.writeSegment), "ab")
+            self.flushed = self.writer.tell()
+            for segment in range(self.readSegment, self.writeSegment + 1):
+                start = self.readOffset if segment == self.readSegment else 0
+                for url in self.records(self.segmentPath(segment), start):
+                    self.outstanding = self.outstanding + 1
+            #links that were being crawled are crawled again
+            for url, depth, seed in state["inflight"]:
+                self.requeued.add(url)
+                self.put(Link(url, depth, seed))
+            return True
+        self.remove()
+        os.makedirs(self.directory, exist_ok=True)
+        self.writer = open(self.segmentPath(0), "ab")
+        return False
+
+
+    def repair(self, path):
+        '''Cuts off a record that was only partly written
+        when the crawl stopped, so appends start cleanly.
+        '''
+        if not os.path.exists(path):
+            return
+        with open(path, "r+b") as f:
+            offset = 0
+            while True:
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                length, depth, seed = self.HEADER.unpack(header)
+                if len(f.read(length)) < length:
+                    break
+                offset = offset + self.HEADER.size + length
+            f.truncate(offset)
+
+
+    def segmentPath(self, segment):
+        return os.path.join(self.directory, "segment-%06d.log" % segment)
+
+
+    def segments(self):
+        return [int(name[8:14]) for name in os.listdir(self.directory)
+                if name.startswith("segment-")] or [0]
+
+
+    def put(self, link):
+        '''Appends a link to the frontier.'''
+        data = link.getURL().encode("utf-8")
+        with self.cv:
+            if self.writer.tell() + self.HEADER.size + len(data) > self.SEGMENT_BYTES:
+                self.writer.close()
+                self.writeSegment = self.writeSegment + 1
+                self.writer = open(self.segmentPath(self.writeSegment), "ab")
+                self.flushed = 0
+            self.writer.write(self.HEADER.pack(len(data), link.getDepth(), link.getSeed()))
+            self.writer.write(data)
+            self.outstanding = self.outstanding + 1
+            self.cv.notify()
+
+
+    def get(self, block=True, timeout=None):
+        '''Removes and returns the oldest link, like
+        queue.Queue.get. Raises queue.Empty if there is none
+        within timeout seconds. done(link) must be called once
+        the link has been crawled.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cv:
+            while True:
+                link = self.read()
+                if link is not None:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise queue.Empty
+                self.cv.wait(remaining)
+            self.inflight[id(link)] = (link.getURL(), link.getDepth(), link.getSeed())
+            if time.monotonic() - self.lastCheckpoint > self.checkpointInterval:
+                self.checkpoint()
+            return link
+
+
+    def read(self):
+        '''Reads the record at the read position or returns
+        None if the readers caught up with the writers. Must
+        be called holding self.cv.
+        '''
+        while True:
+            #bytes of the record at the read position that are mapped
+            need = self.HEADER.size
+            if self.map is not None:
+                position = self.readOffset - self.mapStart
+                if position + need <= len(self.map):
+                    length, depth, seed = self.HEADER.unpack_from(self.map, position)
+                    start = position + self.HEADER.size
+                    need = need + length
+                    if position + need <= len(self.map):
+                        url = bytes(self.map[start:start + length]).decode("utf-8")
+                        self.readOffset = self.readOffset + need
+                        return Link(url, depth, seed)
+            if self.readSegment == self.writeSegment:
+                if self.readOffset >= self.flushed:
+                    #everything flushed was read, the rest is buffered
+                    self.writer.flush()
+                    self.flushed = self.writer.tell()
+                size = self.flushed
+            else:
+                size = os.path.getsize(self.segmentPath(self.readSegment))
+            if self.readOffset < size:
+                self.remap(size, need)
+                continue
+            if self.readSegment == self.writeSegment:
+                return None
+            #this segment is used up, move on to the next one
+            self.unmap()
+            self.readSegment = self.readSegment + 1
+            self.readOffset = 0
+
+
+    def remap(self, size, need):
+        '''Maps a window of the read segment from the read
+        position, or reads the rest of the segment into memory
+        if it is shorter than a window.
+
+        Args:
+            size(int): bytes of the segment that can be read
+            need(int): bytes of the next record at least
+        '''
+        if self.reader is None:
+            self.reader = open(self.segmentPath(self.readSegment), "rb", buffering=0)
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.map = None
+        start = self.readOffset - self.readOffset % mmap.ALLOCATIONGRANULARITY
+        length = min(size - start, max(self.WINDOW_BYTES, self.readOffset - start + need))
+        if length < self.WINDOW_BYTES:
+            self.reader.seek(start)
+            self.map = self.reader.read(length)
+        else:
+            self.map = mmap.mmap(self.reader.fileno(), length, access=mmap.ACCESS_READ, offset=start)
+        self.mapStart = start
+
+
+    def unmap(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.map = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+    def done(self, link):
+        '''Marks a link returned by get as crawled.'''
+        with self.cv:
+            if self.inflight.pop(id(link), None) is not None:
+                self.outstanding = self.outstanding - 1
+
+
+    def checkpoint(self):
+        '''Writes the read position and the links being
+        crawled to disk. Safe to call at any time.
+        '''
+        with self.cv:
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+            state = {"segment": self.readSegment,
+                     "offset": self.readOffset,
+                     "inflight": list(self.inflight.values())}
+            path = os.path.join(self.directory, "checkpoint.json")
+            with open(path + ".tmp", "w") as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            self.lastCheckpoint = time.monotonic()
+            #segments before the checkpoint are not read again
+            while self.firstSegment < self.readSegment:
+                self.retire(self.firstSegment)
+                self.firstSegment = self.firstSegment + 1
+
+
+    def retire(self, segment):
+        '''Adds the urls of a segment that was read to
+        taken.log and deletes the segment.
+        '''
+        path = self.segmentPath(segment)
+        if not os.path.exists(path):
+            return
+        urls = set(self.records(path, 0))
+        with open(os.path.join(self.directory, "taken.log"), "ab") as f:
+            for url in urls:
+                data = url.encode("utf-8")
+                f.write(self.HEADER.pack(len(data), 0, 0))
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.remove(path)
+
+
+    def taken(self):
+        '''Yields the url of every link that was handed out
+        before the last checkpoint and is not queued again,
+        so the crawled set can be rebuilt when resuming.
+        '''
+        with self.cv:
+            end = (self.readSegment, self.readOffset)
+            first = self.firstSegment
+            self.writer.flush()
+        taken = os.path.join(self.directory, "taken.log")
+        if os.path.exists(taken):
+            for url in self.records(taken, 0):
+                if url not in self.requeued:
+                    yield url
+        for segment in range(first, end[0] + 1):
+            limit = end[1] if segment == end[0] else None
+            for url in self.records(self.segmentPath(segment), 0, limit):
+                if url not in self.requeued:
+                    yield url
+
+
+    def records(self, path, start, limit=None):
+        '''Yields the urls of a log file from offset start
+        up to offset limit or the end of the file.
+        '''
+        with open(path, "rb") as f:
+            f.seek(start)
+            offset = start
+            while limit is None or offset < limit:
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                length, depth, seed = self.HEADER.unpack(header)
+                yield f.read(length).decode("utf-8")
+                offset = offset + self.HEADER.size + length
+
+
+    def unread(self):
+        '''Returns the number of links not handed out yet.'''
+        with self.cv:
+            return self.outstanding - len(self.inflight)
+
+
+    def close(self, finished=True):
+        '''Closes the frontier. A finished crawl has nothing
+        to resume, so its files are removed, otherwise a final
+        checkpoint is written.
+
+        Args:
+            finished(bool): whether the crawl ran to the end
+        '''
+        if finished:
+            self.remove()
+        else:
+            self.checkpoint()
+            with self.cv:
+                self.unmap()
+                self.writer.close()
+
+
+    def remove(self):
+        with self.cv:
+            self.unmap()
+            if self.writer is not None:
+                self.writer.close()
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if name.startswith("segment-") or name.startswith("checkpoint") or name == "taken.log":
+                        os.remove(os.path.join(self.directory, name))
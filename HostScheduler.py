@@ -0,0 +1,301 @@
+'''
+HostScheduler sits between the Frontier and the worker threads
+and decides which link is crawled next, so that the workers
+spread over every host with work instead of all hammering the
+host whose links happen to be at the front of the queue.
+
+Links are read from the frontier into a subqueue per host, up
+to `buffer` links in all, dropping urls that were crawled already. A host is handed to at most
+`hostConcurrency` workers at once, and not again until its
+crawl delay (the larger of `crawlDelay` and the Crawl-delay of
+its robots.txt) has passed since its last request. Ready hosts
+take turns in the order they became ready.
+
+A link that failed with a transient error is given back with
+retry(link, delay) instead of done(link), and handed out again
+once the delay has passed. Failures of a host go to its
+CircuitBreaker: while the breaker is open the host's links wait
+in its subqueue, and once it half opens only one of them is
+handed out at a time.
+
+It has the same calls as Frontier, so the workers use it as
+their queue. get() blocks until it can hand out a link and
+raises queue.Empty as soon as every link that was ever put has
+been done, which is exactly when the crawl is over, or after
+stop() was called.
+'''
+from CircuitBreaker import CircuitBreaker
+from collections import deque
+import heapq
+import itertools
+import queue
+import threading
+import time
+import urllib.parse
+
+class HostScheduler(object):
+
+    #most links held in the host subqueues by default
+    BUFFER = 10000
+
+    def __init__(self, frontier, robots, alreadyCrawled, hostConcurrency=2, crawlDelay=0.0, buffer=BUFFER,
+                 breaker=None):
+        '''
+        Args:
+            frontier(Frontier): where links are stored, or a PriorityFrontier
+            robots(RobotsCache): crawl delays of the hosts
+            alreadyCrawled(function): takes a url, returns True if it was
+                crawled already and marks it as crawled otherwise
+            hostConcurrency(int): most workers on one host at a time
+            crawlDelay(float): least seconds between requests to one host
+            buffer(int): most links held in the host subqueues
+            breaker(CircuitBreaker): failures of the hosts, CircuitBreaker() if None
+        '''
+        self.frontier = frontier
+        self.robots = robots
+        self.alreadyCrawled = alreadyCrawled
+        self.hostConcurrency = hostConcurrency
+        self.crawlDelay = crawlDelay
+        self.buffer = buffer
+        self.breaker = breaker or CircuitBreaker()
+        self.cv = threading.Condition()
+        self.reset()
+
+
+    def reset(self):
+        #host -> deque of links waiting for it
+        self.queues = {}
+        #host -> number of its links being crawled
+        self.active = {}
+        #host -> earliest time it may be requested again
+        self.nextTime = {}
+        #(ready time, order, host) of hosts that have links and a free slot
+        self.ready = []
+        self.scheduled = set()
+        self.order = itertools.count()
+        self.buffered = 0
+        #(time it is due, order, link) of links to retry
+        self.delayed = []
+        #id(link) -> times it failed and was retried
+        self.attempts = {}
+        self.breaker.reset()
+        self.stopped = False
+
+
+    @staticmethod
+    def hostOf(link):
+        return urllib.parse.urlsplit(link.getURL()).netloc.lower()
+
+
+    def open(self, resume=False):
+        with self.cv:
+            self.reset()
+        return self.frontier.open(resume)
+
+
+    def put(self, link):
+        self.frontier.put(link)
+        with self.cv:
+            self.cv.notify()
+
+
+    def get(self):
+        '''Returns the next link of the host that has been
+        ready the longest, waiting as long as links are still
+        being crawled that may add more. done(link) must be
+        called once it has been crawled. Raises queue.Empty
+        when the crawl is over.
+        '''
+        with self.cv:
+            while True:
+                if self.stopped:
+                    raise queue.Empty
+                self.fill()
+                now = time.monotonic()
+                self.requeue(now)
+                if self.ready and self.ready[0][0] <= now:
+                    host = self.ready[0][2]
+                    until = self.breaker.openUntil(host)
+                    if until <= now:
+                        return self.take(now)
+                    #its breaker opened after it was scheduled
+                    heapq.heapreplace(self.ready, (until, next(self.order), host))
+                    continue
+                wait = None
+                if self.ready or self.delayed:
+                    wait = min(entry[0][0] for entry in (self.ready, self.delayed) if entry) - now
+                elif not self.buffered and self.frontier.outstanding == 0:
+                    #nothing queued, nothing being crawled: done
+                    self.cv.notify_all()
+                    raise queue.Empty
+                self.cv.wait(wait)
+
+
+    def stop(self):
+        '''Makes every get() raise queue.Empty.'''
+        with self.cv:
+            self.stopped = True
+            self.cv.notify_all()
+
+
+    def backlog(self):
+        '''Returns the number of links waiting to be crawled.'''
+        with self.cv:
+            return self.buffered + self.frontier.unread()
+
+
+    def parallelism(self):
+        '''Returns how many workers the hosts with links can
+        take at once. Unknown while links are still unread
+        in the frontier, which gives None.
+        '''
+        with self.cv:
+            if self.frontier.unread():
+                return None
+            hosts = set(self.queues) | set(self.active)
+            return len(hosts) * self.hostConcurrency
+
+
+    def fill(self):
+        '''Moves links from the frontier into the host
+        subqueues. Must be called holding self.cv.
+        '''
+        while self.buffered < self.buffer:
+            try:
+                link = self.frontier.get(False)
+            except queue.Empty:
+                return
+            #drop links that were crawled already, so they never
+            #take up a slot or a crawl delay of their host
+            if self.alreadyCrawled(link.getURL()):
+                self.frontier.done(link)
+                continue
+            host = self.hostOf(link)
+            self.queues.setdefault(host, deque()).append(link)
+            self.buffered = self.buffered + 1
+            self.schedule(host)
+
+
+    def requeue(self, now):
+        '''Moves the links whose retry is due back into their
+        host subqueues. Must be called holding self.cv.
+        '''
+        while self.delayed and self.delayed[0][0] <= now:
+            link = heapq.heappop(self.delayed)[2]
+            host = self.hostOf(link)
+            self.queues.setdefault(host, deque()).append(link)
+            self.buffered = self.buffered + 1
+            self.schedule(host)
+
+
+    def schedule(self, host):
+        '''Puts host in the ready heap if it has links and
+        a free slot. Must be called holding self.cv.
+        '''
+        if host in self.scheduled or not self.queues.get(host):
+            return
+        active = self.active.get(host, 0)
+        if active >= self.hostConcurrency:
+            return
+        until = self.breaker.openUntil(host)
+        if active and until:
+            #an open or half open host is tried by one worker
+            return
+        self.scheduled.add(host)
+        heapq.heappush(self.ready, (max(self.nextTime.get(host, 0), until), next(self.order), host))
+
+
+    def take(self, now):
+        readyTime, order, host = heapq.heappop(self.ready)
+        self.scheduled.discard(host)
+        links = self.queues[host]
+        link = links.popleft()
+        if not links:
+            del self.queues[host]
+        self.buffered = self.buffered - 1
+        self.active[host] = self.active.get(host, 0) + 1
+        #the links of a host given up are failed without a request
+        delay = 0.0
+        if not self.breaker.dead(host):
+            delay = max(self.crawlDelay, self.robots.crawlDelay(link.getURL()))
+        self.nextTime[host] = now + delay
+        self.schedule(host)
+        return link
+
+
+    def done(self, link, failed=False):
+        '''Marks a link returned by get as crawled, which
+        frees a slot of its host.
+
+        Args:
+            link(Link): the link
+            failed(bool): whether it failed with a transient error
+                after its last retry, which counts towards its host's breaker
+        '''
+        host = self.hostOf(link)
+        with self.cv:
+            self.attempts.pop(id(link), None)
+            self.release(host, failed)
+            self.frontier.done(link)
+            self.cv.notify_all()
+
+
+    def retry(self, link, delay):
+        '''Gives back a link returned by get that failed with
+        a transient error, to be handed out again after delay
+        seconds. It counts towards its host's breaker and stays
+        undone in the frontier, so a checkpoint keeps it.
+
+        Args:
+            link(Link): the link
+            delay(float): seconds until it is retried
+        '''
+        host = self.hostOf(link)
+        with self.cv:
+            self.attempts[id(link)] = self.attempts.get(id(link), 0) + 1
+            heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.order), link))
+            self.release(host, True)
+            self.cv.notify_all()
+
+
+    def attempt(self, link):
+        '''Returns which try of a link returned by get this
+        is, from 1.
+        '''
+        with self.cv:
+            return self.attempts.get(id(link), 0) + 1
+
+
+    def gaveUp(self, link):
+        '''True if the breaker of the link's host gave it up.'''
+        with self.cv:
+            return self.breaker.dead(self.hostOf(link))
+
+
+    def release(self, host, failed):
+        '''Frees a slot of host and tells its breaker how the
+        request went. Must be called holding self.cv.
+        '''
+        if failed:
+            self.breaker.failure(host, time.monotonic())
+        else:
+            self.breaker.success(host)
+        self.active[host] = self.active[host] - 1
+        #forget idle hosts once their delay has passed
+        if self.active[host] == 0 and host not in self.queues:
+            del self.active[host]
+            if self.nextTime.get(host, 0) <= time.monotonic():
+                self.nextTime.pop(host, None)
+        self.schedule(host)
+
+
+    def taken(self):
+        return self.frontier.taken()
+
+
+    def checkpoint(self):
+        self.frontier.checkpoint()
+
+
+    def close(self, finished=True):
+        self.frontier.close(finished)
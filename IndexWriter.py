@@ -0,0 +1,222 @@
+'''
+IndexWriter is the stage that writes the word index. Crawl
+threads hand it the words of every new page and carry on
+crawling, while a background thread merges the postings of
+many pages in memory and flushes them to MongoDB as one
+unordered bulk insert of PostingList blocks.
+
+Every posting keeps the positions of the word on the page and
+the length of the page, and every flush adds the number and
+total length of the pages it wrote to the docStats counter, so
+queries can be ranked with BM25.
+
+A flush happens when maxPostings postings are buffered or
+flushInterval seconds have passed, whichever is first. close()
+flushes whatever is left with a journaled write concern, so
+the whole crawl is on disk once crawlURL returns, and then
+merges words that were left with many small blocks.
+
+If a flush fails the background thread stops and puts the
+postings it took back into the buffer, and add() and close()
+raise the error instead of waiting for a thread that is gone.
+'''
+from PostingList import PostingList
+from pymongo.write_concern import WriteConcern
+import threading
+import time
+
+class IndexWriter(object):
+
+    #words given at least this many blocks in a crawl are compacted by close()
+    COMPACT_BLOCKS = 8
+
+    def __init__(self, words, maxPostings=20000, flushInterval=2.0, counters=None):
+        '''
+        Args:
+            words: MongoDB collection of the word index
+            maxPostings(int): buffered (word, url) pairs that trigger a flush
+            flushInterval(float): most seconds between flushes
+            counters: MongoDB collection the docStats counter is kept in
+        '''
+        self.words = words
+        self.counters = counters
+        self.maxPostings = maxPostings
+        self.flushInterval = flushInterval
+        self.cv = threading.Condition()
+        #word -> list of (document id, positions, length) waiting to be written
+        self.pending = {}
+        #pages and their total length waiting to be written
+        self.pendingDocs = 0
+        self.pendingLength = 0
+        #word -> blocks written for it during this crawl
+        self.blockCounts = {}
+        self.pendingCount = 0
+        self.closed = False
+        #what the last flush of the background thread raised
+        self.error = None
+        self.flushes = 0
+        self.thread = None
+
+
+    def start(self):
+        '''Starts the background flushing thread.'''
+        self.closed = False
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def add(self, docId, words):
+        '''Buffers the postings of one page. Only waits
+        if the buffer has grown to several flushes worth
+        because MongoDB can not keep up. Raises the error
+        of the background thread if a flush failed.
+
+        Args:
+            docId(int): document id of the page
+            words(list): words of the page in order, from WebScraper.crawlText
+        '''
+        positions = {}
+        for position, word in enumerate(words):
+            positions.setdefault(word, []).append(position)
+        length = len(words)
+        with self.cv:
+            while self.pendingCount >= 4 * self.maxPostings and not self.closed and self.error is None:
+                self.cv.wait()
+            if self.error is not None:
+                raise self.error
+            for word, wordPositions in positions.items():
+                self.pending.setdefault(word, []).append((docId, wordPositions, length))
+            self.pendingCount = self.pendingCount + len(positions)
+            self.pendingDocs = self.pendingDocs + 1
+            self.pendingLength = self.pendingLength + length
+            if self.pendingCount >= self.maxPostings:
+                self.cv.notify_all()
+
+
+    def run(self):
+        last = time.monotonic()
+        while True:
+            with self.cv:
+                while not self.closed and self.pendingCount < self.maxPostings:
+                    remaining = self.flushInterval - (time.monotonic() - last)
+                    if remaining <= 0:
+                        break
+                    self.cv.wait(remaining)
+                if self.closed:
+                    return
+                pending, docs, length = self.takePending()
+            try:
+                self.flush(pending, self.words, docs, length)
+            except Exception as e:
+                with self.cv:
+                    #keep the postings and stop, add() and close() raise
+                    self.putBack(pending, docs, length)
+                    self.error = e
+                    self.cv.notify_all()
+                return
+            last = time.monotonic()
+
+
+    def putBack(self, pending, docs, length):
+        '''Returns postings taken by takePending to the front
+        of the buffer. Must be called holding self.cv.
+        '''
+        for word, postings in pending.items():
+            self.pending[word] = postings + self.pending.get(word, [])
+            self.pendingCount = self.pendingCount + len(postings)
+        self.pendingDocs = self.pendingDocs + docs
+        self.pendingLength = self.pendingLength + length
+
+
+    def takePending(self):
+        '''Swaps out the buffer. Must be called holding self.cv.'''
+        pending = (self.pending, self.pendingDocs, self.pendingLength)
+        self.pending = {}
+        self.pendingCount = 0
+        self.pendingDocs = 0
+        self.pendingLength = 0
+        self.cv.notify_all()
+        return pending
+
+
+    def flush(self, pending, words, docs=0, length=0):
+        '''Writes merged postings as one unordered bulk insert
+        of new blocks, so no existing document is rewritten.
+
+        Args:
+            pending(dict): word -> list of (document id, positions, length)
+            words: collection to write to
+            docs(int): pages the postings are from
+            length(int): total words of those pages
+        '''
+        if not pending:
+            return
+        documents = []
+        blockCounts = {}
+        for word, postings in pending.items():
+            blocks = PostingList.blocks(word, postings)
+            blockCounts[word] = len(blocks)
+            documents.extend(blocks)
+        words.insert_many(documents, ordered=False)
+        for word, count in blockCounts.items():
+            self.blockCounts[word] = self.blockCounts.get(word, 0) + count
+        if self.counters is not None and docs:
+            self.counters.update_one({"_id": "docStats"}, 
+                                     {"$inc": {"docs": docs, "length": length}}, upsert=True)
+        self.flushes = self.flushes + 1
+
+
+    def compact(self, word, words):
+        '''Merges all blocks of a word into as few full
+        blocks as possible. The new blocks are written before
+        the old ones are removed, so a crash in between only
+        leaves ids that are stored twice.
+
+        Args:
+            word(str): the word to compact
+            words: collection to write to
+        '''
+        oldIds = []
+        postings = []
+        for post in words.find({"word": word, "ids": {"$exists": True}}):
+            oldIds.append(post["_id"])
+            postings.extend(PostingList.readPostings(post))
+        blocks = PostingList.blocks(word, postings)
+        if len(blocks) >= len(oldIds):
+            return
+        words.insert_many(blocks)
+        words.delete_many({"_id": {"$in": oldIds}})
+
+
+    def close(self, compact=True):
+        '''Stops the background thread and flushes everything
+        that is still buffered, waiting for the journal. Raises
+        the error of the background thread if a flush failed,
+        leaving the postings in the buffer.
+
+        Args:
+            compact(bool): compact the words given many blocks; a
+                process of a distributed crawl leaves that and its
+                blockCounts to the process that started the crawl
+        '''
+        with self.cv:
+            self.closed = True
+            self.cv.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.cv:
+            if self.error is not None:
+                raise self.error
+            pending, docs, length = self.takePending()
+        words = self.words.with_options(write_concern=WriteConcern(j=True))
+        self.flush(pending, words, docs, length)
+        if not compact:
+            return
+        #the crawl is durable now, and compact() is safe to lose 
+        #halfway, so its writes do not wait for the journal
+        for word, count in self.blockCounts.items():
+            if count >= self.COMPACT_BLOCKS:
+                self.compact(word, self.words)
+        self.blockCounts = {}
@@ -7,9 +7,16 @@ queue that the threads will retrieve and then crawl.
 '''
 
 class Link(object):
-    def __init__(self, url, depth):
+    #the frontier can hold millions of links, so no __dict__
+    __slots__ = ("_url", "_depth", "_seed")
+    
+    def __init__(self, url, depth, seed=0):
         self._url = url
-        self._depth = depth
+        #small ints are shared objects, so every link at
+        #the same depth points to the same int
+        self._depth = int(depth)
+        #number of the start url it was found from, in a batch
+        self._seed = seed
     
     def __str__(self):
         return self._url + ", " + str(self._depth)
@@ -18,4 +25,7 @@ class Link(object):
         return self._url
     
     def getDepth(self):
-        return int(self._depth)
\ No newline at end of file
+        return int(self._depth)
+    
+    def getSeed(self):
+        return self._seed
\ No newline at end of file
@@ -0,0 +1,138 @@
+'''
+LinkGraph keeps the links between crawled pages, so PageRank
+can be computed from them after the crawl.
+
+Every stored page gets one document in the graph collection:
+
+    {"source": 17, "count": 42, "targets": <bytes>}
+
+source is the docId of the page, and targets the links found on
+it. A link is stored as a 63 bit hash of its URLCanonicalizer key,
+not as a document id, because most links point at pages that have
+not been crawled yet and have no id. The hashes are sorted and
+written as PostingList varint gaps, about 9 bytes a link.
+
+edges() turns the graph back into document ids in chunks of
+numpy arrays. The hashes of the crawled pages are held in one
+sorted array and the targets of a chunk are looked up in it with
+searchsorted, so only the pages and one chunk of edges are ever
+in memory. Links to pages that were never crawled are dropped.
+'''
+from PostingList import PostingList
+from Storage import Storage
+from URLCanonicalizer import URLCanonicalizer
+import hashlib
+import numpy
+import pymongo
+
+class LinkGraph(object):
+
+    #edges handed out by edges() at a time
+    CHUNK_EDGES = 1 << 20
+
+    def __init__(self, collection, urlsCrawled, chunkEdges=CHUNK_EDGES):
+        '''
+        Args:
+            collection: MongoDB collection the links are kept in
+            urlsCrawled: MongoDB collection of the crawled urls
+            chunkEdges(int): most edges in one chunk of edges()
+        '''
+        self.collection = collection
+        self.urlsCrawled = urlsCrawled
+        self.chunkEdges = chunkEdges
+
+
+    @staticmethod
+    def key(url):
+        '''Returns the 63 bit hash a url is stored as.'''
+        digest = hashlib.blake2b(URLCanonicalizer.key(url).encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") >> 1
+
+
+    def createIndex(self):
+        self.collection.create_index([("source", pymongo.ASCENDING)], unique = True)
+
+
+    def add(self, docId, links):
+        '''Stores the links of a page, in place of the ones
+        stored by an earlier crawl of it.
+
+        Args:
+            docId(int): document id of the page
+            links(iterable): urls the page links to
+        '''
+        targets = sorted({self.key(link) for link in links})
+        self.collection.update_one({"source": docId},
+                                   {"$set": {"count": len(targets),
+                                             "targets": PostingList.encode(targets)}},
+                                   upsert = True)
+
+
+    def pages(self):
+        '''Returns the document ids of the crawled pages and
+        their url hashes, both as numpy arrays sorted by hash.
+        '''
+        ids = []
+        keys = []
+        for post in self.urlsCrawled.find({"docId": {"$exists": True}}, {"_id": 0, "url": 1, "docId": 1}):
+            ids.append(post["docId"])
+            keys.append(self.key(post["url"]))
+        ids = numpy.array(ids, dtype=numpy.int64)
+        keys = numpy.array(keys, dtype=numpy.int64)
+        order = numpy.argsort(keys, kind="stable")
+        return ids[order], keys[order]
+
+
+    def edges(self, ids, keys):
+        '''Yields (sources, targets) chunks of the links
+        between crawled pages, as numpy arrays of positions
+        in ids.
+
+        Args:
+            ids(numpy.ndarray): document ids of the pages, from pages()
+            keys(numpy.ndarray): their url hashes, sorted
+        '''
+        byId = numpy.argsort(ids, kind="stable")
+        sortedIds = ids[byId]
+        sources = []
+        targets = []
+        size = 0
+        for post in self.collection.find({}, {"_id": 0, "source": 1, "targets": 1}):
+            found = numpy.searchsorted(sortedIds, post["source"])
+            if found == len(sortedIds) or sortedIds[found] != post["source"]:
+                #the page is no longer in urlsCrawled
+                continue
+            linked = numpy.array(PostingList.decode(post["targets"]), dtype=numpy.int64)
+            if len(linked) == 0:
+                continue
+            places = numpy.searchsorted(keys, linked)
+            places[places == len(keys)] = 0
+            places = places[keys[places] == linked]
+            sources.append(numpy.full(len(places), byId[found], dtype=numpy.int64))
+            targets.append(places)
+            size = size + len(places)
+            if size >= self.chunkEdges:
+                yield numpy.concatenate(sources), numpy.concatenate(targets)
+                sources = []
+                targets = []
+                size = 0
+        if size:
+            yield numpy.concatenate(sources), numpy.concatenate(targets)
+
+
+    def saveScores(self, ids, scores, batch=10000):
+        '''Writes the PageRank of every page to urlsCrawled.
+
+        Args:
+            ids(numpy.ndarray): document ids of the pages
+            scores(numpy.ndarray): their PageRank, in the same order
+            batch(int): updates sent to MongoDB at once
+        '''
+        updates = []
+        for docId, score in zip(ids.tolist(), scores.tolist()):
+            updates.append(Storage.updateOne({"docId": docId}, {"$set": {"pagerank": score}}))
+            if len(updates) == batch:
+                Storage.bulkWrite(self.urlsCrawled, updates, ordered=False)
+                updates = []
+        if updates:
+            Storage.bulkWrite(self.urlsCrawled, updates, ordered=False)
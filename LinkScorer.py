@@ -0,0 +1,51 @@
+'''
+LinkScorer is the default score of a PriorityFrontier, which
+crawls the links with the highest score first. Any function of
+(url, depth, inlinks) that returns a number can be used instead.
+
+The score adds up:
+
+    depthWeight * depth              depth is the depth left, so links
+                                     closer to the start url score higher
+    inlinkWeight * log2(1 + inlinks) pages many crawled pages link to
+    sameHostWeight                   if the link is on the host of the start url
+    weight of every pattern          regular expressions searched for in the url,
+                                     e.g. ("/products/", 2.0) or ("[?&]sort=", -3.0)
+'''
+import math
+import re
+import urllib.parse
+
+class LinkScorer(object):
+
+    def __init__(self, seed=None, depthWeight=1.0, inlinkWeight=1.0, sameHostWeight=1.0, patterns=()):
+        '''
+        Args:
+            seed(str): start url of the crawl, whose host is preferred
+            depthWeight(float): score per level of depth left
+            inlinkWeight(float): score per doubling of the in-links
+            sameHostWeight(float): score of links on the host of seed
+            patterns(iterable): (regular expression, weight) pairs
+        '''
+        self.host = urllib.parse.urlsplit(seed).netloc.lower() if seed else None
+        self.depthWeight = depthWeight
+        self.inlinkWeight = inlinkWeight
+        self.sameHostWeight = sameHostWeight
+        self.patterns = [(re.compile(pattern), weight) for pattern, weight in patterns]
+
+
+    def __call__(self, url, depth, inlinks):
+        '''Returns the score of a link.
+
+        Args:
+            url(str): the link
+            depth(int): depth left after crawling it
+            inlinks(int): crawled pages found linking to it
+        '''
+        score = self.depthWeight * depth + self.inlinkWeight * math.log2(1 + inlinks)
+        if self.host is not None and urllib.parse.urlsplit(url).netloc.lower() == self.host:
+            score = score + self.sameHostWeight
+        for pattern, weight in self.patterns:
+            if pattern.search(url):
+                score = score + weight
+        return score
@@ -0,0 +1,190 @@
+'''
+LinkTextExtractor pulls the links and the words out of a
+page in a single pass, without building a tree. It is built
+on the incremental tokenizer html.parser.HTMLParser, so bytes
+can be fed in as they are downloaded.
+
+Links are the href of every <a> tag, resolved against the url
+of the page. Words are the text of the page outside of <script>
+and <style>, normalized the way WebScraper always has: split on
+line breaks and double spaces, everything but letters, digits
+and spaces removed, and lowercased.
+'''
+from html.parser import HTMLParser
+import codecs
+import re
+import time
+import urllib.parse
+
+class LinkTextExtractor(HTMLParser):
+
+    SKIP_TAGS = ("script", "style")
+    #how far into a page to look for a <meta> charset
+    SNIFF_BYTES = 2048
+    META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.I)
+    NON_ALPHANUMERIC = re.compile("[^0-9a-zA-Z ]+")
+    LINE_BREAK = re.compile("\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+
+    def __init__(self, url, encoding=None):
+        '''
+        Args:
+            url(str): url of the page, links are resolved against it
+            encoding(str): charset of the page, sniffed from the
+                first bytes fed in if not given
+        '''
+        super().__init__(convert_charrefs=True)
+        self.url = url
+        self.encoding = encoding
+        self.decoder = None
+        self.sniffed = b""
+        self.links = []
+        self.words = []
+        self.skipping = None
+        #text since the last line break that was seen
+        self.line = []
+        #seconds spent in feedBytes and close
+        self.seconds = 0.0
+
+
+    @classmethod
+    def extract(cls, url, html, encoding=None):
+        '''Returns the links and words of a whole page.
+
+        Args:
+            url(str): url of the page
+            html(bytes or str): body of the page
+            encoding(str): charset of the page if html is bytes
+        '''
+        extractor = cls(url, encoding)
+        if isinstance(html, str):
+            extractor.feed(html)
+        else:
+            extractor.feedBytes(html)
+        extractor.close()
+        return extractor.links, extractor.words
+
+
+    def feedBytes(self, data):
+        '''Feeds the next piece of the raw page.
+
+        Args:
+            data(bytes): the next bytes of the page
+        '''
+        if self.decoder is None:
+            #wait for enough bytes to find a <meta> charset
+            self.sniffed = self.sniffed + data
+            if self.encoding is None and len(self.sniffed) < self.SNIFF_BYTES:
+                return
+            data = self.sniffed
+            self.sniffed = b""
+            self.startDecoder(data)
+        start = time.perf_counter()
+        self.feed(self.decoder.decode(data))
+        self.seconds = self.seconds + time.perf_counter() - start
+
+
+    def startDecoder(self, data):
+        #a byte order mark wins even over the charset of the response
+        if self.encoding is None or self.bom(data):
+            self.encoding = self.sniffEncoding(data)
+        try:
+            self.decoder = codecs.getincrementaldecoder(self.encoding)("replace")
+        except LookupError:
+            self.encoding = "utf-8"
+            self.decoder = codecs.getincrementaldecoder(self.encoding)("replace")
+
+
+    @classmethod
+    def sniffEncoding(cls, data):
+        '''Guesses the charset of a page from a byte
+        order mark or a <meta> tag, otherwise utf-8.
+        Pages that are not valid utf-8 fall back to
+        windows-1252 like browsers do.
+        '''
+        bom = cls.bom(data)
+        if bom:
+            return bom
+        match = cls.META_CHARSET.search(data[:cls.SNIFF_BYTES])
+        if match:
+            return match.group(1).decode("ascii").lower()
+        try:
+            data.decode("utf-8")
+        except UnicodeDecodeError as e:
+            #a multi-byte character cut off at the end is still utf-8
+            if e.start < len(data) - 3:
+                return "windows-1252"
+        return "utf-8"
+
+
+    @staticmethod
+    def bom(data):
+        '''Returns the charset named by the byte order mark
+        data starts with, or None.
+        '''
+        if data.startswith(codecs.BOM_UTF8):
+            return "utf-8-sig"
+        if data.startswith(codecs.BOM_UTF16_LE) or data.startswith(codecs.BOM_UTF16_BE):
+            return "utf-16"
+        return None
+
+
+    def close(self):
+        start = time.perf_counter()
+        if self.decoder is None and self.sniffed:
+            self.startDecoder(self.sniffed)
+            self.feed(self.decoder.decode(self.sniffed))
+        if self.decoder is not None:
+            self.feed(self.decoder.decode(b"", True))
+        super().close()
+        self.addLine("".join(self.line))
+        self.line = []
+        self.seconds = self.seconds + time.perf_counter() - start
+
+
+    def handle_starttag(self, tag, attrs):
+        if self.skipping is not None:
+            return
+        if tag in self.SKIP_TAGS:
+            self.skipping = tag
+        elif tag == "a":
+            for name, value in attrs:
+                if name == "href" and value is not None:
+                    self.links.append(urllib.parse.urljoin(self.url, value.strip()))
+                    break
+
+
+    def handle_startendtag(self, tag, attrs):
+        #<script/> has no content to skip
+        if tag == "a":
+            self.handle_starttag(tag, attrs)
+
+
+    def handle_endtag(self, tag):
+        if tag == self.skipping:
+            self.skipping = None
+
+
+    def handle_data(self, data):
+        if self.skipping is not None:
+            return
+        pieces = self.LINE_BREAK.split(data)
+        if len(pieces) == 1:
+            self.line.append(data)
+            return
+        self.line.append(pieces[0])
+        self.addLine("".join(self.line))
+        for piece in pieces[1:-1]:
+            self.addLine(piece)
+        self.line = [pieces[-1]]
+
+
+    def unknown_decl(self, data):
+        #CDATA sections are text, other declarations are not
+        if data.startswith("CDATA["):
+            self.handle_data(data[6:])
+
+
+    def addLine(self, line):
+        '''Normalizes one complete line of text into words.'''
+        for phrase in line.split("  "):
+            self.words.extend(self.NON_ALPHANUMERIC.sub("", phrase.strip()).lower().split())
@@ -0,0 +1,111 @@
+'''
+PageRank computes how important every crawled page is from
+the links between them, by power iteration on a SciPy sparse
+matrix.
+
+The link matrix is built from chunks of edges, as LinkGraph
+hands them out: each chunk becomes its own compressed sparse
+column matrix as soon as it is read, with a column for each page
+the chunk has links from, so the graph is never held as Python
+lists or as one big list of edges. An edge takes 8 bytes of
+matrix, a float32 link weight and an int32 row, so tens of
+millions of edges take a few hundred megabytes. Each iteration
+is one sparse matrix-vector product per chunk:
+
+    rank = damping * (M @ rank + dangling / n) + (1 - damping) / n
+
+where M[target, source] is 1 / outlinks(source), and dangling is
+the rank of the pages without links, which is spread over all
+pages. Iteration stops once the L1 change of the ranks is below
+tolerance.
+
+Scores are scaled so the average page has 1.0, which keeps them
+comparable between crawls of different sizes.
+'''
+import numpy
+import scipy.sparse
+import time
+
+class PageRank(object):
+
+    DAMPING = 0.85
+    TOLERANCE = 1e-6
+    MAX_ITERATIONS = 100
+
+    def __init__(self, damping=DAMPING, tolerance=TOLERANCE, maxIterations=MAX_ITERATIONS):
+        '''
+        Args:
+            damping(float): chance of following a link instead of jumping to any page
+            tolerance(float): L1 change of the ranks at which to stop
+            maxIterations(int): most iterations
+        '''
+        self.damping = damping
+        self.tolerance = tolerance
+        self.maxIterations = maxIterations
+        self.edges = 0
+        self.iterations = 0
+        self.change = 0.0
+        self.buildTime = 0.0
+        self.convergenceTime = 0.0
+
+
+    def build(self, pages, chunks):
+        '''Returns the link matrix chunks, as (sources,
+        matrix) pairs, and the number of links of every page.
+
+        Args:
+            pages(int): number of pages
+            chunks(iterable): (sources, targets) arrays of page positions
+        '''
+        matrices = []
+        outlinks = numpy.zeros(pages, dtype=numpy.int64)
+        for sources, targets in chunks:
+            outlinks = outlinks + numpy.bincount(sources, minlength=pages)
+            #one column per page of the chunk that has links
+            columns, column = numpy.unique(sources, return_inverse=True)
+            matrix = scipy.sparse.csc_matrix((numpy.ones(len(sources), dtype=numpy.float32),
+                                              (targets.astype(numpy.int32), column.astype(numpy.int32))),
+                                             shape=(pages, len(columns)))
+            matrices.append((columns, matrix))
+            self.edges = self.edges + len(sources)
+        #weight each link by 1 / outlinks of its source
+        weights = numpy.zeros(pages, dtype=numpy.float32)
+        linked = outlinks > 0
+        weights[linked] = 1.0 / outlinks[linked]
+        for columns, matrix in matrices:
+            matrix.data = matrix.data * numpy.repeat(weights[columns], numpy.diff(matrix.indptr))
+        return matrices, outlinks
+
+
+    def compute(self, pages, chunks):
+        '''Returns the PageRank of every page as a numpy
+        array, scaled so the average is 1.0.
+
+        Args:
+            pages(int): number of pages
+            chunks(iterable): (sources, targets) arrays of page positions, from LinkGraph.edges
+        '''
+        self.edges = 0
+        self.iterations = 0
+        self.change = 0.0
+        if pages == 0:
+            return numpy.zeros(0)
+        start = time.perf_counter()
+        matrices, outlinks = self.build(pages, chunks)
+        dangling = outlinks == 0
+        self.buildTime = time.perf_counter() - start
+        start = time.perf_counter()
+        rank = numpy.full(pages, 1.0 / pages)
+        while self.iterations < self.maxIterations:
+            spread = rank[dangling].sum() / pages
+            following = numpy.zeros(pages)
+            for columns, matrix in matrices:
+                following = following + matrix @ rank[columns]
+            previous = rank
+            rank = self.damping * (following + spread) + (1 - self.damping) / pages
+            self.iterations = self.iterations + 1
+            self.change = numpy.abs(rank - previous).sum()
+            if self.change < self.tolerance:
+                break
+        self.convergenceTime = time.perf_counter() - start
+        return rank * pages
@@ -0,0 +1,125 @@
+'''
+ParserBenchmark checks that LinkTextExtractor finds the same
+links and words as the BeautifulSoup parsing it replaced, and
+times both on every page of a small corpus.
+
+The BeautifulSoup reference removes all script and style
+elements first and then normalizes the text once, which is
+what WebScraper.crawlText was meant to do.
+
+Usage: python ParserBenchmark.py [repeats]
+'''
+from LinkTextExtractor import LinkTextExtractor
+from bs4 import BeautifulSoup
+import re
+import sys
+import time
+import urllib.parse
+
+BASE = "http://www.example.com/news/index.html"
+
+CORPUS = {
+    "plain": b"<html><head><title>Hello World</title></head>"
+             b"<body><p>Some text here.</p><a href='/about'>About us</a></body></html>",
+    "no script or style": b"<p>Pages   without scripts\nstill have words</p>",
+    "scripts and styles": b"<html><head><style>body { color: red; }</style>"
+                          b"<script>var x = '<a href=\"/fake\">no</a>';</script></head>"
+                          b"<body>Real <b>text</b><script type='text/javascript'>alert(1)</script>"
+                          b" after<style>p{}</style>end</body></html>",
+    "self closing script": b"<p>before<script src='x.js'/>after</p><a href=x.html>x</a>",
+    "entities": b"<p>Fish &amp; Chips &mdash; &#169; 2017 caf&eacute; &nbsp;menu</p>",
+    "comments and doctype": b"<!DOCTYPE html><!-- a comment with words --><p>visible</p>"
+                            b"<?php echo 1 ?><![CDATA[cdata words]]>",
+    "adjacent text nodes": b"<p>foo</p><p>bar</p><div>one<span>two</span>three</div>",
+    "whitespace": b"<p>\ttabbed\twords\r\n  indented  line  \x0c form feed\r last</p>",
+    "links": b"<a href=' relative/page.html '>r</a><a href='http://other.org/x'>abs</a>"
+             b"<a href='../up.html'>up</a><a href='/http-guide'>guide</a><a>no href</a>"
+             b"<A HREF='#frag'>frag</A><a href=''>empty</a><a href=\"?q=1&amp;p=2\">query</a>",
+    "unclosed tags": b"<div><p>open paragraph<li>item one<li>item two<b>bold",
+    "windows-1252": b"<p>na\xefve r\xe9sum\xe9 \x93quoted\x94</p>",
+    "meta charset": b"<meta charset='iso-8859-1'><p>gar\xe7on</p>",
+    "utf-8": "<p>déjà vu — naïve 日本語 words</p>".encode("utf-8"),
+}
+
+
+def generatedPage(paragraphs=400, links=200, scripts=40):
+    '''Returns a large page with many links, paragraphs and
+    scripts, the kind of page the old crawlText was slowest on.
+    '''
+    parts = ["<html><head><title>Generated page</title></head><body>"]
+    for i in range(paragraphs):
+        parts.append("<p>Paragraph %d has   some words, numbers like %d and a "
+                     "<a href='/article/%d.html'>link to article %d</a>.</p>\n" % (i, i * 7, i, i))
+        if i % (paragraphs // scripts) == 0:
+            parts.append("<script>var data%d = {'key': 'value %d'};</script>\n" % (i, i))
+    for i in range(links):
+        parts.append("<li><a href='http://www.example.com/item?id=%d'>Item %d</a></li>\n" % (i, i))
+    parts.append("</body></html>")
+    return "".join(parts).encode("utf-8")
+
+
+def soupExtract(url, html):
+    '''The BeautifulSoup reference for LinkTextExtractor.extract.'''
+    soup = BeautifulSoup(html, "html.parser")
+    links = []
+    for link in soup.find_all('a'):
+        href = link.get('href')
+        if href is not None:
+            links.append(urllib.parse.urljoin(url, href.strip()))
+    for script in soup(["script", "style"]):
+        script.extract()
+    text = soup.get_text()
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    text = '\n'.join(chunk for chunk in chunks if chunk)
+    text = text.replace("\n", " ")
+    text = re.sub("[^0-9a-zA-Z ]+", "", text)
+    return links, text.lower().split()
+
+
+def checkEquivalence(corpus):
+    '''Returns the names of the pages where the extractor
+    and BeautifulSoup disagree, printing the differences.
+    '''
+    failures = []
+    for name, html in corpus.items():
+        expected = soupExtract(BASE, html)
+        actual = LinkTextExtractor.extract(BASE, html)
+        #feeding the page a few bytes at a time must not change anything
+        extractor = LinkTextExtractor(BASE)
+        for i in range(0, len(html), 7):
+            extractor.feedBytes(html[i:i + 7])
+        extractor.close()
+        streamed = (extractor.links, extractor.words)
+        if actual != expected or streamed != expected:
+            failures.append(name)
+            print("MISMATCH", name)
+            print("  soup:     ", expected)
+            print("  extractor:", actual)
+            print("  streamed: ", streamed)
+    return failures
+
+
+def timePage(function, html, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(BASE, html)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def run(repeats=20):
+    corpus = dict(CORPUS)
+    corpus["generated"] = generatedPage()
+    failures = checkEquivalence(corpus)
+    print("%d of %d pages equivalent" % (len(corpus) - len(failures), len(corpus)))
+    print("page                 ---    bytes --- soup ms --- extractor ms --- speedup")
+    for name, html in corpus.items():
+        soup = timePage(soupExtract, html, repeats)
+        extractor = timePage(LinkTextExtractor.extract, html, repeats)
+        print("%-20s --- %8d --- %7.3f --- %12.3f --- %6.1fx"
+              % (name, len(html), soup, extractor, soup / extractor))
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if run(int(sys.argv[1]) if len(sys.argv) > 1 else 20) else 0)
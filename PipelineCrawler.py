@@ -0,0 +1,211 @@
+'''
+PipelineCrawler is the "pipeline" crawl mode of WebCrawler.
+Pages are parsed by LinkTextExtractor, which runs the pure
+Python tokenizer of html.parser and holds the GIL while it
+does, so in threads mode extra threads stop helping once
+parsing is the bottleneck. Here the work is split into stages:
+
+    fetch threads --> fetched --> parser processes --> store threads
+         ^                                                  |
+         +------------------ frontier <---------------------+
+
+Fetch threads only download bytes. A ProcessPoolExecutor
+runs LinkTextExtractor over the pages and sends back their
+links and words, so parsing scales with the number of CPU
+cores. Store threads write the page to MongoDB and queue its
+links. The fetched queue and the number of pages being parsed
+are both bounded, so fast downloads wait for the parsers
+instead of piling up in memory.
+'''
+from WebScraper import WebScraper
+from Link import Link
+from RetryPolicy import RetryPolicy
+from URLCanonicalizer import URLCanonicalizer
+from concurrent.futures import ProcessPoolExecutor
+import os
+import queue
+import threading
+import time
+
+class PipelineCrawler(object):
+
+    def __init__(self, crawler, fetchThreads=16, parseProcesses=None, storeThreads=4, queueSize=64):
+        '''
+        Args:
+            crawler(WebCrawler): crawler whose collections are written to
+            fetchThreads(int): threads downloading pages
+            parseProcesses(int): parser processes, the number of CPUs by default
+            storeThreads(int): threads writing pages to MongoDB
+            queueSize(int): most downloaded pages waiting for a parser
+        '''
+        self.crawler = crawler
+        self.fetchThreads = fetchThreads
+        self.parseProcesses = parseProcesses or os.cpu_count() or 1
+        self.storeThreads = storeThreads
+        self.queueSize = queueSize
+        self.crawlCount = 0
+
+
+    def crawl(self, url, depth):
+        '''Crawls url to depth and returns
+        the number of pages crawled.
+
+        Args:
+            url(str): starting url to crawl
+            depth(int): depth at which to stop crawling
+        '''
+        self.crawlCount = 0
+        self.dontCrawl = self.crawler.newSeenSet()
+        self.frontier = queue.Queue()
+        self.fetched = queue.Queue(maxsize=self.queueSize)
+        self.parsed = queue.Queue()
+        #pages sent to the parsers that have not been stored yet
+        self.parsing = threading.BoundedSemaphore(2 * self.parseProcesses)
+        #links queued that have not been finished yet
+        self.outstanding = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+        self.addLink(Link(url, depth))
+        self.crawler.metrics.watch(self.frontier.qsize, lambda: self.fetchThreads)
+        with ProcessPoolExecutor(self.parseProcesses) as executor:
+            threads = [threading.Thread(target=self.fetcher) for _ in range(self.fetchThreads)]
+            threads.append(threading.Thread(target=self.dispatcher, args=(executor,)))
+            threads.extend(threading.Thread(target=self.storer) for _ in range(self.storeThreads))
+            for t in threads:
+                t.start()
+            self.done.wait()
+            #wake every stage up so it can see the crawl is over
+            for _ in range(self.fetchThreads):
+                self.frontier.put(None)
+            self.fetched.put(None)
+            for _ in range(self.storeThreads):
+                self.parsed.put(None)
+            for t in threads:
+                t.join()
+        return self.crawlCount
+
+
+    def addLink(self, link):
+        with self.lock:
+            self.outstanding = self.outstanding + 1
+        self.frontier.put(link)
+
+
+    def finishLink(self):
+        '''Called once for every link that was added,
+        after it has been skipped, failed or stored.
+        '''
+        with self.lock:
+            self.outstanding = self.outstanding - 1
+            if self.outstanding == 0:
+                self.done.set()
+
+
+    def fetcher(self):
+        while True:
+            link = self.frontier.get()
+            if link is None:
+                return
+            start = time.perf_counter()
+            item = self.fetch(link)
+            #the fetch threads are the workers of this mode, waiting
+            #for the parsers does not count as busy
+            self.crawler.metrics.record("page", time.perf_counter() - start)
+            if item is not None:
+                #blocks while the parsers are behind
+                self.fetched.put(item)
+
+
+    def fetch(self, link):
+        '''Downloads the page of a link and returns what
+        the parsers need, or None if the link was skipped,
+        failed or did not change and is finished already.
+        '''
+        url = link.getURL()
+        if self.dontCrawl.add(URLCanonicalizer.key(url)):
+            self.finishLink()
+            return None
+        #once the budget ran out the links left are dropped
+        if not self.crawler.budget.claim():
+            self.finishLink()
+            return None
+        try:
+            validators = self.crawler.storedValidators(url, self.crawler.urlsCrawled)
+            html, validators, decoder = WebScraper.fetch(url, validators)
+            self.crawler.recordPeak(decoder.peak)
+            self.crawler.budget.charge(decoder.size)
+        except Exception as e:
+            self.crawler.insertError(url, str(e), self.crawler.errors, RetryPolicy.classify(e))
+            self.crawler.budget.release()
+            self.finishLink()
+            return None
+        if html is None:
+            #unchanged since the last crawl, nothing to parse
+            self.revisit(url, link.getDepth(), validators)
+            return None
+        return (url, link.getDepth(), html, decoder.charset, validators)
+
+
+    def revisit(self, url, depth, validators):
+        '''Records a page that did not change and queues
+        the links stored for it.
+        '''
+        try:
+            self.crawler.revisitPage(url, validators, self.crawler.urlsCrawled)
+            with self.lock:
+                self.crawlCount = self.crawlCount + 1
+            if depth > 0:
+                for link in validators.get("links") or []:
+                    self.addLink(Link(link, depth - 1))
+        except Exception as e:
+            self.crawler.insertError(url, str(e), self.crawler.errors, RetryPolicy.classify(e))
+        finally:
+            self.finishLink()
+
+
+    def dispatcher(self, executor):
+        while True:
+            item = self.fetched.get()
+            if item is None:
+                return
+            url, depth, html, encoding, validators = item
+            #blocks while enough pages are already being parsed
+            self.parsing.acquire()
+            future = executor.submit(PipelineCrawler.parse, url, html, encoding)
+            future.add_done_callback(lambda future, url=url, depth=depth, validators=validators:
+                                     self.parsed.put((url, depth, validators, future)))
+
+
+    @staticmethod
+    def parse(url, html, encoding=None):
+        '''Runs WebScraper.parse in a parser process and also
+        returns the seconds it took, since metrics recorded
+        in that process are lost.
+        '''
+        start = time.perf_counter()
+        links, text = WebScraper.parse(url, html, encoding)
+        return links, text, time.perf_counter() - start
+
+
+    def storer(self):
+        while True:
+            item = self.parsed.get()
+            if item is None:
+                return
+            url, depth, validators, future = item
+            self.parsing.release()
+            try:
+                links, text, seconds = future.result()
+                self.crawler.metrics.record("parse", seconds)
+                self.crawler.storePage(url, text, self.crawler.urlsCrawled, validators, links)
+                with self.lock:
+                    self.crawlCount = self.crawlCount + 1
+                if depth > 0:
+                    for link in links:
+                        self.addLink(Link(link, depth - 1))
+            except Exception as e:
+                self.crawler.insertError(url, str(e), self.crawler.errors, RetryPolicy.classify(e))
+                self.crawler.budget.release()
+            finally:
+                self.finishLink()
@@ -0,0 +1,181 @@
+'''
+PostingList stores the pages a word appears on as blocks
+of integer document ids instead of an array of url strings.
+
+The ids of a block are sorted, stored as the gaps between
+neighbours written as varints, and then zlib compressed, so
+a block of thousands of ids takes a few kilobytes. A word is
+spread over as many block documents as it needs:
+
+    {"word": "apple", "first": 17, "last": 9021, "count": 812, "ids": <bytes>,
+     "tfs": <bytes>, "lens": <bytes>, "pos": <bytes>}
+
+For ranking, tfs holds how often the word is on each page and
+lens the number of words of each page. pos holds the positions
+of the word on each page, as gaps from the previous position,
+for phrase queries. They are varints compressed the same way,
+in the order of the ids. Blocks written before they existed
+only have ids.
+
+Document ids are given out by WebCrawler and saved as the
+docId of the page in urlsCrawled.
+'''
+import zlib
+
+class PostingList(object):
+
+    #most ids stored in one block document
+    BLOCK_SIZE = 4096
+
+    @staticmethod
+    def encode(ids):
+        '''Returns the compressed bytes for a sorted list of ids.
+
+        Args:
+            ids(list): sorted, distinct document ids
+        '''
+        gaps = []
+        previous = 0
+        for docId in ids:
+            gaps.append(docId - previous)
+            previous = docId
+        return PostingList.encodeInts(gaps)
+
+
+    @staticmethod
+    def decode(data):
+        '''Returns the sorted list of ids stored in compressed bytes.
+
+        Args:
+            data(bytes): bytes made by encode
+        '''
+        ids = []
+        previous = 0
+        for gap in PostingList.decodeInts(data):
+            previous += gap
+            ids.append(previous)
+        return ids
+
+
+    @staticmethod
+    def encodeInts(values):
+        '''Returns the compressed varints of a list of
+        integers that are 0 or more.
+        '''
+        out = bytearray()
+        for value in values:
+            while value > 0x7f:
+                out.append((value & 0x7f) | 0x80)
+                value >>= 7
+            out.append(value)
+        return zlib.compress(bytes(out))
+
+
+    @staticmethod
+    def decodeInts(data):
+        '''Returns the integers stored by encodeInts.'''
+        values = []
+        value = 0
+        shift = 0
+        for byte in zlib.decompress(data):
+            value |= (byte & 0x7f) << shift
+            if byte & 0x80:
+                shift += 7
+            else:
+                values.append(value)
+                value = 0
+                shift = 0
+        return values
+
+
+    @staticmethod
+    def blocks(word, postings):
+        '''Returns the block documents for the postings of a word.
+
+        Args:
+            word(str): the word
+            postings(iterable): (document id, positions of the word,
+                number of words of the page) of every page the
+                word appears on
+        '''
+        byId = {}
+        for docId, positions, length in postings:
+            byId[docId] = (positions, length)
+        ids = sorted(byId)
+        documents = []
+        for i in range(0, len(ids), PostingList.BLOCK_SIZE):
+            block = ids[i:i + PostingList.BLOCK_SIZE]
+            tfs = []
+            lens = []
+            gaps = []
+            for docId in block:
+                positions, length = byId[docId]
+                tfs.append(len(positions))
+                lens.append(length)
+                previous = 0
+                for position in positions:
+                    gaps.append(position - previous)
+                    previous = position
+            documents.append({"word": word,
+                              "first": block[0],
+                              "last": block[-1],
+                              "count": len(block),
+                              "ids": PostingList.encode(block),
+                              "tfs": PostingList.encodeInts(tfs),
+                              "lens": PostingList.encodeInts(lens),
+                              "pos": PostingList.encodeInts(gaps)})
+        return documents
+
+
+    @staticmethod
+    def read(post):
+        '''Returns the document ids of one document of the
+        words collection. Documents written before posting
+        lists were used hold urls instead and give [].
+
+        Args:
+            post(dict): document from the words collection
+        '''
+        if "ids" not in post:
+            return []
+        return PostingList.decode(post["ids"])
+
+
+    @staticmethod
+    def readPositions(post, ids):
+        '''Returns the positions of the word on each page
+        of a block, in the order of its ids. Blocks without
+        positions give empty lists.
+
+        Args:
+            post(dict): document from the words collection
+            ids(list): its ids, from read
+        '''
+        if "pos" not in post:
+            return [[] for _ in ids]
+        gaps = PostingList.decodeInts(post["pos"])
+        positions = []
+        start = 0
+        for tf in PostingList.decodeInts(post["tfs"]):
+            current = []
+            previous = 0
+            for gap in gaps[start:start + tf]:
+                previous += gap
+                current.append(previous)
+            positions.append(current)
+            start += tf
+        return positions
+
+
+    @staticmethod
+    def readPostings(post):
+        '''Returns the (document id, positions, length)
+        postings of one block, the input of blocks.
+
+        Args:
+            post(dict): document from the words collection
+        '''
+        ids = PostingList.read(post)
+        positions = PostingList.readPositions(post, ids)
+        lens = PostingList.decodeInts(post["lens"]) if "lens" in post else [0] * len(ids)
+        return list(zip(ids, positions, lens))
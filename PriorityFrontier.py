@@ -0,0 +1,275 @@
+'''
+PriorityFrontier is the frontier of a best-first crawl. It has
+the calls of Frontier, but get() returns the waiting link with
+the highest score instead of the oldest one.
+
+Links are kept in memory in a binary heap indexed by url, so a
+url is only queued once: putting it again counts one more
+in-link, keeps the larger depth, and moves it to its new score
+in O(log n) by sifting it up or down from where the index says
+it is. The score is any function of (url, depth, inlinks), a
+LinkScorer by default.
+
+Unlike Frontier the waiting links take memory, about 200 bytes
+each. Every checkpointInterval seconds they are written to
+priority-checkpoint.json with the links being crawled, and
+the url of every link handed out is appended to taken.log, so
+an interrupted crawl can be resumed with open(resume=True).
+'''
+from Link import Link
+from LinkScorer import LinkScorer
+import json
+import os
+import queue
+import threading
+import time
+
+class PriorityFrontier(object):
+
+    #positions in a heap entry
+    SCORE, ORDER, URL, DEPTH, INLINKS = range(5)
+
+    def __init__(self, directory, scorer=None, checkpointInterval=5.0):
+        '''
+        Args:
+            directory(str): where the checkpoint and taken.log are kept
+            scorer(function): takes url, depth and in-links, returns the
+                score of a link, LinkScorer() if None
+            checkpointInterval(float): seconds between checkpoints
+        '''
+        self.directory = directory
+        self.scorer = scorer or LinkScorer()
+        self.checkpointInterval = checkpointInterval
+        self.cv = threading.Condition()
+        self.heap = []
+        #url -> index of its entry in heap
+        self.position = {}
+        self.order = 0
+        #id(link) -> (url, depth) of links handed out but not done
+        self.inflight = {}
+        self.requeued = set()
+        self.takenLog = None
+        self.lastCheckpoint = time.monotonic()
+
+
+    @property
+    def outstanding(self):
+        '''Links put and not done yet, the crawl is over at 0.'''
+        return len(self.heap) + len(self.inflight)
+
+
+    def checkpointPath(self):
+        return os.path.join(self.directory, "priority-checkpoint.json")
+
+
+    def takenPath(self):
+        return os.path.join(self.directory, "taken.log")
+
+
+    def open(self, resume=False):
+        '''Opens the frontier. Returns True if a checkpoint
+        was found and the frontier continues from it, in which
+        case the links that were being crawled are queued again.
+        Otherwise any old frontier is removed.
+
+        Args:
+            resume(bool): continue from the last checkpoint if there is one
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        with self.cv:
+            self.heap = []
+            self.position = {}
+            self.inflight = {}
+            self.requeued = set()
+        if resume and os.path.exists(self.checkpointPath()):
+            with open(self.checkpointPath()) as f:
+                state = json.load(f)
+            #links taken after the checkpoint are crawled again
+            with open(self.takenPath(), "r+b") as f:
+                f.truncate(state["taken"])
+            self.takenLog = open(self.takenPath(), "ab")
+            with self.cv:
+                for url, depth, inlinks in state["queued"]:
+                    self.insert(url, depth, inlinks)
+                for url, depth in state["inflight"]:
+                    self.requeued.add(url)
+                    self.insert(url, depth, 1)
+            return True
+        self.remove()
+        os.makedirs(self.directory, exist_ok=True)
+        self.takenLog = open(self.takenPath(), "ab")
+        return False
+
+
+    def put(self, link):
+        '''Queues a link, or counts another in-link of a url
+        that is queued already.
+        '''
+        url = link.getURL()
+        with self.cv:
+            index = self.position.get(url)
+            if index is None:
+                self.insert(url, link.getDepth(), 1)
+            else:
+                entry = self.heap[index]
+                entry[self.INLINKS] = entry[self.INLINKS] + 1
+                entry[self.DEPTH] = max(entry[self.DEPTH], link.getDepth())
+                entry[self.SCORE] = self.scorer(url, entry[self.DEPTH], entry[self.INLINKS])
+                self.siftDown(self.siftUp(index))
+            self.cv.notify()
+
+
+    def insert(self, url, depth, inlinks):
+        '''Must be called holding self.cv.'''
+        self.order = self.order + 1
+        self.heap.append([self.scorer(url, depth, inlinks), self.order, url, depth, inlinks])
+        self.position[url] = len(self.heap) - 1
+        self.siftUp(len(self.heap) - 1)
+
+
+    def before(self, a, b):
+        '''True if entry a is crawled before entry b: higher
+        score first, then the one queued first.
+        '''
+        if a[self.SCORE] != b[self.SCORE]:
+            return a[self.SCORE] > b[self.SCORE]
+        return a[self.ORDER] < b[self.ORDER]
+
+
+    def swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.position[heap[i][self.URL]] = i
+        self.position[heap[j][self.URL]] = j
+
+
+    def siftUp(self, index):
+        '''Moves an entry towards the root while it goes
+        before its parent and returns where it ended up.
+        '''
+        while index > 0:
+            parent = (index - 1) // 2
+            if not self.before(self.heap[index], self.heap[parent]):
+                break
+            self.swap(index, parent)
+            index = parent
+        return index
+
+
+    def siftDown(self, index):
+        size = len(self.heap)
+        while True:
+            first = index
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < size and self.before(self.heap[child], self.heap[first]):
+                    first = child
+            if first == index:
+                return index
+            self.swap(index, first)
+            index = first
+
+
+    def pop(self):
+        '''Removes and returns the best entry. Must be called
+        holding self.cv.
+        '''
+        self.swap(0, len(self.heap) - 1)
+        entry = self.heap.pop()
+        del self.position[entry[self.URL]]
+        if self.heap:
+            self.siftDown(0)
+        return entry
+
+
+    def get(self, block=True, timeout=None):
+        '''Removes and returns the best link, like
+        queue.Queue.get. Raises queue.Empty if there is none
+        within timeout seconds. done(link) must be called once
+        the link has been crawled.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cv:
+            while not self.heap:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise queue.Empty
+                self.cv.wait(remaining)
+            entry = self.pop()
+            link = Link(entry[self.URL], entry[self.DEPTH])
+            self.inflight[id(link)] = (link.getURL(), link.getDepth())
+            self.takenLog.write(link.getURL().encode("utf-8") + b"\n")
+            if time.monotonic() - self.lastCheckpoint > self.checkpointInterval:
+                self.checkpoint()
+            return link
+
+
+    def done(self, link):
+        '''Marks a link returned by get as crawled.'''
+        with self.cv:
+            self.inflight.pop(id(link), None)
+
+
+    def unread(self):
+        '''Returns the number of links not handed out yet.'''
+        with self.cv:
+            return len(self.heap)
+
+
+    def checkpoint(self):
+        '''Writes the waiting links and the links being
+        crawled to disk. Safe to call at any time.
+        '''
+        with self.cv:
+            self.takenLog.flush()
+            os.fsync(self.takenLog.fileno())
+            state = {"taken": self.takenLog.tell(),
+                     "queued": [entry[self.URL:] for entry in self.heap],
+                     "inflight": list(self.inflight.values())}
+            path = self.checkpointPath()
+            with open(path + ".tmp", "w") as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            self.lastCheckpoint = time.monotonic()
+
+
+    def taken(self):
+        '''Yields the url of every link that was handed out
+        before the last checkpoint and is not queued again,
+        so the crawled set can be rebuilt when resuming.
+        '''
+        with self.cv:
+            self.takenLog.flush()
+            end = self.takenLog.tell()
+        with open(self.takenPath(), "rb") as f:
+            for line in f.read(end).splitlines():
+                url = line.decode("utf-8")
+                if url not in self.requeued:
+                    yield url
+
+
+    def close(self, finished=True):
+        '''Closes the frontier. A finished crawl has nothing
+        to resume, so its files are removed, otherwise a final
+        checkpoint is written.
+
+        Args:
+            finished(bool): whether the crawl ran to the end
+        '''
+        if finished:
+            self.remove()
+        else:
+            self.checkpoint()
+            with self.cv:
+                self.takenLog.close()
+
+
+    def remove(self):
+        with self.cv:
+            if self.takenLog is not None:
+                self.takenLog.close()
+                self.takenLog = None
+            for path in (self.checkpointPath(), self.takenPath()):
+                if os.path.exists(path):
+                    os.remove(path)
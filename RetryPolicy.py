@@ -0,0 +1,93 @@
+'''
+RetryPolicy decides what a failed page was and whether it is
+worth trying again. A timeout, a refused or reset connection, a
+temporary DNS failure or a 408, 429, 500, 502, 503 or 504 usually
+pass, so they are transient; a 404, a page that is not text/html
+or too large, or a bad certificate fail the same way every time,
+so they are permanent.
+
+classify() names the kind of an error, which is what errors are
+counted by. A transient error is retried up to `attempts` times
+in all, each time after a delay that doubles from baseDelay up to
+maxDelay, or after the server's Retry-After if it asked for one.
+The delay is jittered between half and all of it, so the links of
+a host that failed together are not all retried at the same time.
+'''
+from ConnectionPool import HTTPError
+import http.client
+import random
+import socket
+import ssl
+
+class RetryPolicy(object):
+
+    #statuses that a later request may not get
+    TRANSIENT_STATUSES = (408, 429, 500, 502, 503, 504)
+    #kinds of errors that a later request may not get
+    TRANSIENT = {"timeout", "connection", "dns-temporary", "network"}.union(
+        "http %d" % status for status in TRANSIENT_STATUSES)
+
+    def __init__(self, attempts=3, baseDelay=1.0, maxDelay=60.0):
+        '''
+        Args:
+            attempts(int): most times a page is tried, 1 to never retry
+            baseDelay(float): seconds before the first retry
+            maxDelay(float): most seconds before a retry
+        '''
+        self.attempts = attempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+
+
+    @staticmethod
+    def classify(error):
+        '''Returns the kind of an error: "timeout", "connection",
+        "dns", "dns-temporary", "ssl", "network", "http <status>",
+        "content" for a response the crawler can not use, such as
+        one that is not text/html, or "other".
+
+        Args:
+            error(Exception): what fetching or parsing the page raised
+        '''
+        if isinstance(error, HTTPError):
+            return "http %d" % error.status
+        if isinstance(error, socket.timeout):
+            return "timeout"
+        if isinstance(error, socket.gaierror):
+            #EAI_AGAIN: the name server did not answer
+            return "dns-temporary" if error.errno == socket.EAI_AGAIN else "dns"
+        if isinstance(error, ssl.SSLError):
+            return "ssl"
+        if isinstance(error, (ConnectionError, http.client.IncompleteRead, http.client.BadStatusLine)):
+            return "connection"
+        if isinstance(error, OSError):
+            return "network"
+        #raised by the crawler's own checks of the response
+        if type(error) is Exception:
+            return "content"
+        return "other"
+
+
+    def isTransient(self, kind):
+        return kind in self.TRANSIENT
+
+
+    def shouldRetry(self, kind, attempt):
+        '''Returns True if a page that failed with an error
+        of this kind on its attempt-th try is tried again.
+        '''
+        return self.isTransient(kind) and attempt < self.attempts
+
+
+    def delay(self, attempt, retryAfter=None):
+        '''Returns the seconds to wait before trying a page
+        again after its attempt-th try failed.
+
+        Args:
+            attempt(int): tries so far, from 1
+            retryAfter(float): seconds the server asked to wait, or None
+        '''
+        if retryAfter is not None:
+            return min(retryAfter, self.maxDelay)
+        delay = min(self.maxDelay, self.baseDelay * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
@@ -0,0 +1,124 @@
+'''
+RobotsCache fetches and parses the robots.txt of each host
+once and keeps the rules for ttl seconds, so the crawler can
+check every url against them without a request per url.
+
+If robots.txt is missing every url is allowed and if it is
+forbidden (401/403) every url is disallowed, until the rules
+expire. If it can not be fetched at all or the server fails
+(5xx) the host is treated as allowing all, but only for
+errorTtl seconds, so a short outage does not make the crawler
+ignore the host's rules for a whole ttl.
+'''
+from WebScraper import WebScraper
+import threading
+import time
+import urllib.parse
+import urllib.robotparser
+
+class RobotsCache(object):
+
+    AGENT = "Mozilla/5.0"
+
+    def __init__(self, ttl=86400, errorTtl=300):
+        '''
+        Args:
+            ttl(float): seconds the rules of a host are kept
+            errorTtl(float): seconds until a robots.txt that could not
+                be fetched is tried again
+        '''
+        self.ttl = ttl
+        self.errorTtl = errorTtl
+        self.lock = threading.Lock()
+        #host url -> (RobotFileParser, expiry time)
+        self.rules = {}
+        #host url -> Event set when its robots.txt has been loaded
+        self.loading = {}
+
+
+    @staticmethod
+    def hostOf(url):
+        parts = urllib.parse.urlsplit(url)
+        return parts.scheme + "://" + parts.netloc
+
+
+    def allowed(self, url):
+        '''Returns True if robots.txt allows url to be
+        crawled. Fetches robots.txt the first time a host
+        is seen; other threads asking about the same host
+        wait for that one fetch.
+
+        Args:
+            url(str): the url to check
+        '''
+        return self.parser(self.hostOf(url)).can_fetch(self.AGENT, url)
+
+
+    def crawlDelay(self, url):
+        '''Returns the delay between requests that the
+        robots.txt of url's host asks for, or 0. Never
+        fetches robots.txt.
+
+        Args:
+            url(str): any url of the host
+        '''
+        with self.lock:
+            entry = self.rules.get(self.hostOf(url))
+        if entry is None:
+            return 0
+        parser = entry[0]
+        delay = parser.crawl_delay(self.AGENT)
+        if delay is None:
+            rate = parser.request_rate(self.AGENT)
+            if rate is not None and rate.requests:
+                delay = rate.seconds / rate.requests
+        return float(delay or 0)
+
+
+    def parser(self, host):
+        while True:
+            with self.lock:
+                entry = self.rules.get(host)
+                if entry is not None and entry[1] > time.monotonic():
+                    return entry[0]
+                event = self.loading.get(host)
+                if event is None:
+                    event = threading.Event()
+                    self.loading[host] = event
+                    break
+            event.wait()
+        parser = None
+        try:
+            parser, ttl = self.fetch(host)
+        finally:
+            with self.lock:
+                #an interrupted fetch caches nothing, the next caller loads it
+                if parser is not None:
+                    self.rules[host] = (parser, time.monotonic() + ttl)
+                del self.loading[host]
+            event.set()
+        return parser
+
+
+    def fetch(self, host):
+        '''Downloads and parses the robots.txt of host.
+        Returns the parser and the seconds it is kept.
+        '''
+        parser = urllib.robotparser.RobotFileParser(host + "/robots.txt")
+        try:
+            with WebScraper.pool.urlopen(host + "/robots.txt", {'User-Agent': self.AGENT},
+                                         timeout=10, raiseErrors=False) as response:
+                body = response.read()
+            if response.status in (401, 403):
+                parser.disallow_all = True
+            elif response.status >= 500:
+                parser.allow_all = True
+                return parser, self.errorTtl
+            elif response.status >= 400:
+                parser.allow_all = True
+            else:
+                parser.parse(body.decode("utf-8", "replace").splitlines())
+        except Exception:
+            parser.allow_all = True
+            return parser, self.errorTtl
+        return parser, self.ttl
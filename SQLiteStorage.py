@@ -0,0 +1,658 @@
+'''
+SQLiteStorage keeps the crawler's collections in one SQLite
+file, so a crawl runs without a MongoDB server and a write is a
+call into the process instead of a network round trip.
+
+Every collection is a table of BSON documents:
+
+    (id INTEGER PRIMARY KEY, key TEXT UNIQUE, doc BLOB, f_word, f_first, ...)
+
+key is the document's _id. create_index() adds a column for each
+indexed field, copied out of the document on every write, and an
+SQL index over them, unique if asked for. Missing fields are NULL
+and never collide, so unique indexes act like sparse ones. A
+query looks up the first indexed field it compares with a value
+or a $in list, narrowed down by the other indexed fields it bounds
+with $lt/$lte/$gt/$gte and a number, or scans the table, and then
+checks the whole filter on the documents it found. A lookup that
+is the whole filter stops at the first document when only one is
+needed. Only the parts of the query
+language the crawler uses are supported: equality, $in, $nin,
+$exists, $ne, $lt/$lte/$gt/$gte, updates with $set, $unset, $inc
+and $setOnInsert, projections, and sort().
+
+The file is in WAL mode, and writes are grouped into transactions
+of up to BATCH_WRITES writes or BATCH_SECONDS seconds, which is
+what makes many small writes fast. A crash can lose the last
+batch; flush() commits it, and a collection from
+with_options(write_concern=WriteConcern(j=True)) commits after
+every write. All threads share one connection behind a lock.
+
+Several processes can share the file if each opens it with
+shared=True. Every write is then committed at once, so no process
+holds the write lock for a whole batch, and updates take the write
+lock before they read, so a find_one_and_update is atomic across
+processes the way it is in MongoDB.
+'''
+from Storage import Storage
+from contextlib import contextmanager
+import bson
+import pymongo
+import pymongo.errors
+import pymongo.results
+import sqlite3
+import threading
+import time
+
+class SQLiteStorage(Storage):
+
+    #writes and seconds grouped into one transaction
+    BATCH_WRITES = 1000
+    BATCH_SECONDS = 1.0
+
+    #seconds a shared file waits for another process's write lock
+    SHARED_TIMEOUT = 60.0
+
+    def __init__(self, path="crawl.db", shared=False):
+        '''
+        Args:
+            path(str): the SQLite file, created if missing
+            shared(bool): other processes write to the file too
+        '''
+        self.path = path
+        self.shared = shared
+        self.connection = sqlite3.connect(path, timeout=self.SHARED_TIMEOUT if shared else 5.0, 
+                                          check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.RLock()
+        self.batchWrites = 1 if shared else self.BATCH_WRITES
+        self.transaction = False
+        #batch() calls that keep the transaction open
+        self.held = 0
+        self.pending = 0
+        self.batchStart = 0.0
+        #connect() hands out this storage, it is closed with the last handle
+        self.handles = 1
+        self.collections = {}
+        #collection name -> indexed fields, shared by its with_options views
+        self.indexed = {}
+        for attribute, name in self.COLLECTIONS.items():
+            setattr(self, attribute, self[name])
+
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = SQLiteCollection(self, name)
+            return self.collections[name]
+
+
+    def connect(self):
+        with self.lock:
+            self.handles = self.handles + 1
+        return self
+
+
+    def execute(self, sql, parameters=()):
+        '''Runs one statement and returns all its rows. Must
+        be called holding self.lock.
+        '''
+        return self.connection.execute(sql, parameters).fetchall()
+
+
+    def begin(self):
+        '''Starts a transaction if none is open. Must be
+        called holding self.lock.
+        '''
+        if not self.transaction:
+            #a shared file takes the write lock now, not at the first write
+            self.connection.execute("BEGIN IMMEDIATE" if self.shared else "BEGIN")
+            self.transaction = True
+            self.batchStart = time.monotonic()
+
+
+    def readForUpdate(self):
+        '''Called before reading documents that are then
+        written. A shared file starts the transaction first, so
+        no other process writes them in between.
+        '''
+        if self.shared:
+            self.begin()
+
+
+    @contextmanager
+    def batch(self):
+        '''Keeps the writes inside in one transaction, even
+        on a shared file. Must be called holding self.lock.
+        '''
+        self.readForUpdate()
+        self.held = self.held + 1
+        try:
+            yield
+        finally:
+            self.held = self.held - 1
+
+
+    def write(self, sql, parameters=()):
+        '''Runs one writing statement in the current batch.
+        Must be called holding self.lock.
+        '''
+        self.begin()
+        self.pending = self.pending + 1
+        try:
+            return self.connection.execute(sql, parameters)
+        except sqlite3.IntegrityError as e:
+            raise pymongo.errors.DuplicateKeyError(str(e), 11000)
+
+
+    def wrote(self, durable=False):
+        '''Ends a write, committing the batch if it is full,
+        old or the write must be durable. Must be called
+        holding self.lock.
+        '''
+        if self.held:
+            return
+        if self.transaction and (durable or self.pending == 0 or self.pending >= self.batchWrites
+                                 or time.monotonic() - self.batchStart >= self.BATCH_SECONDS):
+            self.commit()
+
+
+    def commit(self):
+        if self.transaction:
+            self.connection.execute("COMMIT")
+            self.transaction = False
+            self.pending = 0
+
+
+    def flush(self):
+        with self.lock:
+            self.commit()
+
+
+    def drop(self):
+        with self.lock:
+            self.commit()
+            for collection in self.collections.values():
+                self.execute('DROP TABLE IF EXISTS "%s"' % collection.name)
+                collection.create()
+
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.handles = self.handles - 1
+            if self.handles == 0:
+                self.connection.close()
+
+
+class SQLiteCollection(object):
+    '''A table of documents with the calls of a pymongo
+    collection that the crawler makes.
+    '''
+
+    def __init__(self, storage, name, durable=False):
+        '''
+        Args:
+            storage(SQLiteStorage): the file the table is in
+            name(str): name of the collection
+            durable(bool): commit after every write
+        '''
+        self.storage = storage
+        self.name = name
+        self.durable = durable
+        self.create()
+
+
+    def create(self):
+        with self.storage.lock:
+            self.storage.execute('CREATE TABLE IF NOT EXISTS "%s" '
+                                 '(id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, doc BLOB NOT NULL)' % self.name)
+            #indexed fields are the f_ columns
+            self.storage.indexed[self.name] = [column[1][2:] for column in 
+                                               self.storage.execute('PRAGMA table_info("%s")' % self.name)
+                                               if column[1].startswith("f_")]
+
+
+    @property
+    def fields(self):
+        return self.storage.indexed[self.name]
+
+
+    def with_options(self, write_concern=None, **options):
+        '''Returns the collection committing after every
+        write if write_concern asks for the journal.
+        '''
+        durable = write_concern is not None and bool(write_concern.document.get("j"))
+        return SQLiteCollection(self.storage, self.name, durable)
+
+
+    @staticmethod
+    def key(value):
+        '''Returns the text an _id is stored as.'''
+        if isinstance(value, bson.ObjectId):
+            return "o" + str(value)
+        if isinstance(value, str):
+            return "s" + value
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return "r" + repr(value)
+        return "n" + repr(value)
+
+
+    @staticmethod
+    def indexable(value):
+        if isinstance(value, (str, int, float, bytes)):
+            return value
+        return None
+
+
+    def create_index(self, keys, unique=False, sparse=False, **options):
+        '''Adds a column for every field of keys, filled from
+        the documents already stored, and an index over them.
+
+        Args:
+            keys: field name, or list of (field, direction)
+            unique(bool): no two documents may have the same values
+            sparse(bool): accepted for MongoDB; missing fields never collide anyway
+        '''
+        if isinstance(keys, str):
+            keys = [(keys, pymongo.ASCENDING)]
+        names = [field for field, direction in keys]
+        with self.storage.lock:
+            added = [field for field in names if field not in self.fields]
+            for field in added:
+                self.storage.write('ALTER TABLE "%s" ADD COLUMN "f_%s"' % (self.name, field))
+                self.fields.append(field)
+            if added:
+                for rowId, data in self.storage.execute('SELECT id, doc FROM "%s"' % self.name):
+                    document = bson.decode(data)
+                    self.storage.write('UPDATE "%s" SET %s WHERE id = ?'
+                                       % (self.name, ", ".join('"f_%s" = ?' % field for field in added)),
+                                       [self.indexable(document.get(field)) for field in added] + [rowId])
+            index = "%s_%s" % (self.name, "_".join(names))
+            self.storage.write('CREATE %s INDEX IF NOT EXISTS "%s" ON "%s" (%s)'
+                               % ("UNIQUE" if unique else "", index, self.name,
+                                  ", ".join('"f_%s"' % field for field in names)))
+            self.storage.wrote(True)
+        return index
+
+
+    def insert_one(self, document):
+        '''Stores a document, giving it an _id if it has none.'''
+        with self.storage.lock:
+            try:
+                self.store(document)
+            finally:
+                self.storage.wrote(self.durable)
+        return pymongo.results.InsertOneResult(document["_id"], True)
+
+
+    def insert_many(self, documents, ordered=True):
+        '''Stores documents. Unordered inserts go on past a
+        duplicate key and raise BulkWriteError at the end.
+        '''
+        documents = list(documents)
+        errors = []
+        with self.storage.lock:
+            try:
+                for index, document in enumerate(documents):
+                    try:
+                        self.store(document)
+                    except pymongo.errors.DuplicateKeyError as e:
+                        if ordered:
+                            raise
+                        errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+            finally:
+                self.storage.wrote(self.durable)
+        if errors:
+            raise pymongo.errors.BulkWriteError({"writeErrors": errors, "nInserted": len(documents) - len(errors)})
+        return pymongo.results.InsertManyResult([document["_id"] for document in documents], True)
+
+
+    def store(self, document):
+        if "_id" not in document:
+            document["_id"] = bson.ObjectId()
+        columns = "".join(', "f_%s"' % field for field in self.fields)
+        self.storage.write('INSERT INTO "%s" (key, doc%s) VALUES (?, ?%s)' % (self.name, columns, ", ?" * len(self.fields)),
+                           [self.key(document["_id"]), bson.encode(document)]
+                           + [self.indexable(document.get(field)) for field in self.fields])
+
+
+    def replace(self, rowId, document):
+        self.storage.write('UPDATE "%s" SET doc = ?%s WHERE id = ?'
+                           % (self.name, "".join(', "f_%s" = ?' % field for field in self.fields)),
+                           [bson.encode(document)]
+                           + [self.indexable(document.get(field)) for field in self.fields] + [rowId])
+
+
+    #comparisons that narrow a lookup down in SQL
+    RANGES = {"$lt": "<", "$lte": "<=", "$gt": ">", "$gte": ">="}
+
+    def rows(self, query, limit=None):
+        '''Yields (row id, document) of every document that
+        matches query. Must be called holding the lock.
+
+        Args:
+            query(dict): the filter
+            limit(int): most documents the caller reads, None for all
+        '''
+        query = query or {}
+        sql = 'SELECT id, doc FROM "%s"' % self.name
+        parameters = []
+        #look up the first field an index or the _id can narrow down
+        for field in ["_id"] + self.fields:
+            if field not in query:
+                continue
+            condition = query[field]
+            if isinstance(condition, dict) and list(condition) == ["$in"]:
+                values = list(condition["$in"])
+            elif not isinstance(condition, dict):
+                values = [condition]
+            else:
+                continue
+            values = list(dict.fromkeys(values))
+            if field == "_id":
+                values = [self.key(value) for value in values]
+                column = "key"
+            else:
+                values = [self.indexable(value) for value in values]
+                if None in values:
+                    continue
+                column = '"f_%s"' % field
+            bounds, parameters, covered = self.ranges(query, field)
+            if limit and covered:
+                #SQL checks the whole query, so it can stop early
+                bounds = bounds + " LIMIT %d" % limit
+            for start in range(0, max(1, len(values)), 500):
+                part = values[start:start + 500]
+                if not part:
+                    return
+                found = self.storage.execute('%s WHERE %s IN (%s)%s' % (sql, column, ", ".join("?" * len(part)), bounds),
+                                             part + parameters)
+                for rowId, data in sorted(found):
+                    document = bson.decode(data)
+                    if self.matches(document, query):
+                        yield rowId, document
+            return
+        #no index helps: scan the table in id order, a page at a time
+        last = 0
+        while True:
+            found = self.storage.execute('%s WHERE id > ? ORDER BY id LIMIT 1000' % sql, (last,))
+            if not found:
+                return
+            for rowId, data in found:
+                document = bson.decode(data)
+                if self.matches(document, query):
+                    yield rowId, document
+            last = found[-1][0]
+
+
+    def ranges(self, query, lookup):
+        '''Returns SQL bounding the indexed fields of query
+        other than lookup by the numbers it compares them with,
+        its parameters, and whether the lookup and that SQL
+        check all of query.
+        '''
+        sql = ""
+        parameters = []
+        covered = True
+        for field, condition in query.items():
+            if field == lookup:
+                continue
+            bounded = field in self.fields and isinstance(condition, dict) and bool(condition)
+            if bounded:
+                for operator, operand in condition.items():
+                    if (operator not in self.RANGES or isinstance(operand, bool)
+                            or not isinstance(operand, (int, float))):
+                        bounded = False
+            if not bounded:
+                covered = False
+                continue
+            for operator, operand in condition.items():
+                sql = sql + ' AND "f_%s" %s ?' % (field, self.RANGES[operator])
+                parameters.append(operand)
+        return sql, parameters, covered
+
+
+    @classmethod
+    def matches(cls, document, query):
+        for field, condition in query.items():
+            present = field in document
+            value = document.get(field)
+            if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+                for operator, operand in condition.items():
+                    if not cls.compare(operator, present, value, operand):
+                        return False
+            elif value != condition:
+                return False
+        return True
+
+
+    @staticmethod
+    def compare(operator, present, value, operand):
+        if operator == "$exists":
+            return present == bool(operand)
+        if operator == "$in":
+            return value in operand
+        if operator == "$nin":
+            return value not in operand
+        if operator == "$ne":
+            return value != operand
+        if not present or value is None:
+            return False
+        if operator == "$lt":
+            return value < operand
+        if operator == "$lte":
+            return value <= operand
+        if operator == "$gt":
+            return value > operand
+        if operator == "$gte":
+            return value >= operand
+        raise Exception("Storage Error: %s is not supported by SQLiteStorage" % operator)
+
+
+    @staticmethod
+    def project(document, projection):
+        '''Returns the fields of document that projection asks for.'''
+        if not projection:
+            return document
+        if isinstance(projection, (list, tuple)):
+            projection = {field: 1 for field in projection}
+        included = [field for field, show in projection.items() if show and field != "_id"]
+        if included:
+            result = {field: document[field] for field in included if field in document}
+            if projection.get("_id", 1) and "_id" in document:
+                result["_id"] = document["_id"]
+            return result
+        return {field: value for field, value in document.items() if projection.get(field, 1)}
+
+
+    def find(self, filter=None, projection=None):
+        '''Returns a cursor over the documents matching filter.'''
+        return SQLiteCursor(self, filter or {}, projection)
+
+
+    def find_one(self, filter=None, projection=None):
+        with self.storage.lock:
+            for rowId, document in self.rows(filter, 1):
+                return self.project(document, projection)
+        return None
+
+
+    def count_documents(self, filter):
+        with self.storage.lock:
+            return sum(1 for row in self.rows(filter))
+
+
+    @staticmethod
+    def apply(document, update, inserting):
+        '''Applies the operators of update to document.'''
+        for operator, fields in update.items():
+            if operator == "$set" or (operator == "$setOnInsert" and inserting):
+                document.update(fields)
+            elif operator == "$inc":
+                for field, amount in fields.items():
+                    document[field] = document.get(field, 0) + amount
+            elif operator == "$unset":
+                for field in fields:
+                    document.pop(field, None)
+            elif operator != "$setOnInsert":
+                raise Exception("Storage Error: %s is not supported by SQLiteStorage" % operator)
+
+
+    def upsert(self, filter, update):
+        '''Stores the document an upsert of filter creates
+        and returns it.
+        '''
+        document = {field: value for field, value in filter.items()
+                    if not (isinstance(value, dict) and any(key.startswith("$") for key in value))}
+        self.apply(document, update, True)
+        self.store(document)
+        return document
+
+
+    def update_one(self, filter, update, upsert=False):
+        with self.storage.lock:
+            try:
+                self.storage.readForUpdate()
+                for rowId, document in self.rows(filter, 1):
+                    self.apply(document, update, False)
+                    self.replace(rowId, document)
+                    return pymongo.results.UpdateResult({"n": 1, "nModified": 1}, True)
+                if upsert:
+                    document = self.upsert(filter, update)
+                    return pymongo.results.UpdateResult({"n": 1, "nModified": 0, "upserted": document["_id"]}, True)
+                return pymongo.results.UpdateResult({"n": 0, "nModified": 0}, True)
+            finally:
+                self.storage.wrote(self.durable)
+
+
+    def update_many(self, filter, update, upsert=False):
+        with self.storage.lock:
+            try:
+                self.storage.readForUpdate()
+                matched = list(self.rows(filter))
+                for rowId, document in matched:
+                    self.apply(document, update, False)
+                    self.replace(rowId, document)
+                if not matched and upsert:
+                    document = self.upsert(filter, update)
+                    return pymongo.results.UpdateResult({"n": 1, "nModified": 0, "upserted": document["_id"]}, True)
+                return pymongo.results.UpdateResult({"n": len(matched), "nModified": len(matched)}, True)
+            finally:
+                self.storage.wrote(self.durable)
+
+
+    def find_one_and_update(self, filter, update, projection=None, upsert=False,
+                            return_document=pymongo.ReturnDocument.BEFORE):
+        '''Updates the first document matching filter and
+        returns it as it was before, or after if return_document
+        is ReturnDocument.AFTER.
+        '''
+        with self.storage.lock:
+            try:
+                self.storage.readForUpdate()
+                for rowId, document in self.rows(filter, 1):
+                    before = dict(document)
+                    self.apply(document, update, False)
+                    self.replace(rowId, document)
+                    return self.project(document if return_document else before, projection)
+                if upsert:
+                    document = self.upsert(filter, update)
+                    return self.project(document, projection) if return_document else None
+                return None
+            finally:
+                self.storage.wrote(self.durable)
+
+
+    def delete_many(self, filter):
+        with self.storage.lock:
+            try:
+                self.storage.readForUpdate()
+                if list(filter) == ["_id"] and isinstance(filter["_id"], dict) and list(filter["_id"]) == ["$in"]:
+                    #documents deleted by _id need not be read
+                    keys = [self.key(value) for value in filter["_id"]["$in"]]
+                    rowIds = []
+                    for start in range(0, len(keys), 500):
+                        part = keys[start:start + 500]
+                        rowIds.extend(row[0] for row in self.storage.execute('SELECT id FROM "%s" WHERE key IN (%s)' 
+                                                                             % (self.name, ", ".join("?" * len(part))), part))
+                else:
+                    rowIds = [rowId for rowId, document in self.rows(filter)]
+                for start in range(0, len(rowIds), 500):
+                    part = rowIds[start:start + 500]
+                    self.storage.write('DELETE FROM "%s" WHERE id IN (%s)' % (self.name, ", ".join("?" * len(part))), part)
+            finally:
+                self.storage.wrote(self.durable)
+        return pymongo.results.DeleteResult({"n": len(rowIds)}, True)
+
+
+    def delete_one(self, filter):
+        with self.storage.lock:
+            try:
+                self.storage.readForUpdate()
+                for rowId, document in self.rows(filter, 1):
+                    self.storage.write('DELETE FROM "%s" WHERE id = ?' % self.name, (rowId,))
+                    return pymongo.results.DeleteResult({"n": 1}, True)
+                return pymongo.results.DeleteResult({"n": 0}, True)
+            finally:
+                self.storage.wrote(self.durable)
+
+
+    def bulk_write(self, operations, ordered=True):
+        '''Runs the operations of Storage.updateOne, insertOne
+        and deleteOne in one batch, see Storage.bulkWrite.
+        '''
+        with self.storage.lock:
+            try:
+                with self.storage.batch():
+                    for operation in operations:
+                        if operation[0] == "update":
+                            self.update_one(operation[1], operation[2], upsert=operation[3])
+                        elif operation[0] == "insert":
+                            self.insert_one(operation[1])
+                        elif operation[0] == "delete":
+                            self.delete_one(operation[1])
+                        else:
+                            raise Exception("Storage Error: Unknown operation %s" % operation[0])
+            finally:
+                self.storage.wrote(self.durable)
+
+
+class SQLiteCursor(object):
+    '''The result of find(), read when it is iterated.'''
+
+    def __init__(self, collection, filter, projection):
+        self.collection = collection
+        self.filter = filter
+        self.projection = projection
+        self.keys = None
+
+
+    def sort(self, key, direction=pymongo.ASCENDING):
+        '''Sorts by a field, or a list of (field, direction).'''
+        self.keys = [(key, direction)] if isinstance(key, str) else list(key)
+        return self
+
+
+    def __iter__(self):
+        storage = self.collection.storage
+        if self.keys is None:
+            #documents are read a page at a time, the lock is not
+            #held while the caller works on them
+            rows = self.collection.rows(self.filter)
+            while True:
+                with storage.lock:
+                    page = [row[1] for i, row in zip(range(1000), rows)]
+                if not page:
+                    return
+                for document in page:
+                    yield self.collection.project(document, self.projection)
+        with storage.lock:
+            documents = [document for rowId, document in self.collection.rows(self.filter)]
+        for field, direction in reversed(self.keys):
+            #missing fields sort first, as null does in MongoDB
+            documents.sort(key=lambda document: (field in document, document.get(field)),
+                           reverse=direction == pymongo.DESCENDING)
+        for document in documents:
+            yield self.collection.project(document, self.projection)
@@ -0,0 +1,148 @@
+'''
+SearchBenchmark measures query latency of SearchEngine over a
+synthetic index, so the numbers do not depend on what happened
+to be crawled. The index is written through a Storage, which is
+emptied first: by default MongoDB's own "searchbench" database,
+or with --storage sqlite the --path file, which needs no mongod.
+
+Pages are random words drawn from a Zipf distribution over the
+vocabulary, like the words of real text, and are indexed through
+IndexWriter the way a crawl would. Single words, AND, OR and
+phrase queries are then timed, first with an empty result cache
+and then again with the cache warm, and the 50th, 95th and 99th
+percentile latencies are printed per kind of query.
+
+Usage: python SearchBenchmark.py [pages] [wordsPerPage] [queries] [options]
+       python SearchBenchmark.py --help
+'''
+from IndexWriter import IndexWriter
+from SearchEngine import SearchEngine
+from Storage import Storage
+import argparse
+import itertools
+import pymongo
+import random
+import time
+
+class SearchBenchmark(object):
+
+    def __init__(self, pages=1000000, wordsPerPage=50, vocabulary=50000, seed=1,
+                 storage="mongo", path="searchbench.db", uri=None):
+        '''
+        Args:
+            pages(int): pages in the synthetic index
+            wordsPerPage(int): average words of a page
+            vocabulary(int): distinct words
+            seed(int): seed of the random pages and queries
+            storage(str): "mongo" or "sqlite", as WebCrawler.STORAGE
+            path(str): the SQLite file
+            uri(str): MongoDB server, the local one if None
+        '''
+        self.pages = pages
+        self.wordsPerPage = wordsPerPage
+        self.vocabulary = ["w%d" % i for i in range(vocabulary)]
+        #Zipf: the word of rank r is 1/r as common as the most common one
+        self.cumWeights = list(itertools.accumulate(1.0 / rank for rank in range(1, vocabulary + 1)))
+        self.random = random.Random(seed)
+        self.storage = Storage.open(storage, path, "searchbench", uri=uri)
+        #consecutive words of some pages, for phrase queries
+        self.phrases = []
+
+
+    def page(self):
+        length = self.random.randint(self.wordsPerPage // 2, self.wordsPerPage * 3 // 2)
+        return self.random.choices(self.vocabulary, cum_weights=self.cumWeights, k=length)
+
+
+    def build(self):
+        '''Writes the synthetic index and its urls.'''
+        storage = self.storage
+        storage.drop()
+        storage.words.create_index([("word", pymongo.ASCENDING), ("first", pymongo.ASCENDING)])
+        storage.urlsCrawled.create_index([("docId", pymongo.ASCENDING)], unique = True)
+        writer = IndexWriter(storage.words, maxPostings=500000, counters=storage.counters)
+        writer.start()
+        start = time.time()
+        urls = []
+        for docId in range(self.pages):
+            words = self.page()
+            writer.add(docId, words)
+            if docId % 1000 == 0 and len(words) > 2:
+                self.phrases.append(words[:2])
+            urls.append({"docId": docId, "url": "http://bench.example/%d" % docId})
+            if len(urls) == 10000:
+                storage.urlsCrawled.insert_many(urls, ordered=False)
+                urls = []
+        if urls:
+            storage.urlsCrawled.insert_many(urls, ordered=False)
+        writer.close()
+        storage.flush()
+        print("Indexed %d pages in %.1f s" % (self.pages, time.time() - start))
+
+
+    def queries(self, count):
+        '''Returns (kind, query) pairs, count of every kind.'''
+        common = self.vocabulary[:100]
+        middle = self.vocabulary[100:5000]
+        rare = self.vocabulary[5000:]
+        queries = []
+        for _ in range(count):
+            pick = self.random.choice
+            queries.append(("word", pick(middle)))
+            queries.append(("and", "%s %s" % (pick(common), pick(middle))))
+            queries.append(("and3", "%s %s %s" % (pick(common), pick(common), pick(middle))))
+            queries.append(("or", "%s OR %s" % (pick(middle), pick(rare))))
+            queries.append(("phrase", '"%s"' % " ".join(pick(self.phrases))))
+        return queries
+
+
+    @staticmethod
+    def percentile(values, share):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(share * len(values)))]
+
+
+    def run(self, queries=200):
+        '''Builds the index, times the queries and prints
+        the latency percentiles in milliseconds.
+
+        Args:
+            queries(int): queries of every kind
+        '''
+        self.build()
+        storage = self.storage
+        engine = SearchEngine(storage.words, storage.urlsCrawled, storage.counters, cacheSize=10 * queries)
+        workload = self.queries(queries)
+        latencies = {}
+        for cache in ("cold", "warm"):
+            if cache == "cold":
+                engine.clear()
+            for kind, query in workload:
+                start = time.perf_counter()
+                engine.search(query, 10)
+                latencies.setdefault((kind, cache), []).append((time.perf_counter() - start) * 1000)
+        print("query  --- cache --- p50 ms --- p95 ms --- p99 ms")
+        for (kind, cache), values in sorted(latencies.items()):
+            print("%-6s --- %-5s --- %6.2f --- %6.2f --- %6.2f"
+                  % (kind, cache, self.percentile(values, 0.5),
+                     self.percentile(values, 0.95), self.percentile(values, 0.99)))
+        return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times queries over a synthetic index.")
+    parser.add_argument("pages", nargs="?", type=int, default=1000000)
+    parser.add_argument("wordsPerPage", nargs="?", type=int, default=50)
+    parser.add_argument("queries", nargs="?", type=int, default=200, help="queries of every kind")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--storage", choices=("mongo", "sqlite"), default="mongo")
+    parser.add_argument("--path", default="searchbench.db", help="the SQLite file")
+    parser.add_argument("--mongo-uri", default=None, help="the MongoDB")
+    args = parser.parse_args()
+
+    benchmark = SearchBenchmark(args.pages, args.wordsPerPage, seed=args.seed,
+                                storage=args.storage, path=args.path, uri=args.mongo_uri)
+    try:
+        benchmark.run(args.queries)
+    finally:
+        benchmark.storage.close()
@@ -0,0 +1,340 @@
+'''
+SearchEngine answers queries over the word index and ranks
+the pages with BM25.
+
+A query is words and "quoted phrases". All of them must be on a
+page (AND), unless clauses are separated by OR, in which case a
+page has to match one clause:
+
+    apple pie                 pages with both words
+    "apple pie" recipe        pages with the phrase and the word
+    apple OR pear             pages with either word
+
+For every clause the posting lists of its words are intersected
+smallest first: the shortest list proposes a page, and every
+other list skips ahead to it, using the first and last id of
+each block to pass over whole blocks without decompressing them
+and skip pointers every sqrt(n) ids inside a block. Phrases are
+checked with the positions of the words on the page.
+
+Pages are scored with BM25 from the term frequencies and page
+lengths stored in the postings and the page count and average
+length in the docStats counter. The best RERANK_DEPTH times
+limit of them are then reordered by their PageRank, when
+WebCrawler.rankPages has computed it: the BM25 score is multiplied
+by 1 + PAGERANK_WEIGHT * log(1 + pagerank), where pagerank is 1.0
+for an average page. Results of recent queries are
+kept in an LRU cache that is dropped whenever the generation
+counter, which every crawl increments, has moved on.
+'''
+from LinkTextExtractor import LinkTextExtractor
+from PostingList import PostingList
+from collections import OrderedDict
+import heapq
+import math
+import re
+import threading
+
+class PostingCursor(object):
+    '''Walks the posting list of one word in id order.'''
+
+    def __init__(self, word, blocks):
+        '''
+        Args:
+            word(str): the word
+            blocks(list): its documents from the words collection
+        '''
+        self.word = word
+        self.blocks = self.merge(sorted(blocks, key=lambda post: post["first"]))
+        #number of pages the word is on, known without decoding anything
+        self.df = sum(post["count"] for post in self.blocks)
+        self.block = -1
+        self.ids = []
+        self.i = 0
+        self.stride = 1
+        self.tfs = None
+        self.lens = None
+        self.positions = None
+        self.nextBlock()
+
+
+    @staticmethod
+    def merge(blocks):
+        '''Returns the blocks with the ones whose id ranges
+        overlap merged. Threads flush pages out of id order, so
+        blocks of one crawl can overlap until close() compacts
+        them.
+        '''
+        merged = []
+        for post in blocks:
+            if merged and post["first"] <= merged[-1]["last"]:
+                previous = merged.pop()
+                postings = previous.get("postings") or PostingList.readPostings(previous)
+                postings = sorted(postings + PostingList.readPostings(post))
+                post = {"first": postings[0][0],
+                        "last": max(previous["last"], post["last"]),
+                        "count": len(postings),
+                        "postings": postings}
+            merged.append(post)
+        return merged
+
+
+    def nextBlock(self):
+        self.block = self.block + 1
+        self.i = 0
+        self.tfs = None
+        self.lens = None
+        self.positions = None
+        if self.block < len(self.blocks) and "postings" in self.blocks[self.block]:
+            postings = self.blocks[self.block]["postings"]
+            self.ids = [docId for docId, positions, length in postings]
+            self.tfs = [len(positions) for docId, positions, length in postings]
+            self.lens = [length for docId, positions, length in postings]
+            self.positions = [positions for docId, positions, length in postings]
+            self.stride = max(1, int(math.sqrt(len(self.ids))))
+        elif self.block < len(self.blocks):
+            self.ids = PostingList.read(self.blocks[self.block])
+            self.stride = max(1, int(math.sqrt(len(self.ids))))
+        else:
+            self.ids = []
+        if self.block < len(self.blocks) and not self.ids:
+            self.nextBlock()
+
+
+    def docId(self):
+        '''Returns the current id, or None past the end.'''
+        if self.i < len(self.ids):
+            return self.ids[self.i]
+        return None
+
+
+    def next(self):
+        self.i = self.i + 1
+        if self.i >= len(self.ids):
+            self.nextBlock()
+
+
+    def advance(self, target):
+        '''Moves to the first id that is target or more.'''
+        if self.i < len(self.ids) and self.ids[-1] < target:
+            #skip whole blocks by their last id without decoding them
+            while self.block + 1 < len(self.blocks) and self.blocks[self.block + 1]["last"] < target:
+                self.block = self.block + 1
+            self.nextBlock()
+        ids = self.ids
+        #follow the skip pointers, then step
+        while self.i + self.stride < len(ids) and ids[self.i + self.stride] <= target:
+            self.i = self.i + self.stride
+        while self.i < len(ids) and ids[self.i] < target:
+            self.i = self.i + 1
+
+
+    def tf(self):
+        if self.tfs is None:
+            post = self.blocks[self.block]
+            self.tfs = PostingList.decodeInts(post["tfs"]) if "tfs" in post else [1] * len(self.ids)
+        return max(1, self.tfs[self.i])
+
+
+    def length(self):
+        '''Returns the number of words of the current page, 0 if unknown.'''
+        if self.lens is None:
+            post = self.blocks[self.block]
+            self.lens = PostingList.decodeInts(post["lens"]) if "lens" in post else [0] * len(self.ids)
+        return self.lens[self.i]
+
+
+    def position(self):
+        '''Returns the positions of the word on the current page.'''
+        if self.positions is None:
+            self.positions = PostingList.readPositions(self.blocks[self.block], self.ids)
+        return self.positions[self.i]
+
+
+class SearchEngine(object):
+
+    K1 = 1.2
+    B = 0.75
+    #BM25 candidates reordered by PageRank per result, and how much it counts
+    RERANK_DEPTH = 10
+    PAGERANK_WEIGHT = 0.5
+    QUOTED = re.compile(r'"([^"]*)"|(\S+)')
+
+    def __init__(self, words, urlsCrawled, counters, cacheSize=256):
+        '''
+        Args:
+            words: MongoDB collection of the word index
+            urlsCrawled: MongoDB collection of the crawled urls
+            counters: MongoDB collection of the docStats and generation counters
+            cacheSize(int): most query results kept
+        '''
+        self.words = words
+        self.urlsCrawled = urlsCrawled
+        self.counters = counters
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+        self.cacheGeneration = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    @staticmethod
+    def normalize(word):
+        '''Normalizes a query word the way page words are.'''
+        return LinkTextExtractor.NON_ALPHANUMERIC.sub("", word).lower()
+
+
+    @classmethod
+    def parse(cls, query):
+        '''Returns the clauses of a query. Each clause is a
+        list of phrases, and each phrase a list of words; a
+        single word is a phrase of one.
+
+        Args:
+            query(str): the query
+        '''
+        clauses = [[]]
+        for match in cls.QUOTED.finditer(query):
+            phrase, word = match.groups()
+            if word == "OR":
+                clauses.append([])
+                continue
+            if word == "AND":
+                continue
+            text = phrase if phrase is not None else word
+            words = [cls.normalize(part) for part in text.split()]
+            words = [part for part in words if part]
+            if words:
+                clauses[-1].append(words)
+        return [clause for clause in clauses if clause]
+
+
+    def generation(self):
+        counter = self.counters.find_one({"_id": "generation"})
+        return counter["value"] if counter else 0
+
+
+    def clear(self):
+        '''Drops every cached result.'''
+        with self.lock:
+            self.cache.clear()
+            self.cacheGeneration = None
+
+
+    def search(self, query, limit=10):
+        '''Returns up to limit (url, score) pairs of the pages
+        matching query, best first.
+
+        Args:
+            query(str): the query, see the module docstring
+            limit(int): most results
+        '''
+        clauses = self.parse(query)
+        key = (repr(clauses), limit)
+        generation = self.generation()
+        with self.lock:
+            if self.cacheGeneration != generation:
+                #something was crawled since the results were cached
+                self.cache.clear()
+                self.cacheGeneration = generation
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits = self.hits + 1
+                return self.cache[key]
+            self.misses = self.misses + 1
+        results = self.rank(clauses, limit)
+        with self.lock:
+            if self.cacheGeneration == generation:
+                self.cache[key] = results
+                if len(self.cache) > self.cacheSize:
+                    self.cache.popitem(last=False)
+        return results
+
+
+    def rank(self, clauses, limit):
+        if not clauses:
+            return []
+        terms = sorted({word for clause in clauses for phrase in clause for word in phrase})
+        blocks = {}
+        for post in self.words.find({"word": {"$in": terms}, "ids": {"$exists": True}}):
+            blocks.setdefault(post["word"], []).append(post)
+        stats = self.counters.find_one({"_id": "docStats"}) or {}
+        docs = max(1, stats.get("docs", 0))
+        averageLength = stats.get("length", 0) / docs or 1.0
+        scores = {}
+        for clause in clauses:
+            for docId, score in self.matchClause(clause, blocks, docs, averageLength):
+                if score > scores.get(docId, -1.0):
+                    scores[docId] = score
+        best = heapq.nlargest(limit * self.RERANK_DEPTH, scores.items(), key=lambda item: (item[1], -item[0]))
+        pages = {}
+        for post in self.urlsCrawled.find({"docId": {"$in": [docId for docId, score in best]}},
+                                          {"_id": 0, "docId": 1, "url": 1, "pagerank": 1}):
+            pages[post["docId"]] = post
+        results = []
+        for docId, score in best:
+            if docId in pages:
+                #pages not ranked yet count as average
+                pagerank = pages[docId].get("pagerank", 1.0)
+                score = score * (1 + self.PAGERANK_WEIGHT * math.log1p(pagerank))
+                results.append((-score, docId, pages[docId]["url"]))
+        return [(url, round(-score, 4)) for score, docId, url in heapq.nsmallest(limit, results)]
+
+
+    def matchClause(self, clause, blocks, docs, averageLength):
+        '''Yields (document id, score) of every page that
+        has all phrases of a clause.
+        '''
+        words = sorted({word for phrase in clause for word in phrase})
+        cursors = {}
+        for word in words:
+            if word not in blocks:
+                #a word no page has: nothing can match
+                return
+            cursors[word] = PostingCursor(word, blocks[word])
+        #smallest posting list first
+        order = sorted(cursors.values(), key=lambda cursor: cursor.df)
+        idf = {cursor.word: math.log(1 + (docs - cursor.df + 0.5) / (cursor.df + 0.5)) for cursor in order}
+        lead = order[0]
+        while lead.docId() is not None:
+            target = lead.docId()
+            matched = True
+            for cursor in order[1:]:
+                cursor.advance(target)
+                current = cursor.docId()
+                if current is None:
+                    return
+                if current != target:
+                    #the lead jumps to the first page the other list has
+                    lead.advance(current)
+                    matched = False
+                    break
+            if not matched:
+                continue
+            if all(self.hasPhrase(phrase, cursors) for phrase in clause if len(phrase) > 1):
+                yield target, self.score(order, idf, averageLength)
+            lead.next()
+
+
+    @staticmethod
+    def hasPhrase(phrase, cursors):
+        '''Returns True if the words of phrase follow each
+        other on the page all cursors are on.
+        '''
+        starts = set(cursors[phrase[0]].position())
+        for offset, word in enumerate(phrase[1:], 1):
+            starts = starts & {position - offset for position in cursors[word].position()}
+            if not starts:
+                return False
+        return True
+
+
+    def score(self, cursors, idf, averageLength):
+        score = 0.0
+        for cursor in cursors:
+            tf = cursor.tf()
+            length = cursor.length() or averageLength
+            norm = self.K1 * (1 - self.B + self.B * length / averageLength)
+            score = score + idf[cursor.word] * tf * (self.K1 + 1) / (tf + norm)
+        return score
@@ -0,0 +1,198 @@
+'''
+SeenSet remembers which urls were already crawled, in place of
+the dontCrawl dict and the one semaphore every worker had to take.
+
+Urls are hashed and spread over `shards` independent shards, each
+with its own lock, so workers rarely wait for each other. Each
+shard is an open addressing table of 64 bit fingerprints in an
+array('Q'), about 16 bytes per url against the 100+ of a dict
+entry. Two urls only collide if their 64 bit hashes are equal,
+which for 10 million urls happens with a chance of about 1 in 400000.
+
+ScalableBloomFilter takes the same calls and uses a few bits
+per url, at the price of treating a small, configurable share
+of new urls as already seen.
+'''
+from array import array
+import hashlib
+import math
+import threading
+
+class SeenSet(object):
+
+    def __init__(self, shards=64, capacity=1024):
+        '''
+        Args:
+            shards(int): number of independently locked shards, a power of 2
+            capacity(int): urls expected, the tables grow past it
+        '''
+        self.mask = shards - 1
+        size = 16
+        while size < 2 * capacity / shards:
+            size = size * 2
+        self.tables = [array("Q", bytes(8 * size)) for _ in range(shards)]
+        self.counts = [0] * shards
+        self.locks = [threading.Lock() for _ in range(shards)]
+
+
+    @staticmethod
+    def hash(url):
+        return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+    def add(self, url):
+        '''Adds url and returns True if it was already in the set.
+
+        Args:
+            url(str): the url, usually URLCanonicalizer.key(url)
+        '''
+        #0 marks an empty slot
+        fingerprint = self.hash(url) or 1
+        shard = fingerprint & self.mask
+        with self.locks[shard]:
+            table = self.tables[shard]
+            if self.find(table, fingerprint):
+                return True
+            if 2 * (self.counts[shard] + 1) > len(table):
+                table = self.grow(shard)
+            self.insert(table, fingerprint)
+            self.counts[shard] = self.counts[shard] + 1
+            return False
+
+
+    def __contains__(self, url):
+        fingerprint = self.hash(url) or 1
+        shard = fingerprint & self.mask
+        with self.locks[shard]:
+            return self.find(self.tables[shard], fingerprint)
+
+
+    def __len__(self):
+        return sum(self.counts)
+
+
+    def find(self, table, fingerprint):
+        mask = len(table) - 1
+        #the low bits chose the shard, probe with the high ones
+        slot = (fingerprint >> 16) & mask
+        while True:
+            value = table[slot]
+            if value == fingerprint:
+                return True
+            if value == 0:
+                return False
+            slot = (slot + 1) & mask
+
+
+    def insert(self, table, fingerprint):
+        mask = len(table) - 1
+        slot = (fingerprint >> 16) & mask
+        while table[slot] != 0:
+            slot = (slot + 1) & mask
+        table[slot] = fingerprint
+
+
+    def grow(self, shard):
+        '''Doubles the table of a shard. Must be called holding its lock.'''
+        old = self.tables[shard]
+        table = array("Q", bytes(16 * len(old)))
+        for fingerprint in old:
+            if fingerprint:
+                self.insert(table, fingerprint)
+        self.tables[shard] = table
+        return table
+
+
+    def memory(self):
+        '''Returns the bytes used by the tables.'''
+        return sum(table.itemsize * len(table) for table in self.tables)
+
+
+class ScalableBloomFilter(object):
+
+    #each new filter is this many times bigger than the last
+    GROWTH = 2
+    #and has this share of the error rate of the last
+    TIGHTENING = 0.5
+
+    def __init__(self, shards=64, capacity=1024, errorRate=0.001):
+        '''
+        Args:
+            shards(int): number of independently locked shards, a power of 2 up to 256
+            capacity(int): urls the first filters are sized for
+            errorRate(float): most share of new urls reported as seen
+        '''
+        self.mask = shards - 1
+        self.initialCapacity = max(64, capacity // shards)
+        #the error rates of the filters of a shard add up to at most errorRate
+        self.errorRate = errorRate * (1 - self.TIGHTENING)
+        #each shard is a list of [bits, hashes, capacity, count]
+        self.filters = [[self.newFilter(self.initialCapacity, self.errorRate)] for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+
+
+    @staticmethod
+    def newFilter(capacity, errorRate):
+        bits = int(math.ceil(-capacity * math.log(errorRate) / (math.log(2) ** 2)))
+        bits = (bits + 7) // 8 * 8
+        hashes = max(1, int(round(bits / capacity * math.log(2))))
+        return [bytearray(bits // 8), hashes, capacity, 0]
+
+
+    @staticmethod
+    def positions(digest, hashes, bits):
+        #double hashing, k positions from two 64 bit hashes
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+    def add(self, url):
+        '''Adds url and returns True if it was (probably)
+        already in the set.
+
+        Args:
+            url(str): the url, usually URLCanonicalizer.key(url)
+        '''
+        digest = hashlib.blake2b(url.encode("utf-8"), digest_size=16).digest()
+        shard = digest[0] & self.mask
+        with self.locks[shard]:
+            filters = self.filters[shard]
+            for bitArray, hashes, capacity, count in filters:
+                if self.contains(bitArray, hashes, digest):
+                    return True
+            current = filters[-1]
+            if current[3] >= current[2]:
+                level = len(filters)
+                current = self.newFilter(current[2] * self.GROWTH,
+                                         self.errorRate * self.TIGHTENING ** level)
+                filters.append(current)
+            bitArray = current[0]
+            for position in self.positions(digest, current[1], 8 * len(bitArray)):
+                bitArray[position >> 3] |= 1 << (position & 7)
+            current[3] = current[3] + 1
+            return False
+
+
+    def contains(self, bitArray, hashes, digest):
+        for position in self.positions(digest, hashes, 8 * len(bitArray)):
+            if not bitArray[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+    def __contains__(self, url):
+        digest = hashlib.blake2b(url.encode("utf-8"), digest_size=16).digest()
+        shard = digest[0] & self.mask
+        with self.locks[shard]:
+            return any(self.contains(bitArray, hashes, digest)
+                       for bitArray, hashes, capacity, count in self.filters[shard])
+
+
+    def __len__(self):
+        return sum(f[3] for filters in self.filters for f in filters)
+
+
+    def memory(self):
+        '''Returns the bytes used by the bit arrays.'''
+        return sum(len(f[0]) for filters in self.filters for f in filters)
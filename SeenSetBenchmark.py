@@ -0,0 +1,68 @@
+'''
+SeenSetBenchmark measures the memory and the lookup
+throughput of the dontCrawl dict, SeenSet and
+ScalableBloomFilter for a large number of urls, and the
+false positive rate of the Bloom filter.
+
+Usage: python SeenSetBenchmark.py [urls] [errorRate]
+'''
+from SeenSet import SeenSet, ScalableBloomFilter
+import sys
+import time
+
+def urls(count, prefix="seen"):
+    '''Yields count distinct urls that look like a crawl.'''
+    for i in range(count):
+        yield "http://www.site%d.com/%s/section%d/article-%d.html" % (i % 5000, prefix, i % 97, i)
+
+
+class DictSeen(object):
+    '''The dict with one lock that the crawler used before.'''
+
+    def __init__(self):
+        self.dontCrawl = {}
+
+    def add(self, url):
+        if url in self.dontCrawl:
+            return True
+        self.dontCrawl[url] = 1
+        return False
+
+    def __contains__(self, url):
+        return url in self.dontCrawl
+
+    def memory(self):
+        #the dict keeps every url string alive as well
+        return sys.getsizeof(self.dontCrawl) + sum(sys.getsizeof(url) for url in self.dontCrawl)
+
+
+def measure(name, seen, count):
+    start = time.perf_counter()
+    for url in urls(count):
+        seen.add(url)
+    insertTime = time.perf_counter() - start
+    memory = seen.memory()
+
+    start = time.perf_counter()
+    for url in urls(count):
+        url in seen
+    lookupTime = time.perf_counter() - start
+
+    #urls that were never added, any hit is a false positive
+    probes = min(count, 1000000)
+    falsePositives = sum(1 for url in urls(probes, "unseen") if url in seen)
+    print("%-20s --- %10.1f --- %10.0f --- %10.0f --- %.6f"
+          % (name, memory / count, count / insertTime, count / lookupTime, falsePositives / probes))
+
+
+def run(count=10000000, errorRate=0.001):
+    print("%d urls" % count)
+    print("set                  --- bytes/url  --- inserts/s  --- lookups/s  --- false positives")
+    measure("dict", DictSeen(), count)
+    measure("SeenSet", SeenSet(capacity=count), count)
+    measure("ScalableBloomFilter", ScalableBloomFilter(capacity=count, errorRate=errorRate), count)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.001)
@@ -0,0 +1,252 @@
+'''
+SharedFrontier is the frontier of a distributed crawl. It is
+kept in the storage, so crawler processes on one machine or
+many can share it through MongoDB, or through one SQLite file
+opened with shared=True.
+
+Every url found is one document of the frontier collection,
+keyed by URLCanonicalizer.key, so it is queued once however
+many processes find it:
+
+    {_id, url, depth, partition, queue, crawled, owner, until}
+
+partition is a hash of the url's host. Processes lease the
+partitions in the leases collection, so all urls of a host are
+crawled by one process and it can keep to the host's crawl delay
+alone. queue is the partition while the url has work left and is
+unset once it is done, so the index on (queue, until) only holds
+waiting urls. depth is the most depth left any path to the url
+gave it. A url found again with more depth left after it was
+crawled is queued again, and then its stored links are queued
+with the new depth without fetching the page, so the pages
+crawled do not depend on the order the processes find them in.
+
+A process claims a url of its partitions with one atomic
+find_one_and_update, which sets the process as owner until a
+lease runs out. Partition leases are renewed in the background;
+urls and partitions whose lease ran out, because their process
+stopped, are claimed by the other processes. Links found are
+written in batches of batchSize requests, and a url is marked
+done only after the batch with its links, so the crawl is over
+once no partition has a url queued.
+'''
+from Storage import Storage
+from URLCanonicalizer import URLCanonicalizer
+import hashlib
+import math
+import pymongo
+import pymongo.errors
+import threading
+import time
+import urllib.parse
+
+class SharedFrontier(object):
+
+    #hosts are hashed into this many partitions, which processes lease
+    PARTITIONS = 64
+
+    def __init__(self, frontier, leases, owner, processes=1, leaseSeconds=30.0,
+                 batchSize=500, flushInterval=0.5):
+        '''
+        Args:
+            frontier: collection of the urls
+            leases: collection of the partition leases
+            owner(str): name of this process, unique in the crawl
+            processes(int): processes in the crawl, which share the partitions
+            leaseSeconds(float): seconds a lease lasts unless it is renewed
+            batchSize(int): most link writes waiting to be sent
+            flushInterval(float): most seconds link writes wait to be sent
+        '''
+        self.frontier = frontier
+        self.leases = leases
+        self.owner = owner
+        #partitions leased while others may still be joining
+        self.share = math.ceil(self.PARTITIONS / max(1, processes))
+        self.leaseSeconds = leaseSeconds
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.lock = threading.Lock()
+        self.partitions = []
+        #requests queuing links, and requests marking urls done
+        self.links = []
+        self.completed = []
+        #key -> most depth sent, a url is only sent again with more
+        self.sent = {}
+        self.lastFlush = time.monotonic()
+        self.started = None
+        self.renewer = None
+
+
+    @classmethod
+    def partitionOf(cls, url):
+        '''Returns the partition of the host of url.'''
+        host = urllib.parse.urlsplit(url).netloc.lower().encode("utf-8")
+        return int.from_bytes(hashlib.blake2b(host, digest_size=8).digest(), "big") % cls.PARTITIONS
+
+
+    @staticmethod
+    def createIndex(frontier):
+        '''Creates the index urls are claimed by.'''
+        frontier.create_index([("queue", pymongo.ASCENDING), ("until", pymongo.ASCENDING)])
+
+
+    @classmethod
+    def reset(cls, frontier, leases):
+        '''Empties the frontier and frees every partition.
+        Called once, before the processes of a crawl start.
+        '''
+        frontier.delete_many({})
+        leases.delete_many({})
+        cls.createIndex(frontier)
+        leases.insert_many([{"_id": partition, "owner": None, "until": 0}
+                            for partition in range(cls.PARTITIONS)])
+
+
+    def open(self):
+        '''Leases this process's share of the partitions and
+        starts renewing the leases and sending link writes in
+        the background.
+        '''
+        self.started = time.monotonic()
+        self.renew()
+        stopped = threading.Event()
+        def run():
+            renewed = time.monotonic()
+            while not stopped.wait(self.flushInterval):
+                self.flush()
+                if time.monotonic() - renewed >= self.leaseSeconds / 3:
+                    self.renew()
+                    renewed = time.monotonic()
+        self.renewer = (threading.Thread(target=run, daemon=True), stopped)
+        self.renewer[0].start()
+
+
+    def renew(self):
+        '''Renews the partition leases of this process and
+        leases more while it holds less than its share. Once
+        a lease period has passed, any partition whose lease
+        ran out is taken, since its process stopped or never
+        joined.
+        '''
+        now = time.time()
+        until = now + self.leaseSeconds
+        self.leases.update_many({"owner": self.owner, "until": {"$gte": now}}, {"$set": {"until": until}})
+        held = [lease["_id"] for lease in self.leases.find({"owner": self.owner, "until": until}, {"_id": 1})]
+        adopt = time.monotonic() - self.started >= self.leaseSeconds
+        if len(held) < self.share or adopt:
+            for lease in list(self.leases.find({"until": {"$lt": now}}, {"_id": 1})):
+                if len(held) >= self.share and not adopt:
+                    break
+                taken = self.leases.find_one_and_update({"_id": lease["_id"], "until": {"$lt": now}},
+                                                        {"$set": {"owner": self.owner, "until": until}})
+                if taken is not None:
+                    held.append(lease["_id"])
+        self.partitions = sorted(held)
+
+
+    def put(self, urls, depth):
+        '''Queues urls with depth left, or gives the ones
+        queued already the larger depth. They are written by
+        the next flush.
+
+        Args:
+            urls(iterable): the urls
+            depth(int): depth left after crawling them
+        '''
+        with self.lock:
+            for url in urls:
+                key = URLCanonicalizer.key(url)
+                if self.sent.get(key, -1) >= depth:
+                    continue
+                self.sent[key] = depth
+                partition = self.partitionOf(url)
+                self.links.append(Storage.updateOne({"_id": key},
+                                                    {"$setOnInsert": {"url": url, "depth": depth,
+                                                                      "partition": partition, "queue": partition,
+                                                                      "crawled": False, "until": 0}},
+                                                    upsert=True))
+                #a url done already is queued again
+                self.links.append(Storage.updateOne({"_id": key, "depth": {"$lt": depth}},
+                                                    {"$set": {"depth": depth, "queue": partition}}))
+
+
+    def claim(self):
+        '''Leases a url of this process's partitions and
+        returns its document, or None if none is waiting.
+        done() must be called once it has been crawled.
+        '''
+        partitions = self.partitions
+        if not partitions:
+            return None
+        now = time.time()
+        return self.frontier.find_one_and_update({"queue": {"$in": partitions}, "until": {"$lt": now}},
+                                                 {"$set": {"owner": self.owner, "until": now + self.leaseSeconds}})
+
+
+    def done(self, document, links=()):
+        '''Queues the links found on a claimed url and marks
+        the url done once they are written.
+
+        Args:
+            document(dict): what claim returned
+            links(iterable): links found on the page
+        '''
+        depth = document["depth"]
+        if depth > 0:
+            self.put(links, depth - 1)
+        with self.lock:
+            #unless its depth was raised meanwhile, then it is
+            #claimed again and only its links are queued
+            self.completed.append(Storage.updateOne({"_id": document["_id"], "owner": self.owner, "depth": depth},
+                                                    {"$set": {"crawled": True}, "$unset": {"queue": ""}}))
+            self.completed.append(Storage.updateOne({"_id": document["_id"], "owner": self.owner},
+                                                    {"$set": {"crawled": True, "owner": None, "until": 0}}))
+            full = (len(self.links) >= self.batchSize
+                    or time.monotonic() - self.lastFlush >= self.flushInterval)
+        if full:
+            self.flush()
+
+
+    def flush(self):
+        '''Writes the links queued and then marks the urls
+        they were found on done.
+        '''
+        with self.lock:
+            links, completed = self.links, self.completed
+            self.links, self.completed = [], []
+            self.lastFlush = time.monotonic()
+        while links:
+            try:
+                Storage.bulkWrite(self.frontier, links)
+                links = []
+            except pymongo.errors.BulkWriteError as e:
+                error = e.details["writeErrors"][0]
+                if error["code"] != 11000:
+                    raise
+                #another process inserted the url first, so the
+                #upsert finds it when it is sent again
+                links = links[error["index"]:]
+        if completed:
+            Storage.bulkWrite(self.frontier, completed)
+
+
+    def finished(self):
+        '''Returns True once no url is waiting or being
+        crawled in any partition.
+        '''
+        self.flush()
+        return self.frontier.find_one({"queue": {"$in": list(range(self.PARTITIONS))}}, {"_id": 1}) is None
+
+
+    def close(self):
+        '''Stops renewing, writes what is left and frees the
+        partitions of this process.
+        '''
+        if self.renewer is not None:
+            thread, stopped = self.renewer
+            stopped.set()
+            thread.join()
+            self.renewer = None
+        self.flush()
+        self.leases.update_many({"owner": self.owner}, {"$set": {"owner": None, "until": 0}})
+        self.partitions = []
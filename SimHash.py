@@ -0,0 +1,145 @@
+'''
+SimHash finds pages that are near duplicates of a page that
+was already indexed: mirrors, print views and urls that only
+differ in tracking parameters, whose words are all or almost
+all the same.
+
+fingerprint() turns the words of a page into a 64 bit SimHash
+(Charikar): every word is hashed, and each bit of the fingerprint
+is set if more words of the page have that bit set than not.
+Pages with mostly the same words get fingerprints that differ in
+only a few bits. Pages with fewer than MIN_WORDS words share too
+much boilerplate with unrelated short pages to be compared.
+
+SimHashIndex remembers the fingerprints of indexed pages and
+finds one within `distance` bits of a new page. The 64 bits are
+cut into distance + 1 bands; two fingerprints that differ in at
+most `distance` bits must agree on at least one whole band, so
+only fingerprints sharing a band with the new one are compared.
+Given a MongoDB collection the fingerprints are also written
+there, and loaded back by load(), so duplicates are found across
+crawls.
+'''
+import hashlib
+import threading
+
+class SimHash(object):
+
+    BITS = 64
+    MIN_WORDS = 50
+
+    @classmethod
+    def fingerprint(cls, words):
+        '''Returns the 64 bit SimHash of a list of words.
+
+        Args:
+            words(list): words of the page in order, from WebScraper.crawlText
+        '''
+        counts = {}
+        for word in words:
+            counts[word] = counts.get(word, 0) + 1
+        weights = [0] * cls.BITS
+        for word, count in counts.items():
+            value = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            for bit in range(cls.BITS):
+                if value >> bit & 1:
+                    weights[bit] = weights[bit] + count
+                else:
+                    weights[bit] = weights[bit] - count
+        fingerprint = 0
+        for bit in range(cls.BITS):
+            if weights[bit] > 0:
+                fingerprint = fingerprint | (1 << bit)
+        return fingerprint
+
+
+    @staticmethod
+    def distance(a, b):
+        '''Returns the number of bits two fingerprints differ in.'''
+        return bin(a ^ b).count("1")
+
+
+    @staticmethod
+    def toSigned(fingerprint):
+        '''MongoDB integers are signed 64 bit.'''
+        return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+    @staticmethod
+    def toUnsigned(value):
+        return value + (1 << 64) if value < 0 else value
+
+
+class SimHashIndex(object):
+
+    def __init__(self, distance=3, collection=None):
+        '''
+        Args:
+            distance(int): most differing bits of a near duplicate
+            collection: MongoDB collection the fingerprints are kept in, or None
+        '''
+        self.distance = distance
+        self.collection = collection
+        self.bands = distance + 1
+        self.bandBits = (SimHash.BITS + self.bands - 1) // self.bands
+        self.lock = threading.Lock()
+        self.clear()
+
+
+    def clear(self):
+        #one dict per band: band value -> list of (fingerprint, url)
+        self.tables = [{} for _ in range(self.bands)]
+        self.size = 0
+
+
+    def load(self):
+        '''Reads the fingerprints stored in the collection.'''
+        with self.lock:
+            self.clear()
+            if self.collection is None:
+                return
+            for post in self.collection.find({}, {"_id": 0, "simhash": 1, "url": 1}):
+                self.insert(SimHash.toUnsigned(post["simhash"]), post["url"])
+
+
+    def keys(self, fingerprint):
+        mask = (1 << self.bandBits) - 1
+        return [(fingerprint >> (band * self.bandBits)) & mask for band in range(self.bands)]
+
+
+    def insert(self, fingerprint, url):
+        for table, key in zip(self.tables, self.keys(fingerprint)):
+            table.setdefault(key, []).append((fingerprint, url))
+        self.size = self.size + 1
+
+
+    def find(self, fingerprint):
+        '''Returns the url of an indexed page within distance
+        bits of fingerprint, or None. Must be called holding
+        self.lock.
+        '''
+        for table, key in zip(self.tables, self.keys(fingerprint)):
+            for other, url in table.get(key, ()):
+                if SimHash.distance(fingerprint, other) <= self.distance:
+                    return url
+        return None
+
+
+    def add(self, fingerprint, url):
+        '''Returns the url of a near duplicate of the page if
+        one was indexed, otherwise remembers the page and
+        returns None. Two near duplicates added at the same
+        time never both get None.
+
+        Args:
+            fingerprint(int): SimHash of the page
+            url(str): url of the page
+        '''
+        with self.lock:
+            original = self.find(fingerprint)
+            if original is not None:
+                return original
+            self.insert(fingerprint, url)
+        if self.collection is not None:
+            self.collection.insert_one({"simhash": SimHash.toSigned(fingerprint), "url": url})
+        return None
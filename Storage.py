@@ -0,0 +1,132 @@
+'''
+Storage holds the collections a crawl writes to: the word
+index, the crawled urls, errors, stats, counters, SimHash
+fingerprints, the link graph, and the shared frontier and
+partition leases of a distributed crawl.
+
+The rest of the crawler only uses them through the calls of a
+pymongo collection, so where they live is decided here. Storage
+itself keeps them in MongoDB, as they always were. open() with
+"sqlite" returns an SQLiteStorage instead, which keeps them in
+one embedded SQLite file and needs no mongod.
+
+connect() returns the storage a worker thread should use:
+MongoDB gets a client per thread, SQLite shares its one
+connection, which it locks.
+
+Batched writes are plain tuples made by updateOne(), insertOne()
+and deleteOne(), run by bulkWrite() on a collection of either
+backend, so SQLite does not have to look inside pymongo's
+request objects.
+'''
+import pymongo
+
+class Storage(object):
+
+    #attribute -> name of the collection, as the crawler has always named them
+    COLLECTIONS = {"words": "db",
+                   "urlsCrawled": "db2",
+                   "errors": "db3",
+                   "stats": "db4",
+                   "counters": "db5",
+                   "fingerprints": "db6",
+                   "links": "db7",
+                   "frontier": "db8",
+                   "leases": "db9"}
+
+    def __init__(self, database="db", uri=None):
+        '''
+        Args:
+            database(str): name of the MongoDB database
+            uri(str): MongoDB server, the local one if None
+        '''
+        self.database = database
+        self.uri = uri
+        self.client = pymongo.MongoClient(uri)
+        self.db = self.client[database]
+        for attribute, name in self.COLLECTIONS.items():
+            setattr(self, attribute, self.db[name])
+
+
+    @staticmethod
+    def open(backend="mongo", path="crawl.db", database="db", shared=False, uri=None):
+        '''Returns the storage of a backend.
+
+        Args:
+            backend(str): "mongo" for MongoDB, "sqlite" for an SQLite file
+            path(str): the SQLite file
+            database(str): name of the MongoDB database
+            shared(bool): other processes write to the SQLite file too
+            uri(str): MongoDB server, the local one if None
+        '''
+        if backend == "sqlite":
+            from SQLiteStorage import SQLiteStorage
+            return SQLiteStorage(path, shared)
+        if backend == "mongo":
+            return Storage(database, uri)
+        raise Exception("Storage Error: Unknown backend %s" % backend)
+
+
+    @staticmethod
+    def updateOne(filter, update, upsert=False):
+        return ("update", filter, update, upsert)
+
+
+    @staticmethod
+    def insertOne(document):
+        return ("insert", document)
+
+
+    @staticmethod
+    def deleteOne(filter):
+        return ("delete", filter)
+
+
+    @staticmethod
+    def request(operation):
+        '''Returns the pymongo request of an operation.'''
+        if operation[0] == "update":
+            return pymongo.UpdateOne(operation[1], operation[2], upsert=operation[3])
+        if operation[0] == "insert":
+            return pymongo.InsertOne(operation[1])
+        if operation[0] == "delete":
+            return pymongo.DeleteOne(operation[1])
+        raise Exception("Storage Error: Unknown operation %s" % operation[0])
+
+
+    @staticmethod
+    def bulkWrite(collection, operations, ordered=True):
+        '''Runs operations of updateOne, insertOne and deleteOne
+        on a collection in one batch. Raises BulkWriteError like
+        pymongo's bulk_write.
+
+        Args:
+            collection: a collection of any storage
+            operations(list): the operations, in order
+            ordered(bool): stop at the first operation that fails
+        '''
+        from SQLiteStorage import SQLiteCollection
+        if isinstance(collection, SQLiteCollection):
+            return collection.bulk_write(operations, ordered=ordered)
+        return collection.bulk_write([Storage.request(operation) for operation in operations], ordered=ordered)
+
+
+    def connect(self):
+        '''Returns a storage for another thread.'''
+        return Storage(self.database, self.uri)
+
+
+    def flush(self):
+        '''Makes the writes so far durable. MongoDB writes are
+        acknowledged one by one, so there is nothing to do.
+        '''
+        pass
+
+
+    def drop(self):
+        '''Deletes every collection.'''
+        self.client.drop_database(self.db)
+
+
+    def close(self):
+        self.client.close()
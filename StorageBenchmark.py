@@ -0,0 +1,209 @@
+'''
+StorageBenchmark checks that the SQLite backend of Storage
+behaves like MongoDB for everything the crawler does with its
+collections, and compares how fast both write the word index.
+
+The equivalence check runs the same writes and queries against
+both backends, each through a WebCrawler of its own: pages with
+duplicate urls stored by the crawler's storePage in one crawl,
+whose stats finishCrawl stores, then counters, upserts,
+projections, sorts, bulk writes and deletes, a search of the word
+index the crawl wrote, and PageRank over its link graph. Every
+result has to be the same. The
+throughput comparison indexes synthetic pages through IndexWriter
+and stores a urlsCrawled document per page, one write at a time,
+as the crawl threads do.
+
+MongoDB is used if a mongod is running, in its own "storagebench"
+database; otherwise only the SQLite numbers are printed.
+
+Usage: python StorageBenchmark.py [pages] [wordsPerPage]
+'''
+from IndexWriter import IndexWriter
+from PageRank import PageRank
+from Storage import Storage
+from WebCrawler import WebCrawler
+import bson
+import contextlib
+import io
+import os
+import pymongo
+import random
+import sys
+import time
+
+class StorageBenchmark(object):
+
+    def __init__(self, pages=20000, wordsPerPage=100, path="storagebench.db"):
+        '''
+        Args:
+            pages(int): pages indexed by the throughput comparison
+            wordsPerPage(int): words of a page
+            path(str): SQLite file, deleted first
+        '''
+        self.pages = pages
+        self.wordsPerPage = wordsPerPage
+        self.path = path
+
+
+    def open(self, backend):
+        '''Returns a crawler on an empty storage of a backend,
+        or None if MongoDB is not running.
+        '''
+        if backend == "sqlite":
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+        else:
+            try:
+                pymongo.MongoClient(serverSelectionTimeoutMS=1000).admin.command("ping")
+            except pymongo.errors.PyMongoError:
+                return None
+        WebCrawler.STORAGE = backend
+        WebCrawler.SQLITE_PATH = self.path
+        WebCrawler.MONGO_DATABASE = "storagebench"
+        crawler = WebCrawler()
+        with contextlib.redirect_stdout(io.StringIO()):
+            crawler.delete()
+        return crawler
+
+
+    @staticmethod
+    def clean(value):
+        '''Drops generated ObjectIds, so results of both
+        backends can be compared.
+        '''
+        if isinstance(value, dict):
+            return {key: StorageBenchmark.clean(item) for key, item in value.items()
+                    if not isinstance(item, bson.ObjectId)}
+        if isinstance(value, list):
+            return [StorageBenchmark.clean(item) for item in value]
+        return value
+
+
+    def workload(self, crawler):
+        '''Runs the checked writes and queries and returns
+        the name and result of every step.
+        '''
+        results = []
+        record = lambda name, value: results.append((name, self.clean(value)))
+        rng = random.Random(7)
+        storage = crawler.storage
+        urls = storage.urlsCrawled
+        vocabulary = ["w%d" % i for i in range(50)]
+        #a crawl storing pages with their words and links, some
+        #urls twice; what the crawler prints is not compared
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = crawler.startCrawl()
+            for page in range(300):
+                url = "http://bench.example/%d" % rng.randrange(200)
+                words = [rng.choice(vocabulary) for _ in range(rng.randint(5, 40))]
+                links = ["http://bench.example/%d" % rng.randrange(250) for _ in range(rng.randint(0, 6))]
+                record("store " + url, crawler.storePage(url, words, urls, {"hash": "h%d" % page}, links))
+            crawler.finishCrawl(started, "benchmark", 1)
+        record("pages", sorted((post["url"], post["docId"], post["count"], post["hash"])
+                               for post in urls.find({}, {"_id": 0, "url": 1, "docId": 1, "count": 1, "hash": 1})))
+        record("stats", storage.stats.find_one({"type": "crawl"}, {"_id": 0, "mode": 1, "threadCount": 1,
+                                                                   "duplicateCount": 1, "postingsSaved": 1}))
+        for _ in range(3):
+            record("counter", storage.counters.find_one_and_update({"_id": "docId"}, {"$inc": {"next": 256}}, upsert = True,
+                                                                   return_document = pymongo.ReturnDocument.AFTER))
+        storage.counters.update_one({"_id": "generation"}, {"$inc": {"value": 1}}, upsert = True)
+        record("generation", storage.counters.find_one({"_id": "generation"}))
+        urls.update_one({"url": "http://bench.example/3"}, {"$set": {"duplicateOf": "http://bench.example/4"}})
+        urls.update_one({"url": "http://bench.example/none"}, {"$set": {"hash": "x"}})
+        record("validators", urls.find_one({"url": "http://bench.example/3"},
+                                           {"_id": 0, "etag": 1, "hash": 1, "duplicateOf": 1}))
+        record("missing", urls.find_one({"url": "http://bench.example/none"}))
+        record("in", sorted(post["url"] for post in urls.find({"docId": {"$in": list(range(0, 300, 7))}})))
+        record("exists", urls.count_documents({"duplicateOf": {"$exists": True}}))
+        record("sorted", [post["url"] for post in urls.find({}, {"url": 1}).sort([("count", pymongo.DESCENDING),
+                                                                                  ("url", pymongo.ASCENDING)])])
+        Storage.bulkWrite(urls, [Storage.updateOne({"docId": docId}, {"$set": {"pagerank": docId / 10}})
+                                 for docId in range(0, 300, 3)], ordered=False)
+        record("bulk", sorted((post["docId"], post["pagerank"]) for post in urls.find({"pagerank": {"$gt": 5}})))
+        try:
+            storage.errors.insert_many([{"_id": 1, "url": "a"}, {"_id": 1, "url": "b"}, {"_id": 2, "url": "c"}],
+                                       ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            record("bulkError", e.details["nInserted"])
+        storage.errors.delete_many({"_id": {"$in": [2]}})
+        record("errors", list(storage.errors.find()))
+        #the word index and link graph of the crawl
+        for query in ("w1", "w2 w3", "w4 OR w5", '"w6 w7"'):
+            record("search " + query, crawler.searchEngine.search(query, 20))
+        graph = crawler.linkGraph
+        ids, keys = graph.pages()
+        scores = PageRank().compute(len(ids), graph.edges(ids, keys))
+        record("pagerank", sorted((docId, round(score, 9)) for docId, score in zip(ids.tolist(), scores.tolist())))
+        storage.flush()
+        return results
+
+
+    def check(self, crawlers):
+        '''Runs the workload on every backend and returns
+        the names of the steps whose results differ.
+        '''
+        results = {backend: self.workload(crawler) for backend, crawler in crawlers.items()}
+        if len(results) < 2:
+            print("MongoDB is not running, SQLite was not compared with it")
+            return []
+        mongo, sqlite = results["mongo"], results["sqlite"]
+        failures = [name for (name, expected), (other, actual) in zip(mongo, sqlite) if expected != actual]
+        if len(mongo) != len(sqlite):
+            failures.append("steps")
+        for name in failures:
+            print("MISMATCH", name)
+        print("%d of %d steps equivalent" % (len(mongo) - len(failures), len(mongo)))
+        return failures
+
+
+    def page(self, rng, vocabulary):
+        return [rng.choice(vocabulary) for _ in range(self.wordsPerPage)]
+
+
+    def throughput(self, storage):
+        '''Returns postings written per second by IndexWriter
+        and page documents stored per second.
+        '''
+        rng = random.Random(1)
+        vocabulary = ["w%d" % i for i in range(20000)]
+        pages = [self.page(rng, vocabulary) for _ in range(self.pages)]
+        start = time.perf_counter()
+        writer = IndexWriter(storage.words, counters = storage.counters)
+        writer.start()
+        for docId, words in enumerate(pages):
+            writer.add(docId, words)
+        writer.close()
+        storage.flush()
+        postings = sum(len(set(words)) for words in pages) / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for docId in range(self.pages):
+            storage.urlsCrawled.insert_one({"url": "http://bench.example/%d" % docId, "count": 1, "docId": docId})
+        storage.flush()
+        stores = self.pages / (time.perf_counter() - start)
+        return postings, stores
+
+
+    def run(self):
+        crawlers = {}
+        for backend in ("mongo", "sqlite"):
+            crawler = self.open(backend)
+            if crawler is not None:
+                crawlers[backend] = crawler
+        failures = self.check(crawlers)
+        print("backend --- index postings/s --- page stores/s")
+        for backend, crawler in crawlers.items():
+            with contextlib.redirect_stdout(io.StringIO()):
+                crawler.delete()
+            postings, stores = self.throughput(crawler.storage)
+            print("%-7s --- %16.0f --- %13.0f" % (backend, postings, stores))
+            crawler.close()
+        return failures
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    benchmark = StorageBenchmark(int(args[0]) if len(args) > 0 else 20000,
+                                 int(args[1]) if len(args) > 1 else 100)
+    sys.exit(1 if benchmark.run() else 0)
@@ -0,0 +1,97 @@
+'''
+URLCanonicalizer turns the many ways of writing a url into
+one, so that the crawler does not fetch the same page twice
+because one link said HTTP://Example.com:80/a/./b#top and
+another said http://example.com/a/b.
+
+canonicalize() gives the url that is fetched and queued. It
+only makes changes that can never point at a different page.
+key() goes further and also ignores a trailing slash; it is
+only used to decide whether a page was already crawled.
+'''
+import re
+import urllib.parse
+
+class URLCanonicalizer(object):
+
+    DEFAULT_PORTS = {"http": 80, "https": 443}
+    #percent escapes of characters that never need escaping
+    UNRESERVED = re.compile("%(2[dDeE]|3[0-9]|[46][1-9a-fA-F]|[57][0-9aA]|5[fF]|7[eE])")
+    ESCAPE = re.compile("%[0-9a-fA-F]{2}")
+
+    @classmethod
+    def canonicalize(cls, url, base=None):
+        '''Returns the canonical form of url, or None if url
+        is not an http or https url.
+
+        Args:
+            url(str): the url, relative urls need base
+            base(str): url the link was found on
+        '''
+        url = url.strip()
+        if base is not None:
+            url = urllib.parse.urljoin(base, url)
+        try:
+            parts = urllib.parse.urlsplit(url)
+            port = parts.port
+        except ValueError:
+            return None
+        scheme = parts.scheme.lower()
+        if scheme not in cls.DEFAULT_PORTS or not parts.hostname:
+            return None
+        host = parts.hostname.lower().rstrip(".")
+        if ":" in host:
+            host = "[" + host + "]"
+        if port is not None and port != cls.DEFAULT_PORTS[scheme]:
+            host = host + ":" + str(port)
+        if parts.username is not None:
+            userinfo = parts.username
+            if parts.password is not None:
+                userinfo = userinfo + ":" + parts.password
+            host = userinfo + "@" + host
+        path = cls.removeDotSegments(cls.normalizeEscapes(parts.path)) or "/"
+        query = cls.normalizeEscapes(parts.query)
+        #the fragment never reaches the server
+        return urllib.parse.urlunsplit((scheme, host, path, query, ""))
+
+
+    @classmethod
+    def key(cls, url):
+        '''Returns the key a url is remembered by in the set
+        of crawled urls: the canonical url without a trailing
+        slash on its path. Non http urls are their own key.
+
+        Args:
+            url(str): the url
+        '''
+        canonical = cls.canonicalize(url) or url
+        parts = urllib.parse.urlsplit(canonical)
+        if len(parts.path) > 1 and parts.path.endswith("/"):
+            canonical = urllib.parse.urlunsplit(parts._replace(path=parts.path.rstrip("/") or "/"))
+        return canonical
+
+
+    @classmethod
+    def normalizeEscapes(cls, text):
+        '''Decodes escapes of unreserved characters and
+        upper cases the hex of the rest.
+        '''
+        text = cls.UNRESERVED.sub(lambda m: chr(int(m.group(1), 16)), text)
+        return cls.ESCAPE.sub(lambda m: m.group(0).upper(), text)
+
+
+    @staticmethod
+    def removeDotSegments(path):
+        '''Resolves "." and ".." segments of a path (RFC 3986 5.2.4).'''
+        if "." not in path:
+            return path
+        output = []
+        for segment in path.split("/")[1:]:
+            if segment == "..":
+                if output:
+                    output.pop()
+            elif segment != ".":
+                output.append(segment)
+        if path.split("/")[-1] in (".", ".."):
+            output.append("")
+        return "/" + "/".join(output)
@@ -43,271 +43,867 @@ Command: mongod
 
 '''
 from WebScraper import WebScraper
+from AsyncCrawler import AsyncCrawler
+from CircuitBreaker import CircuitBreaker
+from CrawlBudget import CrawlBudget
+from CrawlMetrics import CrawlMetrics, MetricsServer
+from DistributedCrawler import DistributedCrawler
+from Frontier import Frontier
+from HostScheduler import HostScheduler
+from IndexWriter import IndexWriter
 from Link import Link
+from LinkGraph import LinkGraph
+from PageRank import PageRank
+from PipelineCrawler import PipelineCrawler
+from PriorityFrontier import PriorityFrontier
+from PostingList import PostingList
+from RetryPolicy import RetryPolicy
+from RobotsCache import RobotsCache
+from SearchEngine import SearchEngine
+from SeenSet import SeenSet, ScalableBloomFilter
+from SharedFrontier import SharedFrontier
+from SimHash import SimHash, SimHashIndex
+from Storage import Storage
+from URLCanonicalizer import URLCanonicalizer
+from WorkerPool import WorkerPool
 import threading
 import queue
 import pymongo
+import sys
 import time
+import urllib.parse
 
 class WebCrawler(object):
     
+    #threads mode starts NUM_THREADS workers and resizes the pool
+    #between MIN_THREADS and MAX_THREADS as the backlog changes
     NUM_THREADS = 4
+    MIN_THREADS = 1
+    MAX_THREADS = 64
+    #document ids are reserved from MongoDB this many at a time
+    ID_BLOCK = 256
+    ASYNC_CONCURRENCY = 200
+    #"exact" remembers crawled urls in a SeenSet, "bloom" in a
+    #ScalableBloomFilter that may skip SEEN_ERROR_RATE of new urls
+    SEEN_SET = "exact"
+    SEEN_ERROR_RATE = 0.001
+    #where the threads mode frontier is kept on disk
+    FRONTIER_DIR = "frontier"
+    #a best-first crawl buffers few links per host, so links keep
+    #gaining in-links in the PriorityFrontier until they are crawled
+    PRIORITY_BUFFER = 64
+    #deepest crawl without a budget, and with one (the most a 
+    #frontier record holds)
+    MAX_DEPTH = 4
+    MAX_BUDGET_DEPTH = 255
+    #most threads on one host at a time, and least seconds between
+    #requests to a host (robots.txt can ask for more)
+    HOST_CONCURRENCY = 2
+    CRAWL_DELAY = 0.0
+    #seconds the robots.txt rules of a host are kept, and the
+    #allow all of a robots.txt that could not be fetched
+    ROBOTS_TTL = 86400
+    ROBOTS_ERROR_TTL = 300
+    #in threads mode a page that failed with a transient error is
+    #tried up to RETRY_ATTEMPTS times, after a jittered delay that
+    #doubles from RETRY_DELAY up to RETRY_MAX_DELAY seconds
+    RETRY_ATTEMPTS = 3
+    RETRY_DELAY = 1.0
+    RETRY_MAX_DELAY = 60.0
+    #a host is left alone for BREAKER_SECONDS, doubling each time,
+    #after BREAKER_THRESHOLD transient failures in a row, and given
+    #up after it opened BREAKER_OPENS times
+    BREAKER_THRESHOLD = 5
+    BREAKER_SECONDS = 15.0
+    BREAKER_OPENS = 3
+    #None uses one parser process per CPU
+    PARSE_PROCESSES = None
+    #distributed mode starts DISTRIBUTED_PROCESSES processes of
+    #NUM_THREADS threads, DISTRIBUTED_TOTAL is the number on all
+    #machines (None if they all run on this one)
+    DISTRIBUTED_PROCESSES = 4
+    DISTRIBUTED_TOTAL = None
+    #pages whose SimHash is this many bits or less from an indexed
+    #page are recorded as its duplicates and not indexed
+    SIMHASH_DISTANCE = 3
+    #"mongo" keeps the collections in the MONGO_DATABASE database
+    #at MONGO_URI (None for the local one), "sqlite" in the 
+    #SQLITE_PATH file, which needs no mongod and which other 
+    #processes write to too if SQLITE_SHARED
+    STORAGE = "mongo"
+    MONGO_URI = None
+    MONGO_DATABASE = "db"
+    SQLITE_PATH = "crawl.db"
+    SQLITE_SHARED = False
+    #seconds between samples of the queue and workers, and between
+    #progress lines, which are printed if PROGRESS is True (None
+    #prints them when the output is a terminal)
+    PROGRESS_INTERVAL = 1.0
+    PROGRESS = None
+    #local port the metrics are served on, None to not serve them
+    METRICS_PORT = None
 
     def __init__(self):
         
-        #Set up mongo db client
-        self.client = pymongo.MongoClient()
-        self.db = self.client.db
-        #Connect to the mongo db's
-        self.words = self.db.db
-        self.urlsCrawled = self.db.db2
-        self.errors = self.db.db3
-        self.stats = self.db.db4
+        #Set up the storage of the collections
+        self.storage = Storage.open(self.STORAGE, self.SQLITE_PATH, self.MONGO_DATABASE,
+                                    shared = self.SQLITE_SHARED, uri = self.MONGO_URI)
+        #Connect to the collections
+        self.words = self.storage.words
+        self.urlsCrawled = self.storage.urlsCrawled
+        self.errors = self.storage.errors
+        self.stats = self.storage.stats
+        self.counters = self.storage.counters
+        self.fingerprints = self.storage.fingerprints
+        self.links = self.storage.links
         
-        self.waitingThreads = 0
         self.crawlCount = 0
-        self.running_threads = []
-        self.dontCrawl = {}
-        self.q = queue.Queue(maxsize=0)
+        self.unchangedCount = 0
+        self.peakPageBytes = 0
+        self.duplicateCount = 0
+        self.postingsSaved = 0
+        self.bytesSaved = 0
+        self.nearDuplicates = SimHashIndex(self.SIMHASH_DISTANCE, self.fingerprints)
+        self.linkGraph = LinkGraph(self.links, self.urlsCrawled)
+        self.searchEngine = SearchEngine(self.words, self.urlsCrawled, self.counters)
+        self.countLock = threading.Lock()
+        self.peakThreads = 0
+        #[crawled, errors] per seed of a batch, None otherwise
+        self.seedCounts = None
+        self.dontCrawl = self.newSeenSet()
+        self.robots = RobotsCache(self.ROBOTS_TTL, self.ROBOTS_ERROR_TTL)
+        self.frontier = Frontier(self.FRONTIER_DIR)
+        self.q = HostScheduler(self.frontier, self.robots, self.alreadyCrawled, 
+                               self.HOST_CONCURRENCY, self.CRAWL_DELAY)
+        self.retries = RetryPolicy(self.RETRY_ATTEMPTS, self.RETRY_DELAY, self.RETRY_MAX_DELAY)
+        self.budget = CrawlBudget()
+        self.stopping = False
+        self.indexWriter = None
+        #timings of every stage, recorded by the scrapers' pool too
+        self.metrics = CrawlMetrics()
+        WebScraper.pool.metrics = self.metrics
+        self.metricsServer = None
+        if self.METRICS_PORT is not None:
+            self.metricsServer = MetricsServer(self.metrics, self.METRICS_PORT)
+            print("Serving metrics on", self.metricsServer.start() + "/metrics")
+        #range of document ids reserved by this crawler
+        self.idLock = threading.Lock()
+        self.nextId = 0
+        self.lastId = -1
+        #ids handed out for pages that turned out to be stored already
+        self.freeIds = []
+        #MongoDB databases get their indexes from delete(), 
+        #an SQLite file when it is opened
+        if self.STORAGE == "sqlite":
+            self.createIndexes()
     
-    def workers(self, id, sema, sema2, cv, barrier):
-        """workers are threads spawned by crawlURL.
+    def workers(self, id, pool):
+        """workers are threads run by the WorkerPool
+        of crawlThreads.
         
-        These workers will crawl a starting link
-        to a certain depth, then end. While crawling,
-        it will add data about these webpages to a 
-        MongoDB database. 
+        These workers will crawl links from the queue
+        until the crawl is over or the pool asks them
+        to retire. While crawling, it will add data 
+        about these webpages to the storage. 
         
         Args:
         
             id(int): Thread identifier
-            sema(threading.Semaphore): guards crawlCount and waitingThreads
-            sema2(threading.Semaphore): guards dontCrawl
-            cv(threading.Condition): allowed threads to wait and be notified
-            barrier(threading.Barrier): creates a barrier for threads
+            pool(WorkerPool): the pool running the worker
             
         """
         #make local connections for each thread
-        client = pymongo.MongoClient()
-        db = client.db
-        words = db.db
-        urlsCrawled = db.db2
-        errors = db.db3
+        storage = self.storage.connect()
+        urlsCrawled = storage.urlsCrawled
+        errors = storage.errors
         
-        done = False
         crawled = 0
         
-        if id is 1:
-            self.waitingThreads = 0
-            self.crawlCount = 0
-            self.dontCrawl = {}
-            
-        barrier.wait()
-        while not done:
+        while not self.stopping:
+            try:
+                #blocks until there is a link, the queue raises
+                #Empty once every link was crawled or on stop()
+                link = self.q.get()
+            except queue.Empty:
+                pool.finish()
+                break
+            if not self.budget.claim():
+                #a budget ran out, every worker stops after its page
+                self.q.stop()
+                self.q.done(link)
+                pool.finish()
+                break
+            start = time.monotonic()
+            failed = True
+            #retried links are not done yet, transient failures count
+            #towards the breaker of their host
+            retried = False
+            hostFailed = False
+            #the page still holds its claim on the budget
+            claimed = True
             try:
-                # If `False`, the program is not blocked, it will throw the Queue.Empty exception.
-                link = self.q.get(True, .1)
                 url = link.getURL()
                 depth = link.getDepth()
-                #print("STARTED crawling url ", url)
-                #if the url has not been crawled 
-                #during this function call
-                #then continue with crawl
-                if not self.alreadyCrawled(url, sema2):
-                    #create our scraper object
-                    scraper = WebScraper(url)
+                #the scheduler only hands out urls that have not
+                #been crawled during this function call
+                if self.q.gaveUp(link):
+                    self.budget.release()
+                    claimed = False
+                    self.insertError(url, "Host gave too many transient errors", errors, "host-down")
+                elif not self.robots.allowed(url):
+                    self.budget.release()
+                    claimed = False
+                    self.insertError(url, "Disallowed by robots.txt", errors, "robots")
+                else:
+                    #create our scraper object, conditional if the
+                    #page was crawled before
+                    scraper = WebScraper(url, validators=self.storedValidators(url, urlsCrawled))
+                    self.recordPeak(scraper.peakBytes)
+                    self.budget.charge(scraper.pageBytes)
+                    claimed = False
                     if not scraper.error:
-                        #print("No Scraper Error --- crawling url ", url)
+                        #Put all links into a Python Set to remove duplicates
+                        links = set(scraper.crawlLinks())
                         if depth > 0:
-                            #Put all links into a Python Set to remove duplicates
-                            links = set(scraper.crawlLinks())
                             #Add all links to queue
-                            for link in links:
-                                queuedLink = Link(link, depth - 1)
+                            for found in links:
+                                queuedLink = Link(found, depth - 1, link.getSeed())
                                 self.q.put(queuedLink)
-                        
-                        #Notify other threads to check the queue again for links
-                        #if they are currently waiting. 
-                        sema.acquire()
-                        self.waitingThreads = 0
-                        cv.acquire()
-                        cv.notify_all()
-                        #print("Thread ", id, " NOTIFYING")
-                        cv.release()
-                        sema.release()
-                        #Insert url into urlsCrawled
-                        try:
-                            urlsCrawled.insert({"url": url, "count": 1})
-                            inserted = True
-                        #If url has already been inserted, then just increment count
-                        except pymongo.errors.DuplicateKeyError:
-                            urlsCrawled.update_one({"url": url},{"$inc": {"count": 1}})
-                            inserted = False
-                        #If inserted, then the url's text needs to be added too. 
-                        if inserted:
-                            #Put all text into a Python Set to remove duplicate words
-                            text = set(scraper.crawlText())
-                            for word in text:
-                                #Insert word into words
-                                try:
-                                    words.insert({"word":word, "urls":[url]})
-                                #if word has already been inserted, then update urls. 
-                                except pymongo.errors.DuplicateKeyError:
-                                    words.update_one({"word": word}, {'$push': {"urls": url}})
-                        #print("FINISHED Crawling url ", url)
+                        if scraper.unchanged:
+                            self.revisitPage(url, scraper.validators, urlsCrawled)
+                        else:
+                            self.storePage(url, scraper.crawlText(), urlsCrawled, 
+                                           scraper.validators, links)
                         crawled = crawled + 1
+                        failed = False
                     else:
-                        #Insert error
-                        errorMessage = scraper.getErrorMessage()
-                        self.insertError(url, errorMessage, errors)
-            #if the queue is empty, then have the threads
-            #wait. If all the threads but one are waiting, then
-            #no more urls need to be crawled and the workers are done.
-            except queue.Empty:
-                sema.acquire()
-                if self.waitingThreads < self.NUM_THREADS - 1:
-                    self.waitingThreads = self.waitingThreads + 1
-                    #print("Thread ", id, " is waiting. Waiting Thread Count: ", self.waitingThreads)
-                    sema.release()
-                    with cv:
-                        cv.wait()
-                        #print("Thread ", id, " woken up.")
-                else:
-                    sema.release()
-                    done = True
-                    cv.acquire()
-                    cv.notify_all()
-                    cv.release()
+                        self.budget.release()
+                        claimed = False
+                        kind = scraper.errorKind
+                        attempt = self.q.attempt(link)
+                        if self.retries.shouldRetry(kind, attempt):
+                            #tried again later, by any worker
+                            self.q.retry(link, self.retries.delay(attempt, scraper.retryAfter))
+                            self.metrics.count("retries")
+                            retried = True
+                        else:
+                            #Insert error
+                            hostFailed = self.retries.isTransient(kind)
+                            errorMessage = scraper.getErrorMessage()
+                            self.insertError(url, errorMessage, errors, kind)
+            except Exception as e:
+                #a page that broke the crawler, for example one the
+                #storage could not take, is failed and the worker
+                #goes on with the next one
+                failed = True
+                if claimed:
+                    self.budget.release()
+                self.insertError(link.getURL(), str(e), errors, RetryPolicy.classify(e))
+            finally:
+                #the link is crawled, a checkpoint no longer needs it,
+                #and the crawl is over once no link is left undone
+                if not retried:
+                    self.q.done(link, hostFailed)
+                if self.seedCounts is not None and not retried:
+                    counts = self.seedCounts[link.getSeed()]
+                    with self.countLock:
+                        if failed:
+                            counts[1] = counts[1] + 1
+                        else:
+                            counts[0] = counts[0] + 1
+            latency = time.monotonic() - start
+            pool.recordLatency(latency)
+            self.metrics.record("page", latency)
+            if pool.shouldRetire(id):
+                break
+        storage.close()
         print("Thread ", id, " crawled ", crawled, " webpages.")
-        sema.acquire()
-        self.crawlCount = self.crawlCount + crawled
-        sema.release()
+        with self.countLock:
+            self.crawlCount = self.crawlCount + crawled
         return
         
 
-    def crawlURL(self, url, depth):
+    def storePage(self, url, text, urlsCrawled, validators=None, links=None):
+        """storePage records a crawled page in MongoDB. 
+        The url is added to urlsCrawled, and if this is the
+        first time the url was crawled then its text is
+        handed to the index writer. 
+        
+        Args:
+            url(str): The url of the crawled page
+            text(list): words of the page, from WebScraper.crawlText
+            urlsCrawled: MongoDB connection for the crawled urls
+            validators(dict): etag, lastModified and hash of the page
+            links(iterable): links found on the page, replayed when
+                the page is crawled again and has not changed, and
+                kept in the link graph for PageRank
+        """
+        start = time.perf_counter()
+        docId = self.nextDocId()
+        fields = dict(validators or {})
+        if links is not None:
+            fields["links"] = sorted(links)
+        #Insert url into urlsCrawled
+        try:
+            page = {"url": url, "count": 1, "docId": docId}
+            page.update(fields)
+            urlsCrawled.insert_one(page)
+            inserted = True
+        #If url has already been inserted, then just increment count
+        except pymongo.errors.DuplicateKeyError:
+            #the page keeps the id it was stored with
+            self.releaseDocId(docId)
+            update = {"$inc": {"count": 1}}
+            if fields:
+                update["$set"] = fields
+            page = urlsCrawled.find_one_and_update({"url": url}, update, {"_id": 0, "docId": 1})
+            docId = page.get("docId") if page else None
+            inserted = False
+        #the link graph keeps the links of the newest crawl
+        if links is not None and docId is not None:
+            self.linkGraph.add(docId, links)
+        #If inserted, then the url's text needs to be added too. 
+        if inserted:
+            words = set(text)
+            original = None
+            if len(text) >= SimHash.MIN_WORDS:
+                original = self.nearDuplicates.add(SimHash.fingerprint(text), url)
+            if original is not None:
+                #the words are already indexed for the original
+                urlsCrawled.update_one({"url": url}, {"$set": {"duplicateOf": original}})
+                with self.countLock:
+                    self.duplicateCount = self.duplicateCount + 1
+                    self.postingsSaved = self.postingsSaved + len(words)
+                    #each posting carries the word and an id of up to 8 bytes
+                    self.bytesSaved = self.bytesSaved + sum(len(word) + 8 for word in words)
+            else:
+                #the writer keeps where each word is and how often
+                self.indexWriter.add(docId, text)
+        self.metrics.record("store", time.perf_counter() - start)
+        self.metrics.count("pages")
+        return inserted
+    
+    
+    def recordPeak(self, peakBytes):
+        """recordPeak keeps the most body bytes any page
+        held in memory at once while it was downloaded. 
+        
+        Args:
+            peakBytes(int): peak body bytes of one page
+        """
+        with self.countLock:
+            self.peakPageBytes = max(self.peakPageBytes, peakBytes)
+    
+    
+    def storedValidators(self, url, urlsCrawled):
+        """storedValidators returns the validators and links
+        stored the last time url was crawled, or None if it 
+        never was. 
+        
+        Args:
+            url(str): The url about to be crawled
+            urlsCrawled: MongoDB connection for the crawled urls
+        """
+        start = time.perf_counter()
+        validators = urlsCrawled.find_one({"url": url}, 
+                                          {"_id": 0, "etag": 1, "lastModified": 1, "hash": 1, "links": 1})
+        self.metrics.record("lookup", time.perf_counter() - start)
+        return validators
+    
+    
+    def revisitPage(self, url, validators, urlsCrawled):
+        """revisitPage records a crawl of a page that did
+        not change since it was stored. Only its count and 
+        validators are updated, the index already has its words. 
+        
+        Args:
+            url(str): The url of the crawled page
+            validators(dict): validators of the page, from WebScraper
+            urlsCrawled: MongoDB connection for the crawled urls
+        """
+        start = time.perf_counter()
+        fields = {key: validators[key] for key in ("etag", "lastModified", "hash") if key in validators}
+        urlsCrawled.update_one({"url": url}, {"$inc": {"count": 1}, "$set": fields})
+        with self.countLock:
+            self.unchangedCount = self.unchangedCount + 1
+        self.metrics.record("store", time.perf_counter() - start)
+        self.metrics.count("pages")
+    
+    
+    def nextDocId(self):
+        """nextDocId returns the next integer document id
+        for a page. Ids are reserved from the counters 
+        collection ID_BLOCK at a time, so most calls do not
+        touch MongoDB. Ids given back by releaseDocId are
+        used first, so the ids stored stay dense. 
+        """
+        with self.idLock:
+            if self.freeIds:
+                return self.freeIds.pop()
+            if self.nextId > self.lastId:
+                counter = self.counters.find_one_and_update({"_id": "docId"}, 
+                                                            {"$inc": {"next": self.ID_BLOCK}}, 
+                                                            upsert = True, 
+                                                            return_document = pymongo.ReturnDocument.AFTER)
+                self.lastId = counter["next"] - 1
+                self.nextId = counter["next"] - self.ID_BLOCK
+            docId = self.nextId
+            self.nextId = self.nextId + 1
+        return docId
+    
+    
+    def releaseDocId(self, docId):
+        """releaseDocId gives back an id from nextDocId
+        that was not stored, so the next page gets it. 
+        
+        Args:
+            docId(int): the unused id
+        """
+        with self.idLock:
+            self.freeIds.append(docId)
+    
+    
+    def crawlURL(self, url, depth, mode="threads", resume=False, budget=None, scorer=None):
         """crawlURL spawns worker threads
-        that will crawl a given url to a certain depth.
+        that will crawl a given url to a certain depth, 
+        or until a budget runs out. 
         
         Args:
         
             url(str): starting url to crawl
             depth(int): depth at which to stop crawling, MAX = 4
+                without a budget
+            mode(str): "threads" crawls with NUM_THREADS worker threads,
+                "async" crawls on one asyncio event loop with
+                ASYNC_CONCURRENCY downloads in flight, 
+                "pipeline" downloads with NUM_THREADS threads and
+                parses in PARSE_PROCESSES processes,
+                "distributed" crawls with DISTRIBUTED_PROCESSES processes
+                sharing a frontier in the storage
+            resume(bool): in threads mode, continue the crawl that
+                was interrupted instead of starting from url; in 
+                distributed mode, join the crawl in the shared frontier
+            budget(CrawlBudget): most pages, bytes and seconds to
+                crawl, None for no limit, not in distributed mode
+            scorer(function): in threads mode, crawl best-first
+                with a PriorityFrontier ordered by this score, such
+                as a LinkScorer, instead of in the order links are found
             
         """
-        if depth > 4:
-            depth = 4
-        if(depth is 0) and (self.urlsCrawled.count({"url": url}) is not 0):
+        self.budget = budget or CrawlBudget()
+        self.seedCounts = None
+        depth = min(depth, self.maxDepth())
+        #pages are stored under their canonical url
+        url = URLCanonicalizer.canonicalize(url) or url
+        if(depth == 0) and (self.urlsCrawled.count_documents({"url": url}) != 0):
             return
+        started = self.startCrawl()
+        try:
+            if mode == "async":
+                crawler = AsyncCrawler(self, self.ASYNC_CONCURRENCY)
+                self.crawlCount = crawler.crawl(url, depth)
+                threadCount = self.ASYNC_CONCURRENCY
+            elif mode == "pipeline":
+                crawler = PipelineCrawler(self, self.NUM_THREADS, self.PARSE_PROCESSES)
+                self.crawlCount = crawler.crawl(url, depth)
+                threadCount = self.NUM_THREADS
+            elif mode == "distributed":
+                crawler = DistributedCrawler(self, self.DISTRIBUTED_PROCESSES, self.NUM_THREADS, 
+                                             self.DISTRIBUTED_TOTAL)
+                self.crawlCount = crawler.crawl(url, depth, resume)
+                threadCount = self.DISTRIBUTED_PROCESSES * self.NUM_THREADS
+            else:
+                self.crawlThreads([Link(url, depth)], resume, scorer)
+                threadCount = self.peakThreads
+        finally:
+            self.metrics.stop()
+        self.finishCrawl(started, mode, threadCount)
+        return
+    
+    
+    def crawlSeeds(self, seeds, resume=False, budget=None):
+        """crawlSeeds crawls many starting urls as one
+        threads mode crawl: every seed is queued at once
+        into one frontier, one pool of workers crawls them
+        all and a url found from several seeds is crawled 
+        once. While it runs seedCounts holds the pages 
+        crawled and failed per seed. 
+        
+        Args:
+            seeds(list): (url, depth) of every starting url, a
+                link is counted for the seed at its index
+            resume(bool): continue the batch that was interrupted
+                instead of queuing the seeds again
+            budget(CrawlBudget): most pages, bytes and seconds to
+                crawl for the whole batch, None for no limit
+        
+        Returns the stats record of the crawl. 
+        """
+        self.budget = budget or CrawlBudget()
+        maxDepth = self.maxDepth()
+        links = [Link(URLCanonicalizer.canonicalize(url) or url, min(depth, maxDepth), seed) 
+                 for seed, (url, depth) in enumerate(seeds)]
+        self.seedCounts = [[0, 0] for _ in seeds]
+        started = self.startCrawl()
+        try:
+            self.crawlThreads(links, resume)
+        finally:
+            self.metrics.stop()
+        return self.finishCrawl(started, "batch", self.peakThreads)
+    
+    
+    def maxDepth(self):
+        """Deepest crawl allowed with the current budget,
+        a budget ends the crawl, so it may go deeper.
+        """
+        return self.MAX_DEPTH if self.budget.unlimited() else self.MAX_BUDGET_DEPTH
+    
+    
+    def startCrawl(self):
+        """startCrawl resets the counts of the last 
+        crawl and starts the budget, index writer and
+        metrics. Returns what finishCrawl needs. 
+        """
         #start time for stats of crawl
         start = time.time()
-        #add url and depth to the queue
-        queuedLink = Link(url, depth)
-        self.q.put(queuedLink)
+        self.budget.start()
+        self.unchangedCount = 0
+        self.peakPageBytes = 0
+        self.duplicateCount = 0
+        self.postingsSaved = 0
+        self.bytesSaved = 0
+        #near duplicates of pages indexed by earlier crawls count too
+        self.nearDuplicates.load()
+        requests, reused = WebScraper.pool.getStats()
+        #word index writes are batched by a background thread
+        self.indexWriter = IndexWriter(self.words, counters = self.counters)
+        self.indexWriter.start()
+        self.metrics.reset()
+        progress = self.PROGRESS if self.PROGRESS is not None else sys.stdout.isatty()
+        self.metrics.start(self.PROGRESS_INTERVAL, progress)
+        return start, requests, reused
+    
+    
+    def finishCrawl(self, started, mode, threadCount):
+        """finishCrawl flushes the index, prints the
+        stats of the crawl and stores them.
         
-        sema = threading.Semaphore()
-        sema2 = threading.Semaphore()
-        cv = threading.Condition()
-        barrier = threading.Barrier(self.NUM_THREADS)
+        Args:
+            started(tuple): what startCrawl returned
+            mode(str): the crawl mode
+            threadCount(int): most workers the crawl ran
         
-        for i in range(self.NUM_THREADS):
-            t = threading.Thread(target=self.workers, args=(i + 1, sema, sema2, cv, barrier,))
-            # t.setDaemon(True) # we are not setting the damenon flag
-            t.start()
-
-            self.running_threads.append(t)
-        # joining threads (we need this if the daemon flag is false)
-        for t in self.running_threads:
-            t.join()
+        Returns the stats record of the crawl.
+        """
+        start, requests, reused = started
+        #flush the rest of the index before the crawl counts as done
+        self.indexWriter.close()
+        self.nextGeneration()
         
         crawlTime = round(time.time() - start, 3)
+        #share of requests during this crawl that reused a keep-alive connection
+        requestsEnd, reusedEnd = WebScraper.pool.getStats()
+        reuseRate = 0.0
+        if requestsEnd > requests:
+            reuseRate = round((reusedEnd - reused) / (requestsEnd - requests), 3)
         print("Execution Time:", crawlTime)
         print("Crawled Count:", self.crawlCount)
-        print("Error Count:", self.errors.find().count())
-        self.stats.insert({"type": "crawl", 
-                           "threadCount": self.NUM_THREADS,
-                           "crawlCount": self.crawlCount, 
-                           "executionTime": crawlTime,
-                           "time": time.strftime("%I:%M:%S"), 
-                           "date": time.strftime("%d/%m/%Y")})
-        return
+        print("Unchanged Count:", self.unchangedCount)
+        print("Peak Page Bytes:", self.peakPageBytes)
+        print("Near Duplicate Count:", self.duplicateCount, 
+              "(", self.postingsSaved, "index writes and", self.bytesSaved, "bytes saved )")
+        print("Error Count:", self.errorCount())
+        print("Retry Count:", self.metrics.snapshot()["retries"])
+        print("Connection Reuse Rate:", reuseRate)
+        if self.budget.exhausted():
+            print("Budget Reached:", self.budget.reason, "(", self.budget.bytes, "bytes crawled )")
+        metrics = self.metrics.snapshot()
+        self.printMetrics(metrics)
+        record = {"type": "crawl", 
+                  "mode": mode,
+                  "threadCount": threadCount,
+                  "crawlCount": self.crawlCount, 
+                  "unchangedCount": self.unchangedCount,
+                  "peakPageBytes": self.peakPageBytes,
+                  "duplicateCount": self.duplicateCount,
+                  "postingsSaved": self.postingsSaved,
+                  "bytesSaved": self.bytesSaved,
+                  "executionTime": crawlTime,
+                  "connectionReuseRate": reuseRate,
+                  "crawlBytes": self.budget.bytes,
+                  "budgetReached": self.budget.reason,
+                  "metrics": metrics,
+                  "time": time.strftime("%I:%M:%S"), 
+                  "date": time.strftime("%d/%m/%Y")}
+        self.stats.insert_one(dict(record))
+        #commit what an embedded storage still batches
+        self.storage.flush()
+        return record
     
     
-    def alreadyCrawled(self, url, sema2):
+    def crawlThreads(self, seeds, resume=False, scorer=None):
+        """crawlThreads starts a pool of NUM_THREADS
+        workers on the seeds, which grows and shrinks with
+        the backlog, and waits until every link was crawled 
+        or the budget ran out. On Ctrl-C the workers are 
+        stopped, what was crawled is kept and the frontier
+        is checkpointed so the crawl can be resumed. 
+        
+        Args:
+            seeds(list): Links of the starting urls
+            resume(bool): continue from the frontier's last checkpoint
+            scorer(function): score of a PriorityFrontier, None
+                crawls links in the order they are found
+        """
+        self.crawlCount = 0
+        self.stopping = False
+        self.dontCrawl = self.newSeenSet()
+        self.q.hostConcurrency = self.HOST_CONCURRENCY
+        self.q.crawlDelay = self.CRAWL_DELAY
+        self.q.breaker = CircuitBreaker(self.BREAKER_THRESHOLD, self.BREAKER_SECONDS, self.BREAKER_OPENS)
+        self.retries = RetryPolicy(self.RETRY_ATTEMPTS, self.RETRY_DELAY, self.RETRY_MAX_DELAY)
+        if scorer is not None:
+            self.q.frontier = PriorityFrontier(self.FRONTIER_DIR, scorer)
+            self.q.buffer = self.PRIORITY_BUFFER
+        else:
+            self.q.frontier = self.frontier
+            self.q.buffer = HostScheduler.BUFFER
+        if self.q.open(resume):
+            #everything handed out before the checkpoint was crawled
+            for crawledURL in self.q.taken():
+                self.dontCrawl.add(URLCanonicalizer.key(crawledURL))
+            print("Resuming crawl,", len(self.dontCrawl), "urls already crawled")
+        else:
+            #add the starting urls and depths to the queue
+            for queuedLink in seeds:
+                self.q.put(queuedLink)
+        
+        pool = WorkerPool(self.workers, self.MIN_THREADS, self.MAX_THREADS,
+                          self.q.backlog, self.q.parallelism)
+        self.metrics.watch(self.q.backlog, pool.size)
+        #workers waiting for a link are stopped when the time is up
+        timer = None
+        if self.budget.remaining() is not None:
+            timer = threading.Timer(self.budget.remaining(), self.q.stop)
+            timer.daemon = True
+            timer.start()
+        try:
+            pool.run(self.NUM_THREADS)
+        except KeyboardInterrupt:
+            #workers finish the link they are on and exit
+            self.stopping = True
+            self.q.stop()
+            pool.join()
+            self.peakThreads = pool.peak
+            self.q.close(finished=False)
+            #keep what was crawled
+            self.indexWriter.close()
+            self.nextGeneration()
+            self.storage.flush()
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+        self.peakThreads = pool.peak
+        #a crawl that ran out of budget is over too
+        self.q.close(finished=True)
+    
+    
+    def alreadyCrawled(self, url):
         """This method checks to see if the current
         url that is being crawled was already crawled 
         during this round of crawling. IT DOES NOT
         check if this url is in MongoDB, which holds
         records of ALL the rounds of crawling. 
+        Urls that only differ in a trailing slash
+        count as the same url. 
         
         Args:
             url(str): The url that needs to checked
-            sema2(threading.Semaphore): Semaphore to guard the 
-                shared resource self.dontCrawl
         """        
-        sema2.acquire()
-        if url in self.dontCrawl:
-            crawled = True
-        else:
-            self.dontCrawl[url] = 1
-            crawled = False
-        sema2.release()
-        return crawled
+        #self.dontCrawl locks itself, per shard
+        return self.dontCrawl.add(URLCanonicalizer.key(url))
     
     
-    def insertError(self, url, errorMessage, errors):
-        """This method will insert a error record
-        into MongoDB. 
+    def newSeenSet(self):
+        """newSeenSet returns an empty set of crawled
+        urls of the kind chosen by SEEN_SET.
+        """
+        if self.SEEN_SET == "bloom":
+            return ScalableBloomFilter(errorRate = self.SEEN_ERROR_RATE)
+        return SeenSet()
+    
+    
+    def printMetrics(self, metrics):
+        """printMetrics prints how long each stage of a
+        page took during a crawl. 
+        
+        Args:
+            metrics(dict): a CrawlMetrics snapshot
+        """
+        print("Worker Utilization:", metrics["utilization"], 
+              "( most links queued", metrics["queueMax"], ")")
+        print("stage    ---  count --- p50 ms --- p95 ms --- p99 ms --- max ms")
+        for stage, summary in metrics["stages"].items():
+            print("%-8s --- %6d --- %6.1f --- %6.1f --- %6.1f --- %6.1f" 
+                  % (stage, summary["count"], 1000 * summary["p50"], 1000 * summary["p95"], 
+                     1000 * summary["p99"], 1000 * summary["max"]))
+    
+    
+    def insertError(self, url, errorMessage, errors, kind="other"):
+        """This method will count an error in the
+        errors collection. Errors are kept as one record
+        per kind and host, with how many there were and
+        the last url and message, instead of one record
+        per failure. 
         
         Args:
             url(str): The url that the error appeared during
             errorMessage(str): The message that was created for the error
             errors: MongoDB connection that the error message is inserted into
+            kind(str): what failed, a RetryPolicy kind, "robots" or "host-down"
         """
+        self.metrics.count("errors")
+        host = urllib.parse.urlsplit(url).netloc.lower()
         crawlTime = str(time.strftime("%I:%M:%S"))
         crawlDate = str(time.strftime("%d/%m/%Y"))
-        errors.insert({"type": "crawl",
-                            "url": url, 
-                            "errorMessage": errorMessage,
-                            "time": crawlTime,
-                            "date": crawlDate})
-    
-    
-    def searchWords(self, word):
-        """Searchs for a word in MongoDB, 
-        and if that word exists then all
-        of the url's that the word appears
-        in will be printed.
+        errors.update_one({"_id": kind + " " + host},
+                          {"$inc": {"count": 1},
+                           "$set": {"url": url, 
+                                    "errorMessage": errorMessage,
+                                    "time": crawlTime,
+                                    "date": crawlDate},
+                           "$setOnInsert": {"type": "crawl",
+                                            "kind": kind,
+                                            "host": host,
+                                            "transient": self.retries.isTransient(kind)}},
+                          upsert = True)
+    
+    
+    def errorCount(self):
+        """errorCount returns the number of errors
+        counted in the errors collection.
+        """
+        #records from before errors were aggregated count once
+        return sum(post.get("count", 1) for post in self.errors.find({}, {"count": 1}))
+    
+    
+    def nextGeneration(self):
+        """nextGeneration counts a crawl that changed the 
+        index, which drops the cached search results of 
+        every SearchEngine on this database. 
+        """
+        self.counters.update_one({"_id": "generation"}, {"$inc": {"value": 1}}, upsert = True)
+    
+    
+    def rankPages(self):
+        """rankPages computes the PageRank of every crawled
+        page from the links stored by the crawls and saves it 
+        in urlsCrawled, where searchWords uses it to order 
+        its results. 
+        """
+        print("Computing PageRank...")
+        start = time.time()
+        ids, keys = self.linkGraph.pages()
+        pageRank = PageRank()
+        scores = pageRank.compute(len(ids), self.linkGraph.edges(ids, keys))
+        self.linkGraph.saveScores(ids, scores)
+        #cached results were ordered without the new ranks
+        self.nextGeneration()
+        rankTime = round(time.time() - start, 3)
+        print("Pages:", len(ids), "Links:", pageRank.edges)
+        print("Iterations:", pageRank.iterations, "Change:", pageRank.change)
+        print("Build Time:", round(pageRank.buildTime, 3), 
+              "Convergence Time:", round(pageRank.convergenceTime, 3))
+        print("Execution Time:", rankTime)
+        self.stats.insert_one({"type": "pagerank", 
+                               "pages": len(ids),
+                               "edges": pageRank.edges,
+                               "iterations": pageRank.iterations,
+                               "convergenceTime": round(pageRank.convergenceTime, 3),
+                               "executionTime": rankTime,
+                               "time": time.strftime("%I:%M:%S"), 
+                               "date": time.strftime("%d/%m/%Y")})
+        self.storage.flush()
+        return scores
+    
+    
+    def searchWords(self, query, limit=20):
+        """Searchs MongoDB for the pages that match
+        a query and prints the best of them, ranked
+        with BM25 and the PageRank from rankPages. 
         
         Args:
-            word(str): Must be a single word without spacing
+            query(str): words, "quoted phrases" and OR, see SearchEngine
+            limit(int): most urls printed
         """
-        print("Here are all the url's that have '%s' in it." % word)
-        for post in self.words.find({"word" : word}):
-            for url in post['urls']:
-                print(url)
+        print("Here are the best url's for '%s'." % query)
+        start = time.perf_counter()
+        results = self.searchEngine.search(query, limit)
+        for url, score in results:
+            print(score, url)
+        print("%d results in %.1f ms" % (len(results), (time.perf_counter() - start) * 1000))
         print('')
-        return
+        return results
     
     
     def delete(self):
         """delete will drop all MongoDB
-        databases that were used for crawling
+        databases that were used for crawling, 
+        or empty the SQLite file
         """        
-        self.client.drop_database(self.db)
-        self.words.create_index([("word", pymongo.ASCENDING)], unique = True)
-        self.urlsCrawled.create_index([("url", pymongo.ASCENDING)], unique = True)
+        self.storage.drop()
+        self.nearDuplicates.load()
+        self.searchEngine.clear()
+        with self.idLock:
+            self.nextId = 0
+            self.lastId = -1
+            self.freeIds = []
+        self.createIndexes()
+        self.storage.flush()
         print("\nDatabases Deleted\n")
     
     
+    def createIndexes(self):
+        """createIndexes creates the indexes the crawl
+        relies on, the unique url index above all. 
+        """
+        self.words.create_index([("word", pymongo.ASCENDING), ("first", pymongo.ASCENDING)])
+        self.urlsCrawled.create_index([("url", pymongo.ASCENDING)], unique = True)
+        self.urlsCrawled.create_index([("docId", pymongo.ASCENDING)], unique = True, sparse = True)
+        self.linkGraph.createIndex()
+        SharedFrontier.createIndex(self.storage.frontier)
+    
+    
+    def close(self):
+        """close stops serving metrics and commits and 
+        closes the storage."""
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
+        self.storage.close()
+    
+    
     def printWords(self):
         """printWords will print all words
         and the url's that word was found one
         """        
         print("---Printing Words---")
-        for post in self.words.find().sort("word", pymongo.ASCENDING):
-            urls = list(post['urls'])
-            print(post['word'], "---urls--->", urls)
+        urlOf = {}
+        for post in self.urlsCrawled.find({"docId": {"$exists": True}}):
+            urlOf[post['docId']] = post['url']
+        word = None
+        urls = []
+        #the blocks of a word are next to each other when sorted
+        for post in self.words.find().sort([("word", pymongo.ASCENDING), ("first", pymongo.ASCENDING)]):
+            if post['word'] != word:
+                if word is not None:
+                    print(word, "---urls--->", urls)
+                word = post['word']
+                urls = []
+            urls.extend(post.get('urls', []))
+            urls.extend(urlOf[docId] for docId in PostingList.read(post) if docId in urlOf)
+        if word is not None:
+            print(word, "---urls--->", urls)
         print("---Done Printing Words---")
         
         
@@ -326,9 +922,11 @@ class WebCrawler(object):
         that have been recorded
         """        
         print("---Printing Errors---")
-        print("Format = 'errorMessage', 'url', 'time', 'date'")
+        print("Format = 'kind', 'host', 'count', 'errorMessage', 'last url', 'time', 'date'")
         for post in self.errors.find():
-            print(post['errorMessage'], ", ", post['url'], ", ", post['time'], ", ", post['date'])
+            #records from before errors were aggregated have no kind
+            print(post.get('kind', '-'), ", ", post.get('host', '-'), ", ", post.get('count', 1), ", ", 
+                  post['errorMessage'], ", ", post['url'], ", ", post['time'], ", ", post['date'])
         print("---Done printing Errors---")
         
         
@@ -337,9 +935,13 @@ class WebCrawler(object):
         have been recorded
         """        
         print("---Printing Stats---")
-        print("Format = 'threadCount', 'urlsCrawled', 'executionTime', 'time', 'date'")
-        for post in self.stats.find():
-            print(post['threadCount'], ", ", post['crawlCount'], ", ", post['executionTime'], ", ", post['time'], ", ", post['date'])
+        print("Format = 'mode', 'threadCount', 'urlsCrawled', 'executionTime', 'fetchP95', 'utilization', 'time', 'date'")
+        for post in self.stats.find({"type": "crawl"}):
+            #crawls stored before metrics were recorded have none
+            metrics = post.get('metrics', {})
+            fetchP95 = metrics.get('stages', {}).get('fetch', {}).get('p95', '-')
+            print(post.get('mode', 'threads'), ", ", post['threadCount'], ", ", post['crawlCount'], ", ", post['executionTime'], ", ", 
+                  fetchP95, ", ", metrics.get('utilization', '-'), ", ", post['time'], ", ", post['date'])
         print("---Done printing Stats---")
         
     def test(self):
@@ -7,64 +7,229 @@ url is then sent a request and a response is recieved.
 If this response has a Content-Type of "text/html" then
 no errors will be thrown and the page can have its
 links and text crawled and returned in a list. 
+
+Pages that were crawled before can be fetched with the 
+validators stored for them (ETag, Last-Modified and a hash
+of the body). The request is then conditional, and if the
+server answers 304 Not Modified or the body hashes the same,
+the page is not decoded or parsed again and its stored links
+are used instead. 
 '''
-from bs4 import BeautifulSoup
-import urllib.request
-import re
-import gzip
+from BodyDecoder import BodyDecoder
+from ConnectionPool import ConnectionPool
+from LinkTextExtractor import LinkTextExtractor
+from RetryPolicy import RetryPolicy
+from URLCanonicalizer import URLCanonicalizer
+import hashlib
+import time
+import urllib.parse
 
 class WebScraper(object):
     
-    def __init__(self, url):
+    #keep-alive connections shared by every scraper
+    pool = ConnectionPool()
+    #pages are cut off with an error past this many decoded bytes
+    #or seconds of downloading and parsing
+    MAX_PAGE_BYTES = 10 * 1024 * 1024
+    PAGE_TIME_LIMIT = 30.0
+    
+    def __init__(self, url, html=None, validators=None, encoding=None):
         '''This constructor takes in a url, creates a 
         request and gets back a response for that url. 
         This response is checked to make sure it can 
         be parsed correctly and if everything works
-        then self.error is False. 
+        then self.error is False. The body is parsed
+        while it is downloaded. 
+        
+        Args:
+            url(str): url of the page
+            html(bytes): already downloaded and decoded body of
+                the page. If given, no request is sent and the
+                html is parsed as is. 
+            validators(dict): etag, lastModified, hash and links
+                stored the last time the page was crawled, or None
+            encoding(str): charset of html, from its Content-Type
         '''
         
         self.url = url
         self.words = []
         self.links = []
+        #True if the page did not change since validators were stored
+        self.unchanged = False
+        self.validators = validators
+        #most body bytes held at once while downloading
+        self.peakBytes = 0
+        #decoded body bytes downloaded, counted by a CrawlBudget
+        self.pageBytes = 0
+        #RetryPolicy kind of the error, and the seconds the server
+        #asked to wait before trying again
+        self.errorKind = None
+        self.retryAfter = None
         
         try:
-            #Create the request
-            req = urllib.request.Request(self.url, headers = {'User-Agent': 'Mozilla/5.0'})
-            #Send the request, and get back a response
-            response = urllib.request.urlopen(req, timeout=10)
-            info = response.info()
-            #if the responses content-type is not text/html, raise exception
-            if str(info.get_content_type()) != "text/html":
-                raise Exception("URL is of Content-Type", info.get_content_type())
-            #Decode the response
-            self.html = self.decode(response)
-            #parse the text/html
-            self.soup = BeautifulSoup(self.html, "html.parser")
+            extractor = LinkTextExtractor(self.url, encoding)
+            if html is None:
+                changed, self.validators, decoder = self.fetch(self.url, validators, extractor)
+                self.peakBytes = decoder.peak
+                self.pageBytes = decoder.size
+                if not changed:
+                    #nothing to parse, the stored links are still current
+                    self.links = validators.get("links") or []
+                    self.unchanged = True
+                    self.error = False
+                    return
+            else:
+                self.pageBytes = len(html)
+                extractor.feedBytes(html)
+            #the links and the text were found in one pass over the page
+            extractor.close()
+            if self.pool.metrics is not None:
+                self.pool.metrics.record("parse", extractor.seconds)
+            self.links, self.words = extractor.links, extractor.words
             self.error = False
         except Exception as e:
             #print("Error " + str(httperror))
             self.error = True
             self.errorMessage = str(e)
+            self.errorKind = RetryPolicy.classify(e)
+            self.retryAfter = getattr(e, "retryAfter", None)
+    
+    
+    @classmethod
+    def download(cls, url):
+        '''Downloads url and returns the decoded body
+        without parsing it. Raises an exception if the
+        page is not text/html or can not be decoded. 
+        
+        Args:
+            url(str): url of the page
+        '''
+        return cls.fetch(url)[0]
+    
+    
+    @classmethod
+    def fetch(cls, url, validators=None, extractor=None):
+        '''Downloads url like download, but conditionally
+        if validators are given. Returns the decoded body, or
+        None if the page did not change, the validators of
+        the page as it is now and the BodyDecoder of the body,
+        whose charset is that of the Content-Type. 
+        
+        If an extractor is given the body is fed to it as it
+        arrives instead, and only True is returned in its place
+        if the page changed. 
+        
+        Args:
+            url(str): url of the page
+            validators(dict): etag, lastModified and hash stored
+                the last time the page was crawled, or None
+            extractor(LinkTextExtractor): parser to stream the body to
+        '''
+        headers = {'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': BodyDecoder.accepted()}
+        if validators:
+            if validators.get("etag"):
+                headers['If-None-Match'] = validators["etag"]
+            if validators.get("lastModified"):
+                headers['If-Modified-Since'] = validators["lastModified"]
+        start = time.perf_counter()
+        #Send the request on a pooled connection, and get back a response
+        with cls.pool.urlopen(url, headers, timeout=10) as response:
+            decoder = cls.decoder(response)
+            if response.status == 304 and validators:
+                #read the empty body so the connection can be reused
+                response.read()
+                current = dict(validators)
+                current["etag"] = response.getheader("ETag") or validators.get("etag")
+                cls.recordFetch(url, start, decoder, extractor)
+                return None, current, decoder
+            info = response.info()
+            #if the responses content-type is not text/html, raise exception
+            if str(info.get_content_type()) != "text/html":
+                raise Exception("URL is of Content-Type", info.get_content_type())
+            if extractor is not None and extractor.encoding is None:
+                extractor.encoding = decoder.charset
+            #Decode the response a chunk at a time
+            digest = hashlib.blake2b(digest_size=16)
+            chunks = []
+            for chunk in decoder.stream(response):
+                digest.update(chunk)
+                if extractor is not None:
+                    extractor.feedBytes(chunk)
+                else:
+                    chunks.append(chunk)
+            current = {"etag": response.getheader("ETag"),
+                       "lastModified": response.getheader("Last-Modified"),
+                       "hash": digest.hexdigest()}
+        cls.recordFetch(url, start, decoder, extractor)
+        #servers without validators still send the same bytes
+        if validators and validators.get("hash") == current["hash"]:
+            current["links"] = validators.get("links")
+            return None, current, decoder
+        if extractor is not None:
+            return True, current, decoder
+        #the joined body is held once more
+        html = b"".join(chunks)
+        decoder.peak = max(decoder.peak, 2 * len(html))
+        return html, current, decoder
+    
+    
+    @classmethod
+    def recordFetch(cls, url, start, decoder, extractor=None):
+        '''Records the download and decode time of a page,
+        and the whole fetch without parsing for its host, if 
+        the pool has metrics. 
+        
+        Args:
+            url(str): url of the page
+            start(float): time.perf_counter() before the request
+            decoder(BodyDecoder): decoder of the body
+            extractor(LinkTextExtractor): parser the body was streamed to
+        '''
+        metrics = cls.pool.metrics
+        if metrics is None:
+            return
+        seconds = time.perf_counter() - start
+        if extractor is not None:
+            seconds = seconds - extractor.seconds
+        metrics.record("download", decoder.readSeconds)
+        metrics.record("decode", decoder.decodeSeconds)
+        metrics.record("fetch", seconds, urllib.parse.urlsplit(url).hostname)
+        metrics.count("bytes", decoder.size)
     
     
-    def decode(self, response):
-        '''Decode responses from webservers. These
-        responses need to be text/html to get to this stage, 
-        and are decoded according to the the Content-Encoding
-        of the response. This method will raise an error
-        if the content-encoding is neither 'None' or 'gzip/x-zip'. 
+    @staticmethod
+    def parse(url, html, encoding=None):
+        '''Parses an already downloaded page and returns
+        a set of its links and a list of its words. This is
+        a plain function of its arguments so it can run in a
+        worker process. Raises an exception if the page can
+        not be parsed. 
         
         Args:
-            response(urllib.request.urlopen): response from a request to a server
+            url(str): url of the page
+            html(bytes): decoded body of the page
+            encoding(str): charset of the page, from its Content-Type
         '''
-        encoding = response.getheader("Content-Encoding")
-        if encoding == None:
-            html = response
-        elif encoding == 'gzip' or encoding == "x-gzip":
-            html = gzip.decompress(response.read())
-        else:
-            raise Exception("Decoding Error: Can not decode %s response" % encoding)            
-        return html
+        scraper = WebScraper(url, html, encoding=encoding)
+        if scraper.error:
+            raise Exception(scraper.getErrorMessage())
+        return set(scraper.crawlLinks()), scraper.crawlText()
+    
+    
+    @classmethod
+    def decoder(cls, response):
+        '''Returns a BodyDecoder for the body of a response
+        from a webserver, limited to MAX_PAGE_BYTES decoded
+        bytes and PAGE_TIME_LIMIT seconds. It raises an error if
+        the Content-Encoding can not be decoded. 
+        
+        Args:
+            response(http.client.HTTPResponse): response from a request to a server
+        '''
+        decoder = BodyDecoder(response.getheader("Content-Encoding"), 
+                              cls.MAX_PAGE_BYTES, cls.PAGE_TIME_LIMIT)
+        decoder.charset = response.info().get_content_charset()
+        return decoder
     
     
     def crawlLinks(self):
@@ -74,46 +239,18 @@ class WebScraper(object):
         '''
         if self.error:
             return
-        #Gets all the links and puts them into list
-        for link in self.soup.find_all('a'):
-            a = link.get('href')
-            #print(a, " --- ", a[:1])
-            if a is None:
-                pass
-            elif "http" in a:
-                self.links.append(a)
-            else:
-                holder = urllib.parse.urljoin(self.url, a)
-                self.links.append(holder.strip())
-        return self.links
+        #only http(s) links, in canonical form
+        links = (URLCanonicalizer.canonicalize(link) for link in self.links)
+        return [link for link in links if link is not None]
     
     def crawlText(self):
         '''This method gets all of the text
-        that appears in the url given and then
+        that appears in the url given, outside of
+        script and style elements, and then
         returns them in a python list.
         '''
         if self.error:
             return
-        # kill all script and style elements
-        for script in self.soup(["script", "style"]):
-            script.extract()    # rip it out
-            # get text
-            text = self.soup.get_text()
-            # break into lines and remove leading and trailing space on each
-            
-            lines = (line.strip() for line in text.splitlines())
-            # break multi-headlines into a line each
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            # drop blank lines
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            #replace all \n with spaces
-            text = text.replace("\n", " ")
-            #Remove all non-Alphanumeric chars
-            text = re.sub("[^0-9a-zA-Z ]+", "", text)
-            text = text.lower()
-            self.words = text.split()
-            #print(text)
-            #print(text.encode(encoding='utf_8'))
         return self.words
     
     def getErrorMessage(self):
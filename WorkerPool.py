@@ -0,0 +1,184 @@
+'''
+WorkerPool runs the worker threads of a threads mode crawl and
+changes how many there are while the crawl runs, instead of a
+fixed NUM_THREADS for every site.
+
+Every `interval` seconds a controller thread looks at how many
+links are waiting and how long a link has taken lately, and
+aims for enough workers to crawl the waiting links in about
+`drainTime` seconds. The target never goes below minWorkers,
+above maxWorkers, or above the number of workers the hosts with
+links can take at once, since workers beyond that would only
+wait for a host slot. The pool at most doubles or halves per
+step so one slow page does not swing it.
+
+Workers are added by starting threads and removed by asking
+them to retire after their current link, so no link is ever
+abandoned half crawled.
+'''
+import math
+import threading
+
+class WorkerPool(object):
+
+    #weight of the newest latency in the moving average
+    SMOOTHING = 0.2
+
+    def __init__(self, target, minWorkers, maxWorkers, backlog, parallelism, interval=0.5, drainTime=2.0):
+        '''
+        Args:
+            target(function): run by each worker, takes the worker id and the pool
+            minWorkers(int): fewest workers while the crawl runs
+            maxWorkers(int): most workers at once
+            backlog(function): returns the number of links waiting
+            parallelism(function): returns the most workers the hosts can
+                take at once, or None if it is not known yet
+            interval(float): seconds between resizes
+            drainTime(float): seconds the waiting links should take to crawl
+        '''
+        self.target = target
+        self.minWorkers = max(1, minWorkers)
+        self.maxWorkers = max(self.minWorkers, maxWorkers)
+        self.backlog = backlog
+        self.parallelism = parallelism
+        self.interval = interval
+        self.drainTime = drainTime
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.threads = []
+        self.live = 0
+        self.retiring = 0
+        self.retired = set()
+        self.nextId = 0
+        self.peak = 0
+        self.latency = None
+
+
+    def run(self, workers):
+        '''Starts `workers` workers and the controller and
+        returns once every worker has exited.
+
+        Args:
+            workers(int): workers to start with
+        '''
+        self.finished.clear()
+        self.threads = []
+        self.live = 0
+        self.retiring = 0
+        self.retired = set()
+        self.peak = 0
+        self.latency = None
+        self.spawn(min(max(workers, self.minWorkers), self.maxWorkers))
+        controller = threading.Thread(target=self.control, daemon=True)
+        controller.start()
+        self.join()
+        self.finished.set()
+        controller.join()
+
+
+    def join(self):
+        '''Waits for every worker, including those started
+        while waiting.
+        '''
+        joined = 0
+        while True:
+            with self.lock:
+                if joined == len(self.threads):
+                    return
+                thread = self.threads[joined]
+            thread.join()
+            joined = joined + 1
+
+
+    def spawn(self, count):
+        with self.lock:
+            for _ in range(count):
+                self.nextId = self.nextId + 1
+                thread = threading.Thread(target=self.work, args=(self.nextId,))
+                self.threads.append(thread)
+                self.live = self.live + 1
+                thread.start()
+            self.peak = max(self.peak, self.live)
+
+
+    def work(self, id):
+        try:
+            self.target(id, self)
+        finally:
+            with self.lock:
+                #retired workers were counted out in shouldRetire
+                if id in self.retired:
+                    self.retired.discard(id)
+                else:
+                    self.live = self.live - 1
+
+
+    def control(self):
+        while not self.finished.wait(self.interval):
+            self.resize()
+
+
+    def resize(self):
+        '''Moves the number of workers a step towards what
+        the backlog and latency call for.
+        '''
+        backlog = self.backlog()
+        parallelism = self.parallelism()
+        with self.lock:
+            if self.finished.is_set():
+                return
+            current = self.live - self.retiring
+            latency = self.latency if self.latency is not None else 1.0
+            wanted = int(math.ceil(backlog * latency / self.drainTime))
+            if parallelism is not None:
+                wanted = min(wanted, parallelism)
+            wanted = min(max(wanted, self.minWorkers), self.maxWorkers)
+            #at most double or halve per step
+            wanted = min(max(wanted, (current + 1) // 2), 2 * current)
+            if wanted < current:
+                self.retiring = self.retiring + current - wanted
+        if wanted > current:
+            #workers that were asked to retire and have not yet
+            #are kept instead of starting new ones
+            with self.lock:
+                kept = min(self.retiring, wanted - current)
+                self.retiring = self.retiring - kept
+            self.spawn(wanted - current - kept)
+
+
+    def shouldRetire(self, id):
+        '''Called by a worker between links. Returns True
+        if the worker should exit to shrink the pool.
+
+        Args:
+            id(int): the id the worker was started with
+        '''
+        with self.lock:
+            if self.retiring > 0 and self.live > self.minWorkers:
+                self.retiring = self.retiring - 1
+                self.live = self.live - 1
+                self.retired.add(id)
+                return True
+            return False
+
+
+    def recordLatency(self, seconds):
+        '''Adds how long a worker took for one link.'''
+        with self.lock:
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency = self.latency + self.SMOOTHING * (seconds - self.latency)
+
+
+    def finish(self):
+        '''Called by a worker that found the crawl over, so
+        no more workers are started.
+        '''
+        self.finished.set()
+
+
+    def size(self):
+        '''Returns the number of workers running.'''
+        with self.lock:
+            return self.live